@@ -0,0 +1,286 @@
+"""
+Backends de modelo: a API Gemini real e um substituto local, determinístico.
+
+Os scripts só usam `backend.generate(payload, schema)`, que recebe a mesma
+lista de partes de `generate_content` (prompt + imagens inline) e, se
+indicado, o esquema da resposta (ver structured_output.py), e devolve o
+texto da resposta. O MockBackend permite medir o pipeline sem gastar quota:
+reproduz respostas gravadas com o RecordingBackend ou responde a partir da
+verdade conhecida de uma pasta sintética (ver benchmark.py), e simula
+latência, erros 429 e JSON inválido (cortado ou com prosa à volta).
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+_FILE_NAMES_RE = re.compile(r"Os nomes de ficheiro são: (\[.*?\])")
+
+
+@dataclass
+class BackendStats:
+    """Contadores partilhados pelas threads do dispatcher."""
+    calls: int = 0
+    images: int = 0
+    bytes_uploaded: int = 0
+    quota_errors: int = 0
+    malformed_responses: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record_call(self, payload: list):
+        parts = [p for p in payload if isinstance(p, dict)]
+        with self._lock:
+            self.calls += 1
+            self.images += len(parts)
+            self.bytes_uploaded += sum(len(p["data"]) for p in parts)
+
+    def add(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+
+def payload_key(payload: list) -> str:
+    """Impressão digital de um pedido (texto e bytes das imagens, pela ordem)."""
+    h = hashlib.sha256()
+    for part in payload:
+        if isinstance(part, dict):
+            h.update(b"\x01" + part["mime_type"].encode() + b"\x00" + part["data"])
+        else:
+            h.update(b"\x02" + str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ModelBackend:
+    """
+    Interface comum: `generate(payload, schema)` devolve o texto da resposta.
+    `last_usage()` devolve os tokens da última chamada feita na thread atual.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.stats = BackendStats()
+        self._usage = threading.local()
+
+    def generate(self, payload: list, schema: dict | None = None) -> str:
+        raise NotImplementedError
+
+    def _record_usage(self, prompt_tokens: int, output_tokens: int):
+        self._usage.value = {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens}
+        self.stats.add("prompt_tokens", prompt_tokens)
+        self.stats.add("output_tokens", output_tokens)
+
+    def last_usage(self) -> dict:
+        return getattr(self._usage, "value", {})
+
+
+class GeminiBackend(ModelBackend):
+    """API Gemini real (google-generativeai, importado só aqui)."""
+    name = "gemini"
+
+    def __init__(self, model_name: str, api_key: str | None):
+        super().__init__()
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, payload: list, schema: dict | None = None) -> str:
+        self.stats.record_call(payload)
+        if schema is None:
+            response = self._model.generate_content(payload)
+        else:
+            # Saída estruturada: o modelo só pode responder com JSON neste esquema.
+            config = {"response_mime_type": "application/json", "response_schema": schema}
+            response = self._model.generate_content(payload, generation_config=config)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self._record_usage(usage.prompt_token_count or 0, usage.candidates_token_count or 0)
+        return response.text
+
+
+class RecordingBackend(ModelBackend):
+    """Passa os pedidos a outro backend e grava as respostas num JSONL, para o MockBackend."""
+    name = "recording"
+
+    def __init__(self, inner: ModelBackend, path: Path):
+        super().__init__()
+        self.inner = inner
+        self.stats = inner.stats
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def generate(self, payload: list, schema: dict | None = None) -> str:
+        text = self.inner.generate(payload, schema)
+        line = json.dumps({"key": payload_key(payload), "text": text}, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        return text
+
+    def last_usage(self) -> dict:
+        return self.inner.last_usage()
+
+
+class MockQuotaError(Exception):
+    """429 simulado (mesmo formato de mensagem que a API)."""
+
+
+class MockBackend(ModelBackend):
+    """
+    Substituto local da API. Por ordem de prioridade, a resposta vem de:
+      1. `recordings`: JSONL gravado pelo RecordingBackend (mesmo pedido);
+      2. `truth`: nome do ficheiro -> {"data": {...}, "has_text": bool};
+      3. uma resposta derivada do hash das imagens (cada pedido é um produto).
+    Os erros e a latência são tirados de um gerador aleatório com semente
+    fixa por pedido, por isso duas execuções com a mesma `seed` coincidem.
+    `low_confidence_rate` e `misread_rate` imitam um modelo mais fraco (cascata).
+    """
+    name = "mock"
+
+    def __init__(self, truth: dict | None = None, recordings: Path | None = None,
+                 latency: float = 0.0, latency_per_image: float = 0.0, jitter: float = 0.0,
+                 quota_error_rate: float = 0.0, malformed_rate: float = 0.0,
+                 low_confidence_rate: float = 0.0, misread_rate: float = 0.0,
+                 retry_seconds: float = 1.0, seed: int = 0):
+        super().__init__()
+        self.truth = truth or {}
+        self.recordings = _load_recordings(recordings) if recordings else {}
+        self.latency = latency
+        self.latency_per_image = latency_per_image
+        self.jitter = jitter
+        self.quota_error_rate = quota_error_rate
+        self.malformed_rate = malformed_rate
+        self.low_confidence_rate = low_confidence_rate
+        self.misread_rate = misread_rate
+        self.retry_seconds = retry_seconds
+        self.seed = seed
+        self._attempts = {}  # chave do pedido -> nº de vezes que foi feito
+        self._lock = threading.Lock()
+
+    def generate(self, payload: list, schema: dict | None = None) -> str:
+        key = payload_key(payload)
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        self.stats.record_call(payload)
+
+        images = sum(1 for p in payload if isinstance(p, dict))
+        delay = self.latency + self.latency_per_image * images + rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if rng.random() < self.quota_error_rate:
+            self.stats.add("quota_errors")
+            raise MockQuotaError(f"429 Resource has been exhausted (mock). Please retry in {self.retry_seconds}s.")
+
+        text = self.recordings.get(key)
+        if text is None:
+            text = json.dumps(self._answer(payload, rng), ensure_ascii=False)
+        # Contagem aproximada da API: 258 tokens por imagem, ~4 caracteres por token.
+        prompt_chars = sum(len(p) for p in payload if isinstance(p, str))
+        self._record_usage(258 * images + prompt_chars // 4, len(text) // 4)
+        if rng.random() < self.malformed_rate:
+            self.stats.add("malformed_responses")
+            if rng.random() < 0.5:
+                return "```json\n" + text[:len(text) // 2]
+            return f"Aqui está a resposta pedida:\n```json\n{text}\n```\nEspero ter ajudado."
+        return text
+
+    def _answer(self, payload: list, rng: random.Random) -> dict:
+        if any(isinstance(p, str) and p.startswith("LOTE ") for p in payload[1:]):
+            return self._answer_packed(payload, rng)
+        prompt = next((p for p in payload if isinstance(p, str)), "")
+        image_parts = [p for p in payload if isinstance(p, dict)]
+        match = _FILE_NAMES_RE.search(prompt)
+        if match is None:
+            # Prompt de imagem única do processar_oculos.py
+            data = _data_from_hash(image_parts[0]["data"]) if image_parts else None
+            return {"referencia": data["reference"] if data else None, "cor": data["color"] if data else None}
+
+        file_names = json.loads(match.group(1))
+        compare = "matched_filenames" in prompt
+        if self.truth:
+            key_name = next((n for n in file_names if self.truth.get(n, {}).get("has_text")), None)
+            data = self.truth[key_name]["data"] if key_name else None
+        else:
+            key_name = file_names[0] if file_names and image_parts else None
+            data = _data_from_hash(image_parts[0]["data"]) if key_name else None
+
+        if data is None:
+            answer = {"key_image_name": None, "data": None}
+            if compare:
+                answer["matched_filenames"] = []
+            return answer
+        raw_text = f"{data['reference']} {data['size1']}[]{data['size2']}-{data['size3']} {data['color']}"
+        if rng.random() < self.misread_rate:
+            # Leitura errada: o campo deixa de coincidir com o texto lido.
+            data = {**data, "color": data["color"] + "8"}
+        confidence = rng.uniform(0.3, 0.7) if rng.random() < self.low_confidence_rate else rng.uniform(0.85, 1.0)
+        answer = {"key_image_name": key_name, "data": data, "raw_text": raw_text, "confidence": round(confidence, 2)}
+        if compare:
+            if self.truth:
+                same = (data["reference"], data["color"])
+                answer["matched_filenames"] = [
+                    n for n in file_names
+                    if n in self.truth and (self.truth[n]["data"]["reference"], self.truth[n]["data"]["color"]) == same
+                ]
+            else:
+                answer["matched_filenames"] = list(file_names)
+        return answer
+
+    def _answer_packed(self, payload: list, rng: random.Random) -> dict:
+        """Pedido com vários lotes: cada linha "LOTE n" abre um lote. Algumas respostas vêm estragadas."""
+        segments = []
+        for part in payload[1:]:
+            if isinstance(part, str):
+                segments.append([payload[0] + "\n" + part])
+            elif segments:
+                segments[-1].append(part)
+        entries = []
+        for number, segment in enumerate(segments, 1):
+            if rng.random() < self.malformed_rate:
+                self.stats.add("malformed_responses")
+                entries.append({"batch": number})
+                continue
+            entries.append({"batch": number, **self._answer(segment, rng)})
+        return {"batches": entries}
+
+
+def _data_from_hash(data: bytes) -> dict:
+    digest = hashlib.sha256(data).hexdigest()
+    return {"reference": str(int(digest[:6], 16) % 10000).zfill(4), "size1": "54", "size2": "18",
+            "size3": "145", "color": f"C{int(digest[6:8], 16) % 9 + 1}"}
+
+
+def _load_recordings(path: Path) -> dict:
+    recordings = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["key"]] = record["text"]
+    return recordings
+
+
+def create_backend(kind: str, model_name: str, api_key: str | None = None,
+                   recordings: Path | None = None, **mock_options) -> ModelBackend:
+    """
+    'gemini' (API real), 'record' (API real, gravando as respostas em
+    `recordings`) ou 'mock' (local, reproduz `recordings` se existir).
+    """
+    if kind == "gemini":
+        return GeminiBackend(model_name, api_key)
+    if kind == "record":
+        return RecordingBackend(GeminiBackend(model_name, api_key), recordings)
+    if kind == "mock":
+        if recordings is not None and not Path(recordings).exists():
+            recordings = None
+        return MockBackend(recordings=recordings, **mock_options)
+    raise ValueError(f"Backend desconhecido: {kind}")
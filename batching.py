@@ -0,0 +1,178 @@
+"""
+Fronteiras de lote adaptativas.
+
+Os produtos têm entre 2 e 5+ fotografias, por isso janelas fixas de
+BATCH_SIZE ficam muitas vezes a meio de dois produtos. Aqui os lotes são
+cortados nas fronteiras prováveis entre produtos, usando:
+  - o intervalo entre capturas (EXIF): uma pausa longa é uma troca de produto;
+  - a sequência do nome do ficheiro (RUS_0007 → RUS_0010): um salto indica
+    fotografias em falta ou já processadas entre as duas;
+  - a semelhança visual (grouping.py).
+
+Quando um lote falha (nenhuma imagem chave), não é descartado: na primeira
+falha desliza, juntando-se ao lote seguinte (a fotografia da haste pode ter
+ficado do outro lado do corte); na segunda é dividido ao meio; só depois é
+dado como falhado.
+"""
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image
+
+from decode_pipeline import DecodedBatch
+from grouping import GroupingConfig, pairwise_distances, same_product
+from preprocess import capture_time
+
+_SEQUENCE_RE = re.compile(r"^(.*?)(\d+)$")
+_capture_times = {}  # caminho -> (mtime_ns, momento da captura), para não reabrir o EXIF a cada passagem
+
+
+@dataclass(frozen=True)
+class BatchingConfig:
+    max_batch_size: int = 5
+    time_gap_seconds: float = 20.0  # Pausa entre capturas que indica outro produto
+    use_sequence: bool = True       # Cortar em saltos na numeração dos ficheiros
+    use_visual: bool = True         # Cortar quando as imagens não parecem o mesmo produto
+    max_rewindows: int = 2          # Falhas (deslizar, dividir) antes de desistir
+
+
+def sequence_number(name: str) -> tuple[str, int] | None:
+    """(prefixo, número) de nomes como 'RUS_0007.jpg', ou None."""
+    stem = name.rsplit('.', 1)[0]
+    match = _SEQUENCE_RE.match(stem)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def is_boundary(prev, cur, config: BatchingConfig, grouping: GroupingConfig) -> bool:
+    """Há uma troca de produto entre as imagens preparadas `prev` e `cur`?"""
+    if prev.captured_at is not None and cur.captured_at is not None:
+        if abs(cur.captured_at - prev.captured_at) >= config.time_gap_seconds:
+            return True
+    if config.use_sequence:
+        a, b = sequence_number(prev.name), sequence_number(cur.name)
+        if a and b and (a[0] != b[0] or b[1] - a[1] > 1):
+            return True
+    if config.use_visual and prev.features and cur.features:
+        hash_distance, hist_distance = pairwise_distances([prev.features], [cur.features])
+        if not same_product(hash_distance, hist_distance, grouping)[0]:
+            return True
+    return False
+
+
+def _file_capture_time(path: Path) -> float | None:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _capture_times.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        with Image.open(path) as img:  # Só lê o cabeçalho (EXIF), não descodifica
+            value = capture_time(img)
+    except Exception:
+        value = None
+    _capture_times[path] = (mtime_ns, value)
+    return value
+
+
+def is_file_boundary(prev: Path, cur: Path, config: BatchingConfig) -> bool:
+    """
+    Como `is_boundary`, mas a partir dos ficheiros ainda por descodificar
+    (numeração e EXIF). Usado para cortar segmentos entre trabalhadores.
+    """
+    if config.use_sequence:
+        a, b = sequence_number(prev.name), sequence_number(cur.name)
+        if a and b and (a[0] != b[0] or b[1] - a[1] > 1):
+            return True
+    prev_time, cur_time = _file_capture_time(prev), _file_capture_time(cur)
+    return prev_time is not None and cur_time is not None and abs(cur_time - prev_time) >= config.time_gap_seconds
+
+
+class AdaptiveBatcher:
+    """
+    Forma lotes a partir de um fluxo ordenado de lotes descodificados.
+    `attempts[nome]` conta as falhas anteriores de cada ficheiro nesta sessão.
+    Os lotes são gerados noutra thread (ver dispatcher.dispatch_ordered):
+    cada passagem usa uma cópia da contagem tirada em `batches`, e as falhas
+    registadas durante a passagem só contam na seguinte.
+
+    Deslizar e dividir vêm antes do limite de tamanho: um lote que falhou
+    com max_batch_size imagens pode crescer até ao dobro para se juntar ao
+    seguinte, e as imagens que já falharam duas vezes ficam num lote só
+    delas, que `_emit` divide ao meio.
+    """
+
+    def __init__(self, config: BatchingConfig, grouping: GroupingConfig, attempts: dict):
+        self.config = config
+        self.grouping = grouping
+        self.attempts = attempts
+
+    def _cut(self, attempts: dict, window: list, cur) -> bool:
+        prev = window[-1]
+        prev_tries, cur_tries = attempts.get(prev.name, 0), attempts.get(cur.name, 0)
+        # Dividir: as imagens com duas falhas não se misturam com as outras.
+        if (prev_tries >= 2) != (cur_tries >= 2):
+            return True
+        limit = self.config.max_batch_size
+        if any(attempts.get(img.name, 0) == 1 for img in window):
+            limit *= 2
+        if len(window) >= limit:
+            return True
+        # Deslizar: um lote que já falhou uma vez junta-se ao seguinte.
+        if prev_tries == 1:
+            return False
+        return is_boundary(prev, cur, self.config, self.grouping)
+
+    def _emit(self, attempts: dict, paths, images, errors):
+        """Divide ao meio os lotes que já falharam duas vezes."""
+        retry = max((attempts.get(img.name, 0) for img in images), default=0)
+        if len(images) > 1 and all(attempts.get(img.name, 0) >= 2 for img in images):
+            half = len(images) // 2
+            first, second = images[:half], images[half:]
+            names = {img.name for img in first}
+            yield DecodedBatch(paths=[p for p in paths if p.name in names],
+                               images=first, errors={}, retry=retry)
+            yield DecodedBatch(paths=[p for p in paths if p.name not in names],
+                               images=second, errors=errors, retry=retry)
+            return
+        yield DecodedBatch(paths=paths, images=images, errors=errors, retry=retry)
+
+    def batches(self, decoded_batches):
+        """Gera os lotes adaptativos, pela ordem dos ficheiros (a contagem de falhas é copiada já)."""
+        return self._batches(decoded_batches, dict(self.attempts))
+
+    def _batches(self, decoded_batches, attempts: dict):
+        paths, images, errors = [], [], {}
+        for decoded in decoded_batches:
+            by_name = {img.name: img for img in decoded.images}
+            for path in decoded.paths:
+                if path.name in decoded.errors:
+                    # Imagens inválidas seguem no lote aberto.
+                    paths.append(path)
+                    errors[path.name] = decoded.errors[path.name]
+                    continue
+                image = by_name[path.name]
+                if images and self._cut(attempts, images, image):
+                    yield from self._emit(attempts, paths, images, errors)
+                    paths, images, errors = [], [], {}
+                paths.append(path)
+                images.append(image)
+        if paths:
+            yield from self._emit(attempts, paths, images, errors)
+
+    def record_failure(self, names: list[str]) -> list[str]:
+        """
+        Regista a falha de um lote. Devolve os nomes que esgotaram as novas
+        tentativas (a marcar como falhados); os restantes voltam a ser agrupados.
+        """
+        exhausted = []
+        for name in names:
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            if self.attempts[name] > self.config.max_rewindows:
+                exhausted.append(name)
+        return exhausted
@@ -0,0 +1,347 @@
+"""
+Benchmark do pipeline do processar_oculos2.py, sem gastar quota.
+
+Gera (ou reutiliza) uma pasta sintética de fotografias de óculos, com 2 a 5
+fotografias por produto e o texto da haste numa delas, e corre o `main()`
+do processar_oculos2 contra o MockBackend (ver backends.py), que conhece a
+verdade da pasta e simula latência, erros 429 e JSON inválido.
+
+Relatório: imagens/s, chamadas à API por produto, bytes enviados, tempo por
+etapa e produtos encontrados face aos esperados.
+
+Utilização:
+    python benchmark.py --images 1000
+    python benchmark.py --images 100000 --latency 2 --quota-rate 0.02 --malformed-rate 0.01
+    python benchmark.py --images 2000 --workers 4    # modo distribuído, 4 processos
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import random
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_FOLDER = Path("benchmark_data")
+IMAGE_SIZE = (1024, 683)
+SHOTS_PER_PRODUCT = (2, 5)
+SECONDS_BETWEEN_SHOTS = 4
+SECONDS_BETWEEN_PRODUCTS = 45
+
+
+# --- Pasta sintética ---
+
+def _draw_glasses(size: tuple, color: tuple, rng: random.Random, text: str | None) -> Image.Image:
+    """Armação simples (duas lentes, ponte, hastes) sobre fundo branco."""
+    w, h = size
+    img = Image.new("RGB", size, (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    scale = rng.uniform(0.85, 1.0)
+    cx, cy = w // 2 + rng.randint(-20, 20), h // 2 + rng.randint(-15, 15)
+    lens_w, lens_h = int(w * 0.18 * scale), int(h * 0.2 * scale)
+    thickness = max(4, w // 120)
+    for side in (-1, 1):
+        x = cx + side * int(lens_w * 0.65)
+        draw.ellipse((x - lens_w // 2, cy - lens_h // 2, x + lens_w // 2, cy + lens_h // 2),
+                     outline=color, width=thickness)
+    draw.line((cx - lens_w // 6, cy - lens_h // 4, cx + lens_w // 6, cy - lens_h // 4), fill=color, width=thickness)
+    # Haste vista de lado, por baixo da frente
+    temple_y = cy + lens_h // 2 + int(h * 0.12)
+    temple = (int(w * 0.12), temple_y - thickness * 2, int(w * 0.88), temple_y + thickness * 2)
+    draw.rectangle(temple, fill=color)
+    if text:
+        font = ImageFont.load_default(size=max(10, thickness * 3))
+        draw.text((temple[0] + int(w * 0.08), temple[1] - thickness), text, fill=(20, 20, 20), font=font)
+    return img
+
+
+def generate_folder(folder: Path, num_images: int, seed: int = 0, size: tuple = IMAGE_SIZE) -> dict:
+    """
+    Cria `num_images` fotografias em `folder` e devolve o manifesto
+    (nome -> {"data": {...}, "has_text": bool}). Uma pasta já gerada com os
+    mesmos parâmetros é reutilizada.
+    """
+    folder = Path(folder)
+    manifest_path = folder / MANIFEST_NAME
+    params = {"num_images": num_images, "seed": seed, "size": list(size)}
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("params") == params:
+            return manifest["truth"]
+        shutil.rmtree(folder)
+
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    truth = {}
+    clock = datetime(2024, 1, 1, 9, 0, 0)
+    index = 0
+    product = 0
+    while index < num_images:
+        product += 1
+        shots = min(rng.randint(*SHOTS_PER_PRODUCT), num_images - index)
+        data = {"reference": f"{product:04d}", "size1": str(rng.choice((50, 52, 54))), "size2": "18",
+                "size3": "145", "color": f"C{rng.randint(1, 9)}"}
+        color = tuple(rng.randint(0, 200) for _ in range(3))
+        text_shot = rng.randrange(shots)
+        text = f"{data['reference']} {data['size1']}[]{data['size2']}-{data['size3']} {data['color']}"
+        for shot in range(shots):
+            name = f"RUS_{index + 1:06d}.jpg"
+            img = _draw_glasses(size, color, rng, text if shot == text_shot else None)
+            exif = Image.Exif()
+            exif[306] = clock.strftime("%Y:%m:%d %H:%M:%S")
+            img.save(folder / name, "JPEG", quality=90, exif=exif)
+            truth[name] = {"data": data, "has_text": shot == text_shot}
+            index += 1
+            clock += timedelta(seconds=SECONDS_BETWEEN_SHOTS)
+        clock += timedelta(seconds=SECONDS_BETWEEN_PRODUCTS)
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"params": params, "truth": truth}, f)
+    return truth
+
+
+# --- Tempo por etapa ---
+
+class StageTimer:
+    """Acumula o tempo gasto em cada etapa (somado entre threads)."""
+
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    def wrap_call(self, stage: str, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def wrap_iter(self, stage: str, iterable):
+        """Tempo à espera de cada `next()` (inclui etapas a montante)."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+
+def run_pipeline(folder: Path, workdir: Path, backends: dict, timer: StageTimer, verbose: bool = False,
+                 worker_id: str | None = None, output: Path | None = None, profile: bool = False):
+    """
+    Corre o main() do processar_oculos2 sobre `folder`, com saídas em
+    `workdir`. Com `worker_id`, corre em modo distribuído e partilha a pasta
+    de saída `output` (e o catálogo) com os outros trabalhadores.
+    """
+    import processar_oculos2 as pipeline
+    from dispatcher import RateLimiter
+
+    if workdir.exists():
+        shutil.rmtree(workdir)
+    workdir.mkdir(parents=True)
+    pipeline.PASTA_ENTRADA = folder
+    pipeline.PASTA_SAIDA = output or workdir / "output"
+    pipeline.WORKER_ID = worker_id or pipeline.WORKER_ID
+    pipeline.CLAIMS_DIR = folder / ".claims"
+    pipeline.SHARED_DATA_FILE = pipeline.PASTA_SAIDA / "extracted_data.json"
+    pipeline.LOG_FILE = workdir / "processing_events.jsonl"
+    pipeline.DATA_FILE = workdir / "extracted_data.json"
+    pipeline.JOURNAL_FILE = workdir / "extracted_data.journal.jsonl"
+    pipeline.STATE_DB = workdir / "processing_state.sqlite"
+    pipeline.METRICS_FILE = workdir / "processing_metrics.jsonl"
+    pipeline.PROFILE_DIR = workdir / "profiles"
+    pipeline.backends = backends
+    pipeline.response_cache = None
+    # Sem limites de quota: mede-se o pipeline, não o plano da API.
+    pipeline.rate_limiters = {name: RateLimiter(name, 10 ** 9, 10 ** 12) for name in pipeline.MODEL_CASCADE}
+
+    prefetch_batches = pipeline.prefetch_batches
+    batcher_class = pipeline.AdaptiveBatcher
+
+    class TimedBatcher(batcher_class):
+        def batches(self, decoded_batches):
+            return timer.wrap_iter("lotes", super().batches(decoded_batches))
+
+    pipeline.prefetch_batches = lambda *args, **kwargs: timer.wrap_iter("descodificação", prefetch_batches(*args, **kwargs))
+    pipeline.AdaptiveBatcher = TimedBatcher
+    pipeline.process_pack = timer.wrap_call("api", pipeline.process_pack)
+    pipeline.handle_batch_result = timer.wrap_call("gravação", pipeline.handle_batch_result)
+
+    stdout = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with stdout:
+        pipeline.main(distributed=worker_id is not None, profile=profile)
+    timer.add("total", time.perf_counter() - start)
+
+    with open(pipeline.SHARED_DATA_FILE if worker_id else pipeline.DATA_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def report(truth: dict, catalogue: list, backends: dict, timer: StageTimer):
+    products = {(v["data"]["reference"], v["data"]["color"]) for v in truth.values()}
+    assigned = {}
+    for entry in catalogue:
+        for group in entry["image_files"]:
+            for name in [group["key_file"]] + group["additional_files"]:
+                assigned[name] = (entry["reference"], group["color"])
+    found = set(assigned.values())  # Cada grupo tem pelo menos a imagem chave
+    correct = sum(1 for name, ref in assigned.items()
+                  if (truth[name]["data"]["reference"], truth[name]["data"]["color"]) == ref)
+
+    totals = timer.totals
+    wall = totals["total"]
+    calls = sum(b.stats.calls for b in backends.values())
+    images = sum(b.stats.images for b in backends.values())
+    bytes_uploaded = sum(b.stats.bytes_uploaded for b in backends.values())
+    # As etapas aninhadas incluem o tempo das de montante; mostra-se o tempo próprio.
+    own = {
+        "descodificação (espera)": totals.get("descodificação", 0.0),
+        "lotes": totals.get("lotes", 0.0) - totals.get("descodificação", 0.0),
+        "api (soma das threads)": totals.get("api", 0.0),
+        "gravação": totals.get("gravação", 0.0),
+    }
+    print(f"Imagens:                {len(truth)} ({len(products)} produtos)")
+    print(f"Tempo total:            {wall:.1f}s")
+    print(f"Imagens/s:              {len(truth) / wall:.1f}")
+    print(f"Chamadas à API:         {calls} ({calls / len(products):.2f} por produto)")
+    for name, backend in backends.items():
+        print(f"  {name:<24} {backend.stats.calls:8d} chamadas, {backend.stats.quota_errors} 429, "
+              f"{backend.stats.malformed_responses} JSON inválidos")
+    print(f"Imagens enviadas:       {images}")
+    print(f"Bytes enviados:         {bytes_uploaded / 1e6:.1f} MB "
+          f"({bytes_uploaded / max(1, images) / 1024:.0f} KB por imagem)")
+    print(f"Produtos encontrados:   {len(found & products)} de {len(products)}")
+    print(f"Imagens bem atribuídas: {correct} de {len(truth)} ({len(assigned) - correct} erradas)")
+    print("Tempo por etapa:")
+    for stage, seconds in own.items():
+        print(f"  {stage:<24} {seconds:8.1f}s")
+
+
+def make_backends(args, truth: dict) -> dict:
+    """O primeiro modelo da cascata é rápido mas erra mais; os seguintes são lentos e fiáveis."""
+    from backends import MockBackend
+    from processar_oculos2 import MODEL_CASCADE
+
+    backends = {}
+    for tier, name in enumerate(MODEL_CASCADE):
+        factor = 1.0 if tier == 0 else args.slow_factor
+        backends[name] = MockBackend(
+            truth=truth, recordings=args.recordings, latency=args.latency * factor,
+            latency_per_image=args.latency_per_image * factor, jitter=args.jitter,
+            quota_error_rate=args.quota_rate, malformed_rate=args.malformed_rate,
+            low_confidence_rate=args.low_confidence_rate if tier == 0 else 0.0,
+            misread_rate=args.misread_rate if tier == 0 else 0.0,
+            retry_seconds=0, seed=args.seed + tier,
+        )
+    return backends
+
+
+def _run_worker(index: int, args, truth: dict, results):
+    """Um trabalhador do modo distribuído (processo próprio, backends próprios)."""
+    backends = make_backends(args, truth)
+    timer = StageTimer()
+    run_pipeline(args.folder / "input", args.folder / "run" / f"worker{index}", backends, timer,
+                 args.verbose, worker_id=f"worker{index}", output=args.folder / "run" / "output")
+    stats = {name: {k: getattr(b.stats, k) for k in ("calls", "images", "bytes_uploaded", "quota_errors",
+                                                     "malformed_responses")}
+             for name, b in backends.items()}
+    results.put((index, stats, timer.totals))
+
+
+def run_workers(args, truth: dict) -> tuple[list, dict, StageTimer]:
+    """Corre `args.workers` processos sobre a mesma pasta e junta as estatísticas."""
+    from backends import BackendStats
+
+    run_dir = args.folder / "run"
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+    shutil.rmtree(args.folder / "input" / ".claims", ignore_errors=True)
+    (run_dir / "output").mkdir(parents=True)
+
+    results = multiprocessing.Queue()
+    start = time.perf_counter()
+    processes = [multiprocessing.Process(target=_run_worker, args=(i, args, truth, results))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    timer = StageTimer()
+    backends = {}
+    for index, stats, totals in sorted(collected):
+        calls = sum(s["calls"] for s in stats.values())
+        print(f"  worker{index}: {calls} chamadas em {totals['total']:.1f}s")
+        for stage, seconds in totals.items():
+            if stage != "total":
+                timer.add(stage, seconds)
+        for name, values in stats.items():
+            merged = backends.setdefault(name, argparse.Namespace(stats=BackendStats())).stats
+            for key, value in values.items():
+                merged.add(key, value)
+    timer.add("total", time.perf_counter() - start)
+    with open(run_dir / "output" / "extracted_data.json", 'r', encoding='utf-8') as f:
+        return json.load(f), backends, timer
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline com o backend simulado.")
+    parser.add_argument("--images", type=int, default=1000, help="Nº de imagens sintéticas (1k a 100k)")
+    parser.add_argument("--folder", type=Path, default=DEFAULT_FOLDER, help="Pasta das imagens sintéticas")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência base por chamada (s)")
+    parser.add_argument("--latency-per-image", type=float, default=0.0, help="Latência extra por imagem (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação aleatória da latência (s)")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="Fração de chamadas com 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fração de respostas com JSON inválido")
+    parser.add_argument("--low-confidence-rate", type=float, default=0.1,
+                        help="Fração de respostas com confiança baixa no primeiro modelo da cascata")
+    parser.add_argument("--misread-rate", type=float, default=0.05,
+                        help="Fração de leituras erradas no primeiro modelo da cascata")
+    parser.add_argument("--slow-factor", type=float, default=3.0,
+                        help="Latência dos modelos seguintes da cascata face ao primeiro")
+    parser.add_argument("--recordings", type=Path, default=None, help="Respostas gravadas a reproduzir (JSONL)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Trabalhadores em processos separados (modo distribuído, ver claims.py)")
+    parser.add_argument("--profile", action="store_true", help="Perfis cProfile das etapas (com --verbose)")
+    parser.add_argument("--verbose", action="store_true", help="Mostra a saída do pipeline")
+    args = parser.parse_args(argv)
+
+    print(f"A preparar {args.images} imagens em {args.folder}...")
+    start = time.perf_counter()
+    truth = generate_folder(args.folder / "input", args.images, args.seed)
+    print(f"Pasta pronta em {time.perf_counter() - start:.1f}s.\n")
+
+    if args.workers > 1:
+        catalogue, backends, timer = run_workers(args, truth)
+        report(truth, catalogue, backends, timer)
+        return
+
+    backends = make_backends(args, truth)
+    timer = StageTimer()
+    catalogue = run_pipeline(args.folder / "input", args.folder / "run", backends, timer, args.verbose,
+                             profile=args.profile)
+    report(truth, catalogue, backends, timer)
+
+
+if __name__ == "__main__":
+    main()
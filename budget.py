@@ -0,0 +1,340 @@
+"""
+Orçamento de tokens e custo de uma execução.
+
+A estimativa de tokens de cada imagem segue a regra da API Gemini: até
+384x384 px uma imagem vale 258 tokens; acima disso é dividida em blocos
+(lado = menor dimensão / 1.5, entre 256 e 768 px) de 258 tokens cada. As
+dimensões usadas são as da imagem já reduzida (durante a execução, as do
+PreparedImage; na projeção, as do cabeçalho reduzidas a PreprocessConfig.long_edge).
+
+`Budget` guarda o consumo de cada modelo por dia na base de estado (pedidos,
+tokens, custo) e, antes de cada chamada, reserva-a e verifica o orçamento da execução, o
+orçamento diário e o limite diário de pedidos do modelo (`rpd` em
+dispatcher.MODEL_QUOTAS). Em vez de gastar pedidos que dariam 429, a
+chamada não é feita (BudgetExceededError, com o momento em que o limite
+volta a ter margem) e a cascata fica pelo modelo mais barato.
+
+`plan_run` projeta chamadas, tokens, custo e duração para uma lista de
+ficheiros (usado pelo --dry-run do processar_oculos2).
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dispatcher import DEFAULT_QUOTA, MODEL_QUOTAS, QuotaExhaustedError
+
+# Preço por milhão de tokens (entrada, saída), em USD. Ajuste à tabela em vigor.
+MODEL_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+DEFAULT_PRICE = (1.25, 10.00)
+
+TOKENS_PER_PROMPT_ESTIMATE = 600  # Texto do prompt de um pedido (estimativa)
+OUTPUT_TOKENS_PER_BATCH = 150  # Resposta JSON de um lote (estimativa)
+MODEL_LATENCY_SECONDS = {"gemini-2.5-flash": 4.0, "gemini-2.5-pro": 12.0}  # Para a projeção de duração
+ESCALATION_RATE = 0.15         # Fração de lotes que sobe na cascata (validação / confiança)
+FALLBACK_RATE = 0.2            # Fração de grupos em que as candidatas não chegam (resto do grupo enviado)
+
+_image_sizes = {}  # caminho -> (mtime_ns, dimensões), para não reabrir o cabeçalho a cada projeção
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS api_usage (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (day, model)
+);
+"""
+
+
+class BudgetExceededError(QuotaExhaustedError):
+    """O orçamento ou o limite diário não permite a chamada. `retry_at`: quando volta a haver margem."""
+
+    def __init__(self, message: str, retry_at: float | None = None):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+# --- Estimativas ---
+
+def image_tokens(width: int, height: int) -> int:
+    """Tokens de entrada de uma imagem com estas dimensões."""
+    if width <= 384 and height <= 384:
+        return 258
+    unit = min(768, max(256, int(min(width, height) / 1.5)))
+    return 258 * math.ceil(width / unit) * math.ceil(height / unit)
+
+
+def fitted_size(size: tuple, long_edge: int) -> tuple:
+    """Dimensões depois da redução ao lado maior `long_edge` (sem o recorte, que só reduz)."""
+    width, height = size
+    if max(size) <= long_edge:
+        return size
+    scale = long_edge / max(size)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def request_tokens(sizes: list[tuple]) -> int:
+    """Tokens de entrada de um pedido com imagens destas dimensões."""
+    return TOKENS_PER_PROMPT_ESTIMATE + sum(image_tokens(w, h) for w, h in sizes)
+
+
+def cost(model_name: str, prompt_tokens: int, output_tokens: int) -> float:
+    price_in, price_out = MODEL_PRICES.get(model_name, DEFAULT_PRICE)
+    return (prompt_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+
+def _next_midnight(now: float) -> float:
+    tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+
+# --- Orçamento durante a execução ---
+
+class Budget:
+    """
+    Consumo por modelo e por dia, persistido, com limites por execução e por
+    dia. As chamadas em voo contam como reservadas, para que várias threads
+    não passem o limite ao mesmo tempo.
+    """
+
+    def __init__(self, db_path: Path, run_budget: float | None = None, daily_budget: float | None = None,
+                 quotas: dict = MODEL_QUOTAS):
+        self.run_budget = run_budget
+        self.daily_budget = daily_budget
+        self.quotas = quotas
+        self.run_cost = 0.0
+        self.run_requests = {}  # modelo -> pedidos nesta execução
+        self._reserved_cost = 0.0
+        self._reserved_requests = {}  # modelo -> pedidos em voo
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def _today() -> str:
+        return time.strftime("%Y-%m-%d")
+
+    def _usage_today(self, model_name: str | None = None) -> tuple[int, float]:
+        query = "SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(cost), 0) FROM api_usage WHERE day = ?"
+        params = [self._today()]
+        if model_name:
+            query += " AND model = ?"
+            params.append(model_name)
+        return self._conn.execute(query, params).fetchone()
+
+    def today(self, model_name: str | None = None) -> tuple[int, float]:
+        """(pedidos, custo) de hoje, de um modelo ou de todos (inclui outras execuções)."""
+        with self._lock:
+            return self._usage_today(model_name)
+
+    def remaining(self) -> float | None:
+        """Margem de custo (a menor entre a da execução e a do dia), ou None sem limites."""
+        limits = []
+        with self._lock:
+            if self.run_budget is not None:
+                limits.append(self.run_budget - self.run_cost - self._reserved_cost)
+            if self.daily_budget is not None:
+                limits.append(self.daily_budget - self._usage_today()[1] - self._reserved_cost)
+        return min(limits) if limits else None
+
+    def _check(self, model_name: str, expected: float):
+        now = time.time()
+        rpd = self.quotas.get(model_name, DEFAULT_QUOTA).get("rpd")
+        if rpd is not None and self._usage_today(model_name)[0] + self._reserved_requests.get(model_name, 0) >= rpd:
+            raise BudgetExceededError(f"Limite diário de {rpd} pedidos de {model_name} atingido",
+                                      _next_midnight(now))
+        if self.run_budget is not None and self.run_cost + self._reserved_cost + expected > self.run_budget:
+            # O orçamento da execução só volta com uma nova execução.
+            raise BudgetExceededError(f"Orçamento da execução (${self.run_budget:.2f}) esgotado", None)
+        if self.daily_budget is not None and self._usage_today()[1] + self._reserved_cost + expected > self.daily_budget:
+            raise BudgetExceededError(f"Orçamento diário (${self.daily_budget:.2f}) esgotado",
+                                      _next_midnight(now))
+
+    def check(self, model_name: str, estimated_tokens: int):
+        """Lança BudgetExceededError se a chamada não couber nos limites (sem reservar)."""
+        with self._lock:
+            self._check(model_name, cost(model_name, estimated_tokens, OUTPUT_TOKENS_PER_BATCH))
+
+    def reserve(self, model_name: str, estimated_tokens: int) -> float:
+        """
+        Reserva uma chamada antes de a fazer; lança BudgetExceededError se
+        passar um dos limites. Devolve o custo reservado, a passar a
+        `record` (ou a `release`, se a chamada não chegar a ser feita).
+        """
+        expected = cost(model_name, estimated_tokens, OUTPUT_TOKENS_PER_BATCH)
+        with self._lock:
+            self._check(model_name, expected)
+            self._reserved_cost += expected
+            self._reserved_requests[model_name] = self._reserved_requests.get(model_name, 0) + 1
+        return expected
+
+    def release(self, model_name: str, reserved: float):
+        with self._lock:
+            self._reserved_cost -= reserved
+            self._reserved_requests[model_name] -= 1
+
+    def record(self, model_name: str, prompt_tokens: int, output_tokens: int, reserved: float | None = None):
+        """Soma uma chamada feita ao consumo de hoje (e liberta a reserva, se houver)."""
+        spent = cost(model_name, prompt_tokens, output_tokens)
+        with self._lock:
+            if reserved is not None:
+                self._reserved_cost -= reserved
+                self._reserved_requests[model_name] -= 1
+            self.run_cost += spent
+            self.run_requests[model_name] = self.run_requests.get(model_name, 0) + 1
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO api_usage VALUES (?, ?, 1, ?, ?, ?) ON CONFLICT(day, model) DO UPDATE SET "
+                    "requests = requests + 1, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                    "output_tokens = output_tokens + excluded.output_tokens, cost = cost + excluded.cost",
+                    (self._today(), model_name, prompt_tokens, output_tokens, spent),
+                )
+
+
+# --- Projeção (dry-run) ---
+
+@dataclass
+class Plan:
+    files: int = 0
+    images_sent: float = 0.0
+    batches: int = 0
+    calls: dict = field(default_factory=dict)       # modelo -> pedidos
+    tokens: dict = field(default_factory=dict)      # modelo -> (entrada, saída)
+    cost: float = 0.0
+    duration_seconds: float = 0.0
+    file_costs: list = field(default_factory=list)  # custo estimado de cada ficheiro, pela ordem
+
+    def affordable(self, remaining: float | None) -> int:
+        """Quantos ficheiros (do início da lista) cabem em `remaining`."""
+        if remaining is None:
+            return self.files
+        total = 0.0
+        for count, file_cost in enumerate(self.file_costs):
+            total += file_cost
+            if total > remaining:
+                return count
+        return self.files
+
+
+def _image_size(path: Path) -> tuple | None:
+    from PIL import Image  # Só na projeção: o `status` do oculos.py não precisa do Pillow
+
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _image_sizes.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        with Image.open(path) as img:  # Só o cabeçalho
+            size = img.size
+    except Exception:
+        size = None
+    _image_sizes[path] = (mtime_ns, size)
+    return size
+
+
+def plan_run(files: list[Path], models: list[str], long_edge: int, max_batch_size: int, pack_size: int,
+             max_in_flight: int, is_boundary=None, candidates_per_group: int | None = None,
+             detail_long_edge: int = 0, detail_box: tuple | None = None) -> Plan:
+    """
+    Projeta o custo de processar `files`. Os lotes são estimados com
+    `is_boundary(anterior, atual)` (numeração e EXIF) e `max_batch_size`.
+    Com `candidates_per_group`, cada grupo envia primeiro só as candidatas
+    (agrupamento local) e o resto em FALLBACK_RATE dos casos. Assume que uma
+    fração ESCALATION_RATE dos lotes sobe para cada modelo seguinte da cascata.
+    Com `detail_long_edge` e `detail_box`, conta também esse recorte (frações
+    da imagem) de cada imagem. As dimensões e as fronteiras (ver
+    batching.is_file_boundary) ficam em cache por ficheiro: com orçamento, a
+    projeção é refeita em cada passagem sem voltar a abrir os ficheiros.
+    """
+    plan = Plan(files=len(files))
+    batches = []  # lista de listas de tokens por imagem
+    previous = None
+    for path in files:
+        size = _image_size(path)
+        tokens = image_tokens(*fitted_size(size, long_edge)) if size else 0
+        if detail_long_edge and detail_box is not None and size:
+            left, top, right, bottom = detail_box
+            crop = (max(1, round(size[0] * (right - left))), max(1, round(size[1] * (bottom - top))))
+            tokens += image_tokens(*fitted_size(crop, detail_long_edge))
+        new_batch = (not batches or len(batches[-1]) >= max_batch_size
+                     or (is_boundary is not None and is_boundary(previous, path)))
+        if new_batch:
+            batches.append([])
+        batches[-1].append(tokens)
+        previous = path
+    plan.batches = len(batches)
+    starts = [0]
+    for batch in batches:
+        starts.append(starts[-1] + len(batch))
+    plan.file_costs = [0.0] * len(files)
+
+    share = 1.0  # Fração dos lotes que chega a este modelo
+    for model_name in models:
+        prompt_tokens = output_tokens = 0.0
+        for batch, start in zip(batches, starts):
+            if candidates_per_group:
+                first = min(candidates_per_group, len(batch))
+                sent = first + FALLBACK_RATE * (len(batch) - first)
+            else:
+                sent = len(batch)
+            per_image = sum(batch) / len(batch)
+            batch_prompt = share * (TOKENS_PER_PROMPT_ESTIMATE / pack_size + sent * per_image)
+            batch_output = share * OUTPUT_TOKENS_PER_BATCH
+            prompt_tokens += batch_prompt
+            output_tokens += batch_output
+            plan.images_sent += share * sent
+            # Custo do lote repartido pelos seus ficheiros (para cortar a lista ao orçamento).
+            batch_cost = cost(model_name, batch_prompt, batch_output)
+            for i in range(start, start + len(batch)):
+                plan.file_costs[i] += batch_cost / len(batch)
+        calls = math.ceil(share * len(batches) / pack_size)
+        plan.calls[model_name] = calls
+        plan.tokens[model_name] = (round(prompt_tokens), round(output_tokens))
+        plan.cost += cost(model_name, prompt_tokens, output_tokens)
+
+        quota = MODEL_QUOTAS.get(model_name, DEFAULT_QUOTA)
+        by_rpm = calls / quota["rpm"] * 60
+        by_tpm = prompt_tokens / quota["tpm"] * 60
+        by_latency = calls * MODEL_LATENCY_SECONDS.get(model_name, 8.0) / max_in_flight
+        plan.duration_seconds += max(by_rpm, by_tpm, by_latency)
+        share *= ESCALATION_RATE
+    return plan
+
+
+def print_plan(plan: Plan, budget: Budget | None = None):
+    print(f"Ficheiros:          {plan.files}")
+    print(f"Lotes estimados:    {plan.batches}")
+    print(f"Imagens enviadas:   {plan.images_sent:.0f}")
+    for model_name, calls in plan.calls.items():
+        prompt_tokens, output_tokens = plan.tokens[model_name]
+        quota = MODEL_QUOTAS.get(model_name, DEFAULT_QUOTA)
+        rpd = f" (limite diário {quota['rpd']})" if quota.get("rpd") else ""
+        print(f"  {model_name:<20} {calls:6d} pedidos{rpd}, {prompt_tokens:,} tokens de entrada, "
+              f"{output_tokens:,} de saída")
+    print(f"Custo estimado:     ${plan.cost:.2f}")
+    print(f"Duração estimada:   {timedelta(seconds=round(plan.duration_seconds))}")
+    if budget is not None:
+        requests_today, cost_today = budget.today()
+        print(f"Gasto hoje:         ${cost_today:.2f} em {requests_today} pedidos")
+        remaining = budget.remaining()
+        if remaining is not None:
+            fits = plan.affordable(remaining)
+            print(f"Margem:             ${remaining:.2f} -> {fits} de {plan.files} ficheiros cabem no orçamento")
@@ -0,0 +1,277 @@
+"""
+Catálogo em JSON com journal de escrita antecipada (write-ahead).
+
+Cada lote guardado é acrescentado como uma linha JSON ao journal e
+sincronizado em disco (fsync) antes de se considerar gravado: a escrita por
+lote é O(1) e sobrevive a uma falha a meio. Em memória, o catálogo é
+indexado por referência e por (referência, cor). A compactação reescreve o
+`extracted_data.json` no formato aninhado de forma atómica (ficheiro
+temporário + rename) e só depois esvazia o journal.
+
+Os registos são "upserts" idempotentes: um segundo lote da mesma
+(referência, cor) junta os seus ficheiros aos que já lá estão (ver
+state_store.merge_files), por isso reaplicar o journal sobre um JSON já
+compactado (falha entre o rename e o esvaziamento) não duplica nada.
+
+Com `shared=True` (vários trabalhadores, ver claims.py) cada trabalhador
+escreve o seu próprio journal (`extracted_data.<trabalhador>.journal.jsonl`)
+ao lado do JSON. A leitura junta o JSON e os journals de todos, com os
+registos pela ordem em que foram escritos (campo "ts"), seja qual for o
+nome do trabalhador; a compactação é feita com um ficheiro de bloqueio e
+relê o JSON e os journals do disco antes de escrever, por isso nenhum
+trabalhador apaga os registos de outro. Cada um só esvazia o seu journal.
+O journal de uma execução anterior sem trabalhadores é juntado ao JSON uma
+só vez, com o bloqueio, e depois apagado.
+"""
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from claims import StalenessTracker
+from state_store import merge_files
+
+COMPACT_EVERY = 500 # Registos no journal antes de uma compactação automática
+LOCK_STALE_SECONDS = 60 # Bloqueio de compactação inalterado durante este tempo = dono morreu
+
+
+class CatalogCorruptError(Exception):
+    """O JSON compactado não pôde ser lido; não é tratado como catálogo vazio."""
+
+
+class CatalogJournal:
+    """Catálogo aninhado (referência → image_files) com journal JSONL."""
+
+    def __init__(self, json_path: Path, journal_path: Path | None = None,
+                 compact_every: int = COMPACT_EVERY, shared: bool = False):
+        self.json_path = Path(json_path)
+        self.journal_path = Path(journal_path) if journal_path else self.json_path.with_suffix(".journal.jsonl")
+        self.compact_every = compact_every
+        self.shared = shared
+        self._refs = {}    # referência -> entrada (ordem de inserção preservada)
+        self._groups = {}  # (referência, cor) -> grupo de ficheiros
+        self._pending = 0  # registos no journal desde a última compactação
+        if shared:
+            self._fold_legacy_journal()
+        self._load()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    # --- Leitura ---
+
+    def _load_json(self):
+        if not self.json_path.exists():
+            return
+        try:
+            with open(self.json_path, 'r', encoding='utf-8') as f:
+                data_list = json.load(f)
+        except json.JSONDecodeError as e:
+            raise CatalogCorruptError(f"{self.json_path} está corrompido: {e}") from e
+        for entry in data_list:
+            sizes = {k: entry.get(k) for k in ('size1', 'size2', 'size3')}
+            for group in entry.get('image_files', []):
+                self._apply(entry['reference'], sizes, group['color'], group.get('key_file'),
+                            group.get('additional_files', []))
+            # Referências sem cores também são preservadas
+            self._refs.setdefault(entry['reference'], {"reference": entry['reference'], **sizes, "image_files": []})
+
+    def _load(self):
+        self._load_json()
+        records = []
+        if self.shared:
+            # Journals dos outros trabalhadores: só leitura (podem estar a meio de uma escrita).
+            for path in self.json_path.parent.glob(f"{self.json_path.stem}.*.journal.jsonl"):
+                if path.resolve() != self.journal_path.resolve():
+                    records += self._read_journal(path, own=False)
+        if self.journal_path.exists():
+            records += self._read_journal(self.journal_path, own=True)
+        if self.shared:
+            # Pela ordem de escrita entre trabalhadores (registos antigos, sem "ts", primeiro).
+            records.sort(key=lambda record: record.get("ts", 0))
+        for record in records:
+            self._apply_record(record)
+
+    def _fold_legacy_journal(self):
+        """
+        Modo partilhado: junta ao JSON, com o bloqueio, o journal de uma
+        execução anterior sem trabalhadores e apaga-o, para não ser
+        reaplicado por todos os trabalhadores em todas as leituras.
+        """
+        legacy = self.json_path.with_suffix(".journal.jsonl")
+        if legacy.resolve() == self.journal_path.resolve() or not legacy.exists():
+            return
+        lock_path, token = self._acquire_lock()
+        try:
+            if not legacy.exists():
+                return  # Outro trabalhador já o juntou
+            # O JSON, depois o journal antigo (mais recente que o JSON, mais antigo que os dos trabalhadores).
+            self._load_json()
+            for record in self._read_journal(legacy, own=False):
+                self._apply_record(record)
+            self._write_json()
+            legacy.unlink()
+            _fsync_dir(self.json_path.parent)
+        finally:
+            self._release_lock(lock_path, token)
+            self._refs, self._groups = {}, {}
+
+    def _read_journal(self, path: Path, own: bool) -> list:
+        try:
+            with open(path, 'rb') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []  # Journal de outro trabalhador apagado entretanto (já compactado)
+        records = []
+        valid_bytes = 0
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                if number == len(lines):
+                    if own:
+                        # Última linha incompleta: a escrita foi interrompida antes do fsync.
+                        # É cortada para que os próximos registos não fiquem colados a ela.
+                        print(f"Aviso: Última linha do journal incompleta ignorada ({path}).")
+                        with open(path, 'r+b') as f:
+                            f.truncate(valid_bytes)
+                    break
+                raise CatalogCorruptError(f"{path}: linha {number} inválida")
+            records.append(record)
+            if own:
+                self._pending += 1
+            valid_bytes += len(line)
+        return records
+
+    def _apply(self, reference: str, sizes: dict, color: str, key_file: str, additional_files: list):
+        entry = self._refs.get(reference)
+        if entry is None:
+            entry = {"reference": reference, **sizes, "image_files": []}
+            self._refs[reference] = entry
+        group = self._groups.get((reference, color))
+        if group is None:
+            group = {"color": color, "key_file": key_file, "additional_files": list(additional_files)}
+            entry["image_files"].append(group)
+            self._groups[(reference, color)] = group
+        else:
+            # A cor já existe (produto dividido em vários lotes): junta os ficheiros.
+            group["key_file"], group["additional_files"] = merge_files(
+                group["key_file"], group["additional_files"], key_file, additional_files)
+
+    def _apply_record(self, record: dict):
+        sizes = {k: record.get(k) for k in ('size1', 'size2', 'size3')}
+        self._apply(record['reference'], sizes, record['color'], record['key_file'], record['additional_files'])
+
+    def entries(self) -> list:
+        """Catálogo no formato aninhado de `extracted_data.json`."""
+        return list(self._refs.values())
+
+    def get(self, reference: str, color: str) -> dict | None:
+        return self._groups.get((reference, color))
+
+    # --- Escrita ---
+
+    def append(self, new_data: dict, key_file: str, additional_files: list):
+        """Grava um lote no journal (com fsync) e atualiza o índice em memória."""
+        record = {
+            "ts": time.time(),
+            "reference": new_data['reference'],
+            "size1": new_data.get('size1'),
+            "size2": new_data.get('size2'),
+            "size3": new_data.get('size3'),
+            "color": new_data['color'],
+            "key_file": key_file,
+            "additional_files": list(additional_files),
+        }
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._apply_record(record)
+        self._pending += 1
+        if self._pending >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Reescreve o JSON aninhado de forma atómica e esvazia o journal."""
+        if not self.shared:
+            self._write_compacted()
+            return
+        lock_path, token = self._acquire_lock()
+        try:
+            # Relê o que os outros trabalhadores compactaram ou escreveram entretanto.
+            self._refs, self._groups, self._pending = {}, {}, 0
+            self._load()
+            self._write_compacted()
+        finally:
+            self._release_lock(lock_path, token)
+
+    def _release_lock(self, lock_path: Path, token: str):
+        # Não apaga o bloqueio de outro, caso o nosso tenha sido dado como abandonado.
+        try:
+            if lock_path.read_text(encoding='utf-8') == token:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    def _acquire_lock(self) -> tuple[Path, str]:
+        """Bloqueio exclusivo da compactação partilhada (ficheiro criado com O_EXCL)."""
+        lock_path = self.json_path.with_name(self.json_path.name + ".lock")
+        token = uuid.uuid4().hex
+        tracker = StalenessTracker()
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    holder = lock_path.read_text(encoding='utf-8')
+                except FileNotFoundError:
+                    continue
+                if tracker.unchanged_for(lock_path.name, holder) >= LOCK_STALE_SECONDS:
+                    # Quem tinha o bloqueio morreu a meio: o rename só tem sucesso para um.
+                    stale_path = lock_path.with_name(f"{lock_path.name}.{token}.stale")
+                    try:
+                        os.rename(lock_path, stale_path)
+                        os.remove(stale_path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                time.sleep(0.1)
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(token)
+            return lock_path, token
+
+    def _write_json(self):
+        """Escreve o JSON aninhado de forma atómica (temporário + rename)."""
+        tmp_path = self.json_path.with_name(f"{self.json_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries(), f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.json_path)
+        _fsync_dir(self.json_path.parent)
+
+    def _write_compacted(self):
+        self._write_json()
+        self._journal.truncate(0)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._pending = 0
+
+    def close(self):
+        if self._pending:
+            self.compact()
+        self._journal.close()
+        if self.shared and self.journal_path.stat().st_size == 0:
+            # Journals partilhados vazios não ficam a acumular na pasta de saída.
+            self.journal_path.unlink()
+
+
+def _fsync_dir(directory: Path):
+    """Garante que o rename fica em disco (não suportado no Windows)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(str(directory or '.'), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,215 @@
+"""
+Consultas e exportação do catálogo a partir da base de estado (state_store.py).
+
+Em vez de ler o `extracted_data.json` inteiro e percorrer referência ->
+image_files -> cor à mão, as consultas usam os índices da base (ficheiro,
+referência, cor e o trio de tamanhos):
+
+    python catalog_query.py file IMG_0001.jpg        # referência e cor de um ficheiro
+    python catalog_query.py ref 1234 [--color C1]    # imagens de uma referência
+    python catalog_query.py color C1                 # referências com esta cor
+    python catalog_query.py sizes 52 18 140          # referências com estes tamanhos
+    python catalog_query.py export catalogo.csv [--format csv|jsonl|parquet]
+
+A exportação é uma linha por imagem (ver EXPORT_COLUMNS), lida da base com
+um cursor e escrita à medida: a memória usada não depende do tamanho do
+catálogo. O Parquet precisa do pacote opcional `pyarrow` e é escrito em
+blocos de PARQUET_ROW_GROUP linhas.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+from state_store import STATE_DB, StateStore
+
+EXPORT_COLUMNS = ("reference", "size1", "size2", "size3", "color", "filename", "role", "position")
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+PARQUET_ROW_GROUP = 50_000
+
+
+class CatalogQuery:
+    """Consultas só de leitura ao catálogo (podem correr durante o processamento)."""
+
+    def __init__(self, path: Path = STATE_DB):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"A base de estado '{self.path}' não existe.")
+        StateStore(self.path).close()  # Cria os índices que faltem numa base antiga
+        self._conn = sqlite3.connect(self.path.resolve().as_uri() + "?mode=ro", uri=True)
+
+    def close(self):
+        self._conn.close()
+
+    def file(self, filename: str) -> dict | None:
+        """Referência, cor, tamanhos e papel ("key" ou "additional") de um ficheiro processado."""
+        row = self._conn.execute(
+            "SELECT f.reference, f.color, f.role, r.size1, r.size2, r.size3 "
+            "FROM files f JOIN refs r ON r.reference = f.reference WHERE f.filename = ?",
+            (filename,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("reference", "color", "role", "size1", "size2", "size3"), row))
+
+    def images(self, reference: str, color: str | None = None) -> dict:
+        """Cor -> ficheiros (a imagem chave primeiro) de uma referência."""
+        query = "SELECT color, key_file, additional_files FROM colors WHERE reference = ?"
+        params = [reference]
+        if color is not None:
+            query += " AND color = ?"
+            params.append(color)
+        rows = self._conn.execute(query + " ORDER BY position", params)
+        return {color: [key_file] + json.loads(additional) for color, key_file, additional in rows}
+
+    def references_with_color(self, color: str) -> list[str]:
+        rows = self._conn.execute("SELECT reference FROM colors WHERE color = ? ORDER BY reference", (color,))
+        return [row[0] for row in rows]
+
+    def references_with_sizes(self, size1, size2, size3) -> list[str]:
+        rows = self._conn.execute(
+            "SELECT reference FROM refs WHERE size1 = ? AND size2 = ? AND size3 = ? ORDER BY position",
+            (str(size1), str(size2), str(size3)),
+        )
+        return [row[0] for row in rows]
+
+    def iter_rows(self):
+        """Uma linha (tuplo com EXPORT_COLUMNS) por imagem, pela ordem do catálogo, sem carregar tudo."""
+        # CROSS JOIN fixa a ordem do ciclo (refs por fora, pelo índice da posição): o SQLite só
+        # ordena as cores de cada referência, em vez de juntar e ordenar o catálogo inteiro.
+        cursor = self._conn.execute(
+            "SELECT r.reference, r.size1, r.size2, r.size3, c.color, c.key_file, c.additional_files "
+            "FROM refs r CROSS JOIN colors c ON c.reference = r.reference ORDER BY r.position, c.position"
+        )
+        for reference, size1, size2, size3, color, key_file, additional in cursor:
+            yield (reference, size1, size2, size3, color, key_file, "key", 0)
+            for position, filename in enumerate(json.loads(additional), 1):
+                yield (reference, size1, size2, size3, color, filename, "additional", position)
+
+
+# --- Exportação ---
+
+def _write_csv(rows, f):
+    writer = csv.writer(f)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+
+
+def _write_jsonl(rows, f):
+    for row in rows:
+        f.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+
+
+def _write_parquet(rows, path: Path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("A exportação para Parquet precisa do pacote opcional 'pyarrow' (pip install pyarrow).")
+    schema = pa.schema([(name, pa.int32() if name == "position" else pa.string()) for name in EXPORT_COLUMNS])
+
+    def write(writer, block):
+        writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, row)) for row in block], schema))
+
+    with pq.ParquetWriter(str(path), schema) as writer:
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) >= PARQUET_ROW_GROUP:
+                write(writer, block)
+                block = []
+        if block:
+            write(writer, block)
+
+
+def export_rows(query: CatalogQuery, destination: Path, fmt: str | None = None) -> int:
+    """
+    Escreve o catálogo em `destination` (formato pela extensão, se `fmt`
+    não for indicado). Escrita atómica: ficheiro temporário + rename.
+    Devolve o nº de linhas.
+    """
+    destination = Path(destination)
+    fmt = fmt or destination.suffix.lstrip(".").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato desconhecido: '{fmt}' (use um de {EXPORT_FORMATS})")
+    tmp_path = destination.with_name(destination.name + ".tmp")
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in query.iter_rows():
+            count += 1
+            yield row
+
+    try:
+        if fmt == "parquet":
+            _write_parquet(counted(), tmp_path)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                (_write_csv if fmt == "csv" else _write_jsonl)(counted(), f)
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, destination)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas e exportação do catálogo.")
+    parser.add_argument("--db", type=Path, default=STATE_DB, help="Base de estado")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("file", help="Referência e cor de um ficheiro").add_argument("filename")
+    ref_parser = commands.add_parser("ref", help="Imagens de uma referência")
+    ref_parser.add_argument("reference")
+    ref_parser.add_argument("--color")
+    commands.add_parser("color", help="Referências com esta cor").add_argument("color")
+    sizes_parser = commands.add_parser("sizes", help="Referências com estes tamanhos")
+    sizes_parser.add_argument("sizes", nargs=3)
+    export_parser = commands.add_parser("export", help="Uma linha por imagem (CSV, JSONL ou Parquet)")
+    export_parser.add_argument("destination", type=Path)
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, help="Por omissão, a extensão do destino")
+    args = parser.parse_args()
+
+    try:
+        query = CatalogQuery(args.db)
+    except FileNotFoundError as e:
+        print(f"ERRO: {e}")
+        sys.exit(1)
+    try:
+        if args.command == "file":
+            found = query.file(args.filename)
+            if found is None:
+                print(f"{args.filename}: não processado.")
+                sys.exit(1)
+            print(f"{args.filename}: referência {found['reference']}, cor {found['color']} ({found['role']})")
+        elif args.command == "ref":
+            groups = query.images(args.reference, args.color)
+            if not groups:
+                print(f"Referência {args.reference}: sem imagens.")
+                sys.exit(1)
+            for color, files in groups.items():
+                print(f"{args.reference} {color}: {', '.join(files)}")
+        elif args.command in ("color", "sizes"):
+            if args.command == "color":
+                references = query.references_with_color(args.color)
+            else:
+                references = query.references_with_sizes(*args.sizes)
+            print("\n".join(references) if references else "Nenhuma referência.")
+        else:
+            try:
+                count = export_rows(query, args.destination, args.format)
+            except (ValueError, RuntimeError) as e:
+                print(f"ERRO: {e}")
+                sys.exit(1)
+            print(f"{count} linhas exportadas para {args.destination}.")
+    finally:
+        query.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Reserva distribuída de trabalho: vários processos (ou máquinas, cada uma
+com a sua chave de API) a processar a mesma pasta partilhada.
+
+Cada trabalhador reserva um segmento de ficheiros consecutivos criando um
+ficheiro de "lease" na pasta `.claims` (criação exclusiva, O_EXCL). Enquanto
+trabalha, uma thread renova cada lease mudando a sua data de modificação
+(os.utime), sem o reescrever: um lease retirado entretanto não é recriado
+(o utime falha) e, se outro trabalhador já criou um lease com o mesmo nome,
+a releitura do dono mostra que o segmento deixou de ser nosso. Um lease cuja
+data de modificação não muda durante `lease_seconds` (medido no relógio de
+quem o observa, por isso não depende de relógios acertados entre máquinas)
+é de um trabalhador que morreu: é retirado (rename atómico) e os ficheiros
+voltam a estar livres. Um segmento concluído fica marcado com um ficheiro
+`.done`, que é imutável.
+
+A reserva é otimista: depois de criar o lease, o trabalhador relê os
+restantes e, se o seu segmento se sobrepuser a um lease anterior (ordem
+criação + trabalhador), desiste e tenta outro segmento.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+LEASE_SECONDS = 120
+MAX_SEGMENT_EXTENSION = 20 # Ficheiros a mais para acabar o segmento numa fronteira entre produtos
+CLAIM_ATTEMPTS = 8
+
+_LEASE_SUFFIX = ".lease"
+_DONE_SUFFIX = ".done"
+
+
+@dataclass
+class Claim:
+    """Segmento reservado por este trabalhador."""
+    name: str
+    worker: str
+    created: float
+    paths: list[Path]
+    lost: bool = False  # O lease foi retirado por outro trabalhador (este foi dado como morto)
+
+    @property
+    def filenames(self) -> list[str]:
+        return [p.name for p in self.paths]
+
+    def to_json(self) -> str:
+        return json.dumps({"worker": self.worker, "created": self.created, "files": self.filenames},
+                          ensure_ascii=False)
+
+
+@dataclass
+class StalenessTracker:
+    """Há quanto tempo (no relógio local) o conteúdo de cada ficheiro não muda."""
+    _seen: dict = field(default_factory=dict)  # nome -> (conteúdo, visto pela primeira vez)
+
+    def unchanged_for(self, name: str, token) -> float:
+        now = time.monotonic()
+        previous = self._seen.get(name)
+        if previous is None or previous[0] != token:
+            self._seen[name] = (token, now)
+            return 0.0
+        return now - previous[1]
+
+    def forget(self, name: str):
+        self._seen.pop(name, None)
+
+
+def write_atomic(path: Path, text: str):
+    """Escreve `text` num ficheiro temporário e substitui `path` (rename atómico)."""
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: Path) -> dict | None:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        # Apagado entretanto, ou a meio de ser substituído: volta a ser lido na próxima vez.
+        return None
+
+
+class ClaimManager:
+    """Leases de segmentos numa pasta partilhada."""
+
+    def __init__(self, claims_dir: Path, worker_id: str, lease_seconds: float = LEASE_SECONDS):
+        self.claims_dir = Path(claims_dir)
+        self.claims_dir.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._active = {}     # nome -> Claim deste trabalhador
+        self._done = {}       # nome -> ficheiros (os .done não mudam, são lidos uma vez)
+        self._tracker = StalenessTracker()
+        self._lock = threading.Lock()
+        self._release_own_stale()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name="claims-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _release_own_stale(self):
+        """Leases com o nosso id são de uma execução anterior que não terminou: ficam livres."""
+        for path in self.claims_dir.glob("*" + _LEASE_SUFFIX):
+            data = _read_json(path)
+            if data is not None and data["worker"] == self.worker_id:
+                path.unlink(missing_ok=True)
+                print(f"   [CLAIM] Lease '{path.name}' de uma execução anterior libertado.")
+
+    # --- Leitura do estado partilhado ---
+
+    def _leases(self) -> dict:
+        """
+        Leases ativos de todos os trabalhadores (nome -> conteúdo, ou None se
+        ainda estiver a ser escrito). Retira os expirados. Se um lease desaparecer durante a leitura (segmento acabado
+        de concluir), a pasta volta a ser lida: o `.done` correspondente pode
+        ter sido criado depois de a listagem começar.
+        """
+        while True:
+            leases = self._scan()
+            if leases is not None:
+                return leases
+
+    def _scan(self) -> dict | None:
+        leases = {}
+        for entry in os.scandir(self.claims_dir):
+            if entry.name.endswith(_DONE_SUFFIX) and entry.name not in self._done:
+                data = _read_json(Path(entry.path))
+                if data is not None:
+                    self._done[entry.name] = set(data["files"])
+            if not entry.name.endswith(_LEASE_SUFFIX):
+                continue
+            data = _read_json(Path(entry.path))
+            try:
+                mtime_ns = os.stat(entry.path).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            if data is None or data["worker"] != self.worker_id:
+                # Um lease ilegível (criação interrompida a meio) também acaba por expirar.
+                token = (data["worker"], data["created"], mtime_ns) if data else (None, mtime_ns)
+                if self._tracker.unchanged_for(entry.name, token) >= self.lease_seconds:
+                    self._expire(entry.name, data)
+                    continue
+            leases[entry.name] = data
+        return leases
+
+    def _expire(self, name: str, data: dict | None):
+        """Retira o lease de um trabalhador que deixou de dar sinal de vida."""
+        stale_path = self.claims_dir / f"{name}.{self.worker_id}.stale"
+        try:
+            # Só um trabalhador consegue o rename; os outros recebem FileNotFoundError.
+            os.rename(self.claims_dir / name, stale_path)
+        except FileNotFoundError:
+            return
+        os.remove(stale_path)
+        self._tracker.forget(name)
+        if data is None:
+            print(f"   [CLAIM] Lease ilegível '{name}' removido.")
+        else:
+            print(f"   [CLAIM] Lease '{name}' de {data['worker']} expirou; {len(data['files'])} ficheiros libertados.")
+
+    def taken_filenames(self) -> set:
+        """Ficheiros reservados (por qualquer trabalhador) ou já concluídos."""
+        taken = set()
+        for data in self._leases().values():
+            if data is not None:
+                taken.update(data["files"])
+        for files in self._done.values():
+            taken |= files
+        return taken
+
+    # --- Reserva ---
+
+    def claim(self, candidates: list[Path], size: int, is_boundary=None) -> Claim | None:
+        """
+        Reserva os primeiros `size` ficheiros livres e consecutivos de
+        `candidates` (ordenados). Com `is_boundary(anterior, atual)`, o
+        segmento estende-se até `MAX_SEGMENT_EXTENSION` ficheiros para acabar
+        numa fronteira entre produtos. Devolve None se não houver nada livre.
+        """
+        for _ in range(CLAIM_ATTEMPTS):
+            taken = self.taken_filenames()
+            start = next((i for i, p in enumerate(candidates) if p.name not in taken), None)
+            if start is None:
+                return None
+            segment = []
+            for path in candidates[start:]:
+                if path.name in taken or len(segment) >= size + MAX_SEGMENT_EXTENSION:
+                    break
+                if len(segment) >= size and (is_boundary is None or is_boundary(segment[-1], path)):
+                    break
+                segment.append(path)
+
+            claim = Claim(name=segment[0].name + _LEASE_SUFFIX, worker=self.worker_id,
+                          created=time.time(), paths=segment)
+            try:
+                fd = os.open(self.claims_dir / claim.name, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(claim.to_json())
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self._overlaps_earlier(claim):
+                os.remove(self.claims_dir / claim.name)
+                time.sleep(random.uniform(0.05, 0.3))
+                continue
+            with self._lock:
+                self._active[claim.name] = claim
+            return claim
+        return None
+
+    def _overlaps_earlier(self, claim: Claim) -> bool:
+        mine = set(claim.filenames)
+        order = (claim.created, claim.worker)
+        leases = self._leases()
+        if any(mine & files for files in self._done.values()):
+            return True
+        for name, data in leases.items():
+            if name == claim.name:
+                continue
+            if data is None:
+                return True  # Outro lease a meio de ser criado: na dúvida, cede-se a vez
+            if mine & set(data["files"]) and (data["created"], data["worker"]) < order:
+                return True
+        return False
+
+    def complete(self, claim: Claim):
+        """Marca o segmento como concluído (`.done`) e liberta o lease."""
+        with self._lock:
+            self._active.pop(claim.name, None)
+        if claim.lost:
+            return
+        done_name = claim.name[:-len(_LEASE_SUFFIX)] + _DONE_SUFFIX
+        write_atomic(self.claims_dir / done_name, json.dumps({"worker": self.worker_id, "files": claim.filenames}))
+        self._done[done_name] = set(claim.filenames)
+        self._remove_own(claim)
+
+    def release(self, claim: Claim):
+        """Liberta o lease sem concluir (os ficheiros voltam a estar livres)."""
+        with self._lock:
+            self._active.pop(claim.name, None)
+        if not claim.lost:
+            self._remove_own(claim)
+
+    def _owns(self, claim: Claim, data: dict | None) -> bool:
+        return data is not None and data["worker"] == self.worker_id and data["created"] == claim.created
+
+    def _remove_own(self, claim: Claim):
+        """
+        Apaga o lease de `claim` se ainda for nosso. Depois de expirar, outro
+        trabalhador pode ter criado um lease com o mesmo nome: o ficheiro é
+        primeiro tirado do sítio (rename atómico) e, se não for nosso, reposto.
+        """
+        path = self.claims_dir / claim.name
+        if not self._owns(claim, _read_json(path)):
+            return
+        held = self.claims_dir / f"{claim.name}.{self.worker_id}.release"
+        try:
+            os.rename(path, held)
+        except FileNotFoundError:
+            return
+        if not self._owns(claim, _read_json(held)):
+            try:
+                os.link(held, path)  # Falha se entretanto já existir outro lease com este nome
+            except FileExistsError:
+                pass
+        os.remove(held)
+
+    # --- Heartbeat ---
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.lease_seconds / 4):
+            self._beat()
+
+    def _beat(self):
+        """Renova os leases ativos; os que outro trabalhador retirou ficam perdidos."""
+        with self._lock:
+            active = list(self._active.values())
+        for claim in active:
+            path = self.claims_dir / claim.name
+            try:
+                # O utime só altera um ficheiro que existe: um lease retirado não volta a aparecer.
+                now_ns = time.time_ns()
+                os.utime(path, ns=(now_ns, now_ns))
+            except FileNotFoundError:
+                self._lose(claim)
+                continue
+            except OSError as e:
+                print(f"   [CLAIM] Falha ao renovar o lease '{claim.name}': {e}")
+                continue
+            data = _read_json(path)
+            if data is None and path.exists():
+                continue  # Ilegível por agora (lease de outro a ser criado): fica para o próximo batimento
+            if not self._owns(claim, data):
+                # Retirado e já reservado por outro trabalhador (o utime renovou o dele).
+                self._lose(claim)
+
+    def _lose(self, claim: Claim):
+        # Outro trabalhador deu este como morto; o trabalho já feito não se perde
+        # (os registos são idempotentes), mas o segmento deixa de ser nosso.
+        claim.lost = True
+        with self._lock:
+            self._active.pop(claim.name, None)
+        print(f"   [CLAIM] Lease '{claim.name}' perdido.")
+
+    def close(self):
+        """Para os batimentos e liberta os leases que ainda estiverem ativos."""
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            active = list(self._active.values())
+        for claim in active:
+            self.release(claim)
@@ -0,0 +1,4 @@
+"""Configuração do pytest. Os testes estão em tests/ e importam os módulos da raiz."""
+
+# Script manual que chama a API real (não é um teste).
+collect_ignore = ["test_api.py"]
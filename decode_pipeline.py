@@ -0,0 +1,75 @@
+"""
+Descodificação única das imagens, em processos paralelos e com pré-carregamento.
+
+Cada ficheiro é lido e descodificado uma só vez: a mesma passagem valida a
+imagem (um ficheiro truncado falha no `load()`), calcula o hash do conteúdo
+e produz a versão reduzida que segue para a API. O trabalho corre num
+ProcessPoolExecutor que vai preparando os lotes seguintes enquanto o lote
+atual está na API; no máximo `max_prefetched` lotes ficam em memória à espera.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from preprocess import PreparedImage, PreprocessConfig, prepare_path
+
+DEFAULT_DECODE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+
+@dataclass
+class DecodedBatch:
+    """Lote já descodificado: imagens válidas e erros por ficheiro."""
+    paths: list[Path]
+    images: list[PreparedImage] = field(default_factory=list)
+    errors: dict[str, str] = field(default_factory=dict)
+    retry: int = 0  # Nº de falhas anteriores (lote re-janelado, ver batching.py)
+
+    @property
+    def valid_paths(self) -> list[Path]:
+        names = {img.name for img in self.images}
+        return [p for p in self.paths if p.name in names]
+
+
+def decode_image(path: Path, config: PreprocessConfig) -> tuple[PreparedImage | None, str | None]:
+    """Descodifica um ficheiro. Devolve (imagem, None) ou (None, erro)."""
+    try:
+        return prepare_path(path, config), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _collect(paths: list[Path], futures: list) -> DecodedBatch:
+    batch = DecodedBatch(paths=paths)
+    for path, future in zip(paths, futures):
+        image, error = future.result()
+        if image is not None:
+            batch.images.append(image)
+        else:
+            batch.errors[path.name] = error
+    return batch
+
+
+def prefetch_batches(batches, config: PreprocessConfig, workers: int = DEFAULT_DECODE_WORKERS,
+                     max_prefetched: int = 2):
+    """
+    Gera DecodedBatch pela mesma ordem de `batches`, descodificando até
+    `max_prefetched` lotes à frente do que já foi consumido.
+    """
+    batches = iter(batches)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        queue = deque()
+
+        def fill():
+            while len(queue) < max_prefetched:
+                paths = next(batches, None)
+                if paths is None:
+                    return
+                queue.append((paths, [pool.submit(decode_image, p, config) for p in paths]))
+
+        fill()
+        while queue:
+            paths, futures = queue.popleft()
+            fill()
+            yield _collect(paths, futures)
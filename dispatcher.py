@@ -0,0 +1,213 @@
+"""
+Despacho concorrente de lotes para a API Gemini.
+
+Mantém vários lotes em voo ao mesmo tempo e respeita as quotas de cada
+modelo (pedidos por minuto e tokens por minuto) com um token bucket.
+Quando a API responde 429, o pedido espera o tempo indicado pelo servidor
+("Please retry in Xs") e volta a ser tentado, em vez de o lote ser dado
+como falhado.
+"""
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Quotas por modelo. Os valores abaixo são os do plano pago (Tier 1);
+# no plano gratuito o gemini-2.5-pro tem apenas 2 pedidos por minuto.
+# "rpd" (pedidos por dia) é verificado pelo budget.py antes de cada chamada.
+MODEL_QUOTAS = {
+    "gemini-2.5-pro": {"rpm": 150, "tpm": 2_000_000, "rpd": 10_000},
+    "gemini-2.5-flash": {"rpm": 1000, "tpm": 1_000_000, "rpd": 10_000},
+}
+DEFAULT_QUOTA = {"rpm": 10, "tpm": 250_000}
+
+MAX_QUOTA_RETRIES = 8
+FALLBACK_RETRY_SECONDS = 30.0
+
+_RETRY_IN_RE = re.compile(r"retry in ([0-9.]+)\s*s", re.IGNORECASE)
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*([0-9]+)", re.IGNORECASE)
+_FEED_DONE = object()
+
+
+class QuotaExhaustedError(Exception):
+    """A quota continuou esgotada depois de todas as tentativas."""
+
+
+class TokenBucket:
+    """Token bucket thread-safe, reabastecido continuamente a `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute: float, capacity: float | None = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate_per_second)
+        self._last = now
+
+    def acquire(self, amount: float = 1.0):
+        """Bloqueia até existirem `amount` tokens disponíveis e consome-os."""
+        # Um pedido maior do que o balde nunca passaria; limita-se à capacidade.
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait_seconds = (amount - self._tokens) / self.rate_per_second
+            time.sleep(min(wait_seconds, 1.0))
+
+    def drain(self):
+        """Esvazia o balde (usado quando o servidor indica que a quota acabou)."""
+        with self._lock:
+            self._tokens = 0.0
+            self._last = time.monotonic()
+
+
+class RateLimiter:
+    """Limites RPM/TPM de um modelo, partilhados por todas as threads."""
+
+    def __init__(self, model_name: str, rpm: int, tpm: int):
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_name: str) -> "RateLimiter":
+        quota = MODEL_QUOTAS.get(model_name, DEFAULT_QUOTA)
+        return cls(model_name, quota["rpm"], quota["tpm"])
+
+    def pause(self, seconds: float):
+        """Suspende todos os pedidos deste modelo durante `seconds`."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.requests.drain()
+
+    def acquire(self, estimated_tokens: int):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(remaining)
+        self.requests.acquire(1)
+        self.tokens.acquire(estimated_tokens)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Indica se o erro é um 429 / ResourceExhausted."""
+    return type(error).__name__ == "ResourceExhausted" or str(error).lstrip().startswith("429")
+
+
+def parse_retry_delay(error: Exception) -> float | None:
+    """Extrai o tempo de espera sugerido pelo servidor numa resposta 429."""
+    text = str(error)
+    match = _RETRY_IN_RE.search(text) or _RETRY_DELAY_RE.search(text)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def call_with_quota(fn, limiter: RateLimiter, estimated_tokens: int,
+                    max_retries: int = MAX_QUOTA_RETRIES, on_retry=None):
+    """
+    Executa `fn()` respeitando o `limiter`. Em caso de 429 espera o tempo
+    indicado pelo servidor e tenta de novo; outros erros são propagados.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated_tokens)
+        try:
+            return fn()
+        except Exception as e:
+            if not is_quota_error(e):
+                raise
+            if attempt == max_retries:
+                raise QuotaExhaustedError(str(e)) from e
+            delay = parse_retry_delay(e)
+            if delay is None:
+                delay = FALLBACK_RETRY_SECONDS * (2 ** attempt)
+            # Pequena margem para não voltar a bater no limite no mesmo segundo.
+            delay += 1.0
+            limiter.pause(delay)
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+
+
+def dispatch_ordered(batches, worker, max_in_flight: int, max_ahead: int):
+    """
+    Executa `worker(batch)` em paralelo, com no máximo `max_in_flight` lotes
+    em voo, e devolve pares (lote, future) pela ordem dos lotes; o resultado
+    (ou exceção) obtém-se com `future.result()` na thread principal.
+      - `batches` (leitura, descodificação, corte em lotes) é consumido numa
+        thread própria, que vai submetendo os lotes a `worker`;
+      - a ordem é a dos lotes, não a ordem em que terminam: o tratamento (e
+        o catálogo) não depende da latência;
+      - contrapressão: no máximo `max_ahead` lotes tirados de `batches` e
+        ainda não tratados pela thread principal. Se o tratamento se atrasa,
+        a descodificação para; se a API se atrasa, os lotes ficam à espera
+        de vaga sem ocupar mais do que isso.
+    Uma exceção de `batches` é relançada na thread principal, depois dos
+    lotes anteriores.
+    """
+    batches = iter(batches)
+    ready = queue.Queue()
+    slots = threading.Semaphore(max_ahead)
+    stop = threading.Event()
+
+    def feed(pool):
+        try:
+            while True:
+                # A vaga é reservada antes de pedir (e descodificar) o lote seguinte.
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                batch = next(batches, _FEED_DONE)
+                if batch is _FEED_DONE:
+                    return
+                ready.put((batch, pool.submit(worker, batch)))
+        except BaseException as e:
+            ready.put((_FEED_DONE, e))
+        finally:
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()  # Termina os processos da descodificação (prefetch_batches)
+            ready.put((_FEED_DONE, None))
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        feeder = threading.Thread(target=feed, args=(pool,), name="dispatch-feed", daemon=True)
+        feeder.start()
+        try:
+            while True:
+                batch, item = ready.get()
+                if batch is _FEED_DONE:
+                    if item is not None:
+                        raise item
+                    break
+                yield batch, item
+                slots.release()
+        finally:
+            stop.set()
+            feeder.join()
+            # Interrompido: os lotes submetidos que ainda não começaram não chegam à API.
+            pool.shutdown(cancel_futures=True)
+
+
+def pack_batches(batches, pack_size: int):
+    """Agrupa `batches` em listas de até `pack_size` lotes consecutivos (um pedido cada)."""
+    pack = []
+    for batch in batches:
+        pack.append(batch)
+        if len(pack) >= pack_size:
+            yield pack
+            pack = []
+    if pack:
+        yield pack
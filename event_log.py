@@ -0,0 +1,222 @@
+"""
+Registo de eventos estruturado (JSONL), escrito em segundo plano.
+
+`EventLog.write` só põe o evento numa fila; uma thread escreve os eventos em
+blocos (no máximo a cada `flush_interval` segundos) e roda o ficheiro quando
+passa de `max_bytes` (events.jsonl -> events.jsonl.1 -> ... .N). Cada linha:
+
+    {"ts": "2024-06-10 14:03:12", "event": "SUCESSO", "message": "...",
+     "files": [...], "batch": 12, "reference": "1234", "color": "C1", "model": "..."}
+
+Além do JSONL, a mesma thread mantém contagens agregadas por evento,
+referência, tipo de erro e dia numa tabela SQLite, por isso o resumo não
+precisa de ler o registo inteiro:
+
+    python event_log.py summary [--by reference|error|event] [--since 2024-06-01]
+    python event_log.py show [--event ERRO_API] [--reference 1234] [--limit 50]
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+EVENTS_FILE = Path("processing_events.jsonl")
+INDEX_DB = Path("processing_state.sqlite")
+MAX_BYTES = 20 * 1024 * 1024
+BACKUPS = 5
+FLUSH_INTERVAL = 1.0 # Segundos máximos entre a chegada de um evento e a escrita
+
+SUCCESS_EVENTS = {"SUCESSO"}
+FAILURE_EVENTS = {"FALHA_API", "ERRO_API", "RESPOSTA_INVALIDA", "ERRO_INTERNO", "ERRO_DADOS",
+                  "ERRO_SAVE", "ERRO_MOVIMENTO", "IMG_CORROMPIDA", "QUOTA_ESGOTADA"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS event_counts (
+    day TEXT NOT NULL,
+    event TEXT NOT NULL,
+    reference TEXT NOT NULL,
+    error_class TEXT NOT NULL,
+    events INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    PRIMARY KEY (day, event, reference, error_class)
+);
+"""
+_STOP = object()
+
+
+class EventLog:
+    """Eventos em JSONL com escrita em blocos, rotação por tamanho e contagens agregadas."""
+
+    def __init__(self, path: Path = EVENTS_FILE, index_db: Path | None = INDEX_DB,
+                 max_bytes: int = MAX_BYTES, backups: int = BACKUPS, flush_interval: float = FLUSH_INTERVAL):
+        self.path = Path(path)
+        self.index_db = Path(index_db) if index_db else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+        self._thread.start()
+
+    def write(self, event: str, message: str = "", files: list | None = None, **fields):
+        """Acrescenta um evento (não bloqueia; campos None são omitidos)."""
+        record = {"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "event": event, "message": message}
+        if files:
+            record["files"] = list(files)
+        record.update({k: v for k, v in fields.items() if v is not None})
+        self._queue.put(record)
+
+    def close(self):
+        """Escreve os eventos pendentes e termina a thread (pode ser chamado mais de uma vez)."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    # --- Thread de escrita ---
+
+    def _run(self):
+        conn = None
+        if self.index_db is not None:
+            conn = sqlite3.connect(str(self.index_db))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        stopping = False
+        while not stopping:
+            try:
+                records = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Junta tudo o que já estiver na fila num só bloco.
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(r is _STOP for r in records):
+                stopping = True
+                records = [r for r in records if r is not _STOP]
+            try:
+                self._flush(records, conn)
+            except Exception as e:
+                print(f"Aviso: Não foi possível escrever no registo de eventos: {e}")
+        if conn is not None:
+            conn.close()
+
+    def _flush(self, records: list, conn):
+        if not records:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+        if self.path.stat().st_size >= self.max_bytes:
+            self._rotate()
+        if conn is not None:
+            counts = {}
+            for r in records:
+                key = (r["ts"][:10], r["event"], str(r.get("reference", "")), r.get("error_class", ""))
+                events, files = counts.get(key, (0, 0))
+                counts[key] = (events + 1, files + len(r.get("files", ())))
+            with conn:
+                conn.executemany(
+                    "INSERT INTO event_counts VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(day, event, reference, error_class) "
+                    "DO UPDATE SET events = events + excluded.events, files = files + excluded.files",
+                    [(*key, events, files) for key, (events, files) in counts.items()],
+                )
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+
+# --- Consulta ---
+
+def summarize(index_db: Path, by: str = "reference", since: str | None = None) -> list[tuple]:
+    """(chave, sucessos, falhas, outros eventos, taxa de sucesso) a partir das contagens agregadas."""
+    column = {"reference": "reference", "error": "error_class", "event": "event"}[by]
+    conn = sqlite3.connect(str(index_db))
+    try:
+        rows = conn.execute(
+            f"SELECT {column}, event, SUM(events) FROM event_counts WHERE day >= ? GROUP BY {column}, event",
+            (since or "",),
+        ).fetchall()
+    finally:
+        conn.close()
+    table = {}
+    for key, event, events in rows:
+        success, failure, other = table.get(key, (0, 0, 0))
+        if event in SUCCESS_EVENTS:
+            success += events
+        elif event in FAILURE_EVENTS:
+            failure += events
+        else:
+            other += events
+        table[key] = (success, failure, other)
+    result = []
+    for key, (success, failure, other) in table.items():
+        rate = success / (success + failure) if success + failure else None
+        result.append((key, success, failure, other, rate))
+    return sorted(result, key=lambda row: (-(row[1] + row[2]), str(row[0])))
+
+
+def read_events(path: Path, backups: int = BACKUPS):
+    """Eventos do registo e das rotações, do mais antigo para o mais recente."""
+    files = [path.with_name(f"{path.name}.{i}") for i in range(backups, 0, -1)] + [path]
+    for file in files:
+        if not file.exists():
+            continue
+        with open(file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta do registo de eventos.")
+    parser.add_argument("--log", type=Path, default=EVENTS_FILE, help="Registo JSONL")
+    parser.add_argument("--db", type=Path, default=INDEX_DB, help="Base com as contagens agregadas")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="Sucessos e falhas agregados")
+    summary_parser.add_argument("--by", choices=("reference", "error", "event"), default="reference")
+    summary_parser.add_argument("--since", help="Dia inicial (AAAA-MM-DD)")
+    show_parser = commands.add_parser("show", help="Eventos filtrados (lê o registo)")
+    show_parser.add_argument("--event")
+    show_parser.add_argument("--reference")
+    show_parser.add_argument("--file", help="Eventos que incluem este ficheiro")
+    show_parser.add_argument("--limit", type=int, default=50, help="Últimos N eventos")
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        rows = summarize(args.db, args.by, args.since)
+        print(f"{args.by:<20}{'sucessos':>10}{'falhas':>10}{'outros':>10}{'taxa':>8}")
+        for key, success, failure, other, rate in rows:
+            print(f"{str(key or '-'):<20}{success:>10}{failure:>10}{other:>10}"
+                  f"{'' if rate is None else f'{rate:.0%}':>8}")
+        return
+
+    matches = []
+    for record in read_events(args.log):
+        if args.event and record.get("event") != args.event:
+            continue
+        if args.reference and str(record.get("reference")) != args.reference:
+            continue
+        if args.file and args.file not in record.get("files", ()):
+            continue
+        matches.append(record)
+    for record in matches[-args.limit:]:
+        extra = {k: v for k, v in record.items() if k not in ("ts", "event", "message", "files")}
+        print(f"[{record['ts']}] [{record['event']:^15}] {record.get('message', '')} {extra or ''}".rstrip())
+        for name in record.get("files", ()):
+            print(f"                   - {name}")
+
+
+if __name__ == "__main__":
+    main()
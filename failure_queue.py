@@ -0,0 +1,221 @@
+"""
+Fila persistente de falhas (dead-letter) com novas tentativas agendadas.
+
+Cada ficheiro que falha fica registado na base de estado com o motivo, o nº
+de tentativas e o momento da próxima tentativa, calculado com recuo
+exponencial por motivo. Um reinício já não volta a tentar tudo de uma vez,
+e uma falha transitória da API volta a ser tentada na mesma execução, assim
+que o prazo chegar. Imagens corrompidas nunca são tentadas de novo
+automaticamente; depois do nº máximo de tentativas, as outras também não.
+
+    python failure_queue.py list [--reason MOTIVO]
+    python failure_queue.py requeue [ficheiros...] [--reason MOTIVO] [--all]
+    python failure_queue.py purge [ficheiros...] [--reason MOTIVO] [--all]
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+STATE_DB = Path("processing_state.sqlite")
+
+CORRUPT = "imagem_corrompida"
+API_ERROR = "erro_api"
+QUOTA = "quota"
+NO_KEY = "sem_imagem_chave"
+INVALID_RESPONSE = "resposta_invalida"
+EMPTY_REFERENCE = "referencia_vazia"
+SAVE_ERROR = "erro_gravacao"
+BUDGET = "orcamento"
+
+# Motivo -> (espera inicial em segundos, nº máximo de tentativas). None = nunca.
+RETRY_POLICY = {
+    CORRUPT: None,
+    API_ERROR: (30, 8),
+    QUOTA: (60, 10),
+    NO_KEY: (6 * 3600, 3),
+    INVALID_RESPONSE: (600, 4),
+    EMPTY_REFERENCE: (600, 4),
+    SAVE_ERROR: (60, 5),
+    BUDGET: (3600, 30),  # Normalmente com o prazo indicado pelo budget.py (meia-noite)
+}
+MAX_BACKOFF_SECONDS = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS failures (
+    filename TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    first_failed_at REAL NOT NULL,
+    last_failed_at REAL NOT NULL,
+    next_retry_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_failures_next ON failures(next_retry_at);
+CREATE INDEX IF NOT EXISTS idx_failures_reason ON failures(reason);
+"""
+
+
+def next_retry_time(reason: str, attempts: int, now: float) -> float | None:
+    """Momento da próxima tentativa após `attempts` falhas, ou None se não houver mais."""
+    policy = RETRY_POLICY.get(reason, RETRY_POLICY[API_ERROR])
+    if policy is None:
+        return None
+    base, max_attempts = policy
+    if attempts >= max_attempts:
+        return None
+    return now + min(MAX_BACKOFF_SECONDS, base * 2 ** (attempts - 1))
+
+
+class FailureQueue:
+    """Falhas por ficheiro, na mesma base SQLite do StateStore."""
+
+    def __init__(self, path: Path = STATE_DB):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def record(self, filenames: list[str], reason: str, error: str = "",
+               retry_at: float | None = None) -> list[str]:
+        """
+        Regista uma falha de cada ficheiro (uma transação). Com `retry_at`, a
+        nova tentativa fica para esse momento em vez do recuo do motivo.
+        Devolve os que não voltam a ser tentados automaticamente.
+        """
+        now = time.time()
+        dead = []
+        with self._conn:
+            for name in filenames:
+                row = self._conn.execute(
+                    "SELECT reason, attempts, first_failed_at FROM failures WHERE filename = ?", (name,)
+                ).fetchone()
+                # Um motivo novo recomeça a contagem (ex: 429 seguido de imagem sem texto).
+                attempts = row[1] + 1 if row and row[0] == reason else 1
+                first = row[2] if row else now
+                next_retry = next_retry_time(reason, attempts, now)
+                if next_retry is not None and retry_at is not None:
+                    next_retry = max(next_retry, retry_at)
+                if next_retry is None:
+                    dead.append(name)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (name, reason, attempts, error, first, now, next_retry),
+                )
+        return dead
+
+    def clear(self, filenames: list[str]):
+        """Remove os ficheiros da fila (processados com sucesso)."""
+        with self._conn:
+            self._conn.executemany("DELETE FROM failures WHERE filename = ?", [(n,) for n in filenames])
+
+    def blocked_filenames(self, now: float | None = None) -> set:
+        """Ficheiros que ainda não devem ser tentados (prazo por chegar ou sem mais tentativas)."""
+        now = time.time() if now is None else now
+        rows = self._conn.execute(
+            "SELECT filename FROM failures WHERE next_retry_at IS NULL OR next_retry_at > ?", (now,)
+        )
+        return {row[0] for row in rows}
+
+    def next_retry_at(self, now: float | None = None) -> float | None:
+        """Próximo prazo ainda por chegar, ou None."""
+        now = time.time() if now is None else now
+        return self._conn.execute(
+            "SELECT MIN(next_retry_at) FROM failures WHERE next_retry_at > ?", (now,)
+        ).fetchone()[0]
+
+    def has_due(self, now: float | None = None) -> bool:
+        """Há ficheiros cuja nova tentativa já pode ser feita?"""
+        now = time.time() if now is None else now
+        return self._conn.execute(
+            "SELECT 1 FROM failures WHERE next_retry_at <= ? LIMIT 1", (now,)
+        ).fetchone() is not None
+
+    def entries(self, reason: str | None = None) -> list[tuple]:
+        """(ficheiro, motivo, tentativas, último erro, última falha, próxima tentativa)."""
+        query = "SELECT filename, reason, attempts, last_error, last_failed_at, next_retry_at FROM failures"
+        if reason:
+            return self._conn.execute(query + " WHERE reason = ? ORDER BY filename", (reason,)).fetchall()
+        return self._conn.execute(query + " ORDER BY filename").fetchall()
+
+    def summary(self) -> list[tuple]:
+        """(motivo, ficheiros, sem mais tentativas, próxima tentativa) por motivo."""
+        return self._conn.execute(
+            "SELECT reason, COUNT(*), SUM(next_retry_at IS NULL), MIN(next_retry_at) FROM failures "
+            "GROUP BY reason ORDER BY COUNT(*) DESC"
+        ).fetchall()
+
+    def _where(self, filenames: list[str] | None, reason: str | None) -> tuple[str, list]:
+        clauses, params = [], []
+        if filenames:
+            clauses.append(f"filename IN ({','.join('?' * len(filenames))})")
+            params += filenames
+        if reason:
+            clauses.append("reason = ?")
+            params.append(reason)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def requeue(self, filenames: list[str] | None = None, reason: str | None = None) -> int:
+        """Volta a pôr os ficheiros em fila já, com a contagem a zero (incluindo corrompidos)."""
+        where, params = self._where(filenames, reason)
+        with self._conn:
+            return self._conn.execute(
+                "UPDATE failures SET attempts = 0, next_retry_at = ?" + where, [time.time()] + params
+            ).rowcount
+
+    def purge(self, filenames: list[str] | None = None, reason: str | None = None) -> int:
+        """Apaga entradas da fila. Os ficheiros voltam a ser processados normalmente."""
+        where, params = self._where(filenames, reason)
+        with self._conn:
+            return self._conn.execute("DELETE FROM failures" + where, params).rowcount
+
+
+def _format_time(timestamp: float | None) -> str:
+    if timestamp is None:
+        return "nunca"
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def print_entries(queue: FailureQueue, reason: str | None = None):
+    rows = queue.entries(reason)
+    for filename, reason, attempts, error, last_failed, next_retry in rows:
+        print(f"{filename:<32} {reason:<18} {attempts:>3}x  última: {_format_time(last_failed)}  "
+              f"próxima: {_format_time(next_retry)}  {error or ''}")
+    print(f"{len(rows)} entradas.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fila de ficheiros falhados.")
+    parser.add_argument("--db", type=Path, default=STATE_DB, help="Base de estado")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="Lista as falhas")
+    list_parser.add_argument("--reason", choices=sorted(RETRY_POLICY))
+    for name, help_text in (("requeue", "Volta a tentar já"), ("purge", "Apaga da fila")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument("filenames", nargs="*")
+        sub.add_argument("--reason", choices=sorted(RETRY_POLICY))
+        sub.add_argument("--all", action="store_true", help="Todas as entradas")
+    args = parser.parse_args()
+
+    queue = FailureQueue(args.db)
+    try:
+        if args.command == "list":
+            print_entries(queue, args.reason)
+            return
+        if not (args.filenames or args.reason or args.all):
+            print("Indique ficheiros, --reason ou --all.")
+            sys.exit(1)
+        action = queue.requeue if args.command == "requeue" else queue.purge
+        count = action(args.filenames or None, args.reason)
+        print(f"{count} entradas {'reenviadas' if args.command == 'requeue' else 'apagadas'}.")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
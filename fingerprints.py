@@ -0,0 +1,248 @@
+"""
+Deteção de ficheiros já processados pelo conteúdo, e não pelo nome.
+
+Cada imagem da pasta de entrada tem uma impressão digital (tamanho, mtime e
+um hash parcial: SHA-256 do tamanho, dos primeiros e dos últimos
+PARTIAL_BYTES), guardada na base de estado entre execuções. Numa nova
+listagem, um ficheiro com o mesmo caminho, tamanho e mtime reaproveita a
+impressão guardada: para os ficheiros que não mudaram, basta o stat. Só os
+novos ou alterados são lidos (parcialmente).
+
+Cada lote gravado regista o conteúdo dos seus ficheiros. Um ficheiro está
+processado se o seu conteúdo já foi registado, com este ou outro nome:
+  - uma fotografia nova que reutiliza um nome da câmara (RUS_0001.jpg) tem
+    outro conteúdo e é processada;
+  - uma fotografia renomeada não é paga outra vez.
+Quando o hash parcial coincide com o de um ficheiro com outro nome ou
+caminho, ou com o do mesmo ficheiro mas com outro mtime, os dois são
+confirmados com o hash completo (response_cache.file_hash), que é guardado
+ao registar o conteúdo.
+
+    python fingerprints.py scan PASTA   # quantos ficheiros já estão processados
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from response_cache import file_hash
+
+STATE_DB = Path("processing_state.sqlite")
+PARTIAL_BYTES = 64 * 1024
+HASH_WORKERS = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial_hash TEXT NOT NULL,
+    full_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS processed_content (
+    size INTEGER NOT NULL,
+    partial_hash TEXT NOT NULL,
+    full_hash TEXT,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    processed_at REAL NOT NULL,
+    mtime_ns INTEGER,
+    PRIMARY KEY (size, partial_hash, filename)
+);
+CREATE INDEX IF NOT EXISTS idx_processed_content_filename ON processed_content(filename);
+"""
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    size: int
+    mtime_ns: int
+    partial_hash: str
+    full_hash: str | None = None
+
+
+def partial_hash(path: Path, size: int) -> str:
+    """SHA-256 do tamanho, dos primeiros e dos últimos PARTIAL_BYTES do ficheiro."""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_BYTES))
+        if size > 2 * PARTIAL_BYTES:
+            f.seek(-PARTIAL_BYTES, os.SEEK_END)
+        digest.update(f.read(PARTIAL_BYTES))
+    return digest.hexdigest()
+
+
+def _partial_hash_or_none(path: Path, size: int) -> str | None:
+    try:
+        return partial_hash(path, size)
+    except FileNotFoundError:
+        return None  # Apagado entre o stat e a leitura
+
+
+class FingerprintIndex:
+    """Impressões digitais da pasta de entrada e conteúdos já processados, na base de estado."""
+
+    def __init__(self, path: Path = STATE_DB):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(processed_content)")}
+        if "mtime_ns" not in columns:
+            # Bases anteriores: sem mtime registado, vale o hash parcial.
+            self._conn.execute("ALTER TABLE processed_content ADD COLUMN mtime_ns INTEGER")
+        self._conn.commit()
+        self._known = {}  # caminho absoluto -> Fingerprint (lido da base uma vez)
+        for path_text, size, mtime_ns, partial, full in self._conn.execute("SELECT * FROM fingerprints"):
+            self._known[path_text] = Fingerprint(size, mtime_ns, partial, full)
+
+    def close(self):
+        self._conn.commit()  # Impressões de uma listagem interrompida a meio
+        self._conn.close()
+
+    def is_empty(self) -> bool:
+        """Nenhum conteúdo processado registado (base anterior a este índice)."""
+        return self._conn.execute("SELECT 1 FROM processed_content LIMIT 1").fetchone() is None
+
+    def scan(self, paths: list[Path]) -> dict:
+        """
+        Caminho -> Fingerprint. Os ficheiros sem alterações desde a última
+        listagem custam só um stat; os outros são lidos em paralelo. Os
+        ficheiros que desapareceram entretanto ficam de fora.
+        """
+        result, changed = {}, []
+        for path in paths:
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            known = self._known.get(os.path.abspath(path))
+            if known is not None and known.size == st.st_size and known.mtime_ns == st.st_mtime_ns:
+                result[path] = known
+            else:
+                changed.append((path, st.st_size, st.st_mtime_ns))
+        if changed:
+            with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+                hashes = pool.map(lambda item: _partial_hash_or_none(item[0], item[1]), changed)
+                for (path, size, mtime_ns), partial in zip(changed, hashes):
+                    if partial is not None:
+                        result[path] = self._remember(path, Fingerprint(size, mtime_ns, partial))
+            self._conn.commit()
+        return result
+
+    def _remember(self, path: Path, fingerprint: Fingerprint) -> Fingerprint:
+        key = os.path.abspath(path)
+        self._known[key] = fingerprint
+        self._conn.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                           (key, fingerprint.size, fingerprint.mtime_ns, fingerprint.partial_hash,
+                            fingerprint.full_hash))
+        return fingerprint
+
+    def _full_hash(self, path: Path, fingerprint: Fingerprint) -> str:
+        fingerprint = self._known.get(os.path.abspath(path), fingerprint)
+        if fingerprint.full_hash is None:
+            fingerprint = self._remember(path, Fingerprint(fingerprint.size, fingerprint.mtime_ns,
+                                                           fingerprint.partial_hash, file_hash(path)))
+        return fingerprint.full_hash
+
+    def processed(self, paths: list[Path], legacy_names: set = frozenset()) -> dict:
+        """
+        Nome atual -> nome com que o conteúdo foi processado, para os
+        ficheiros de `paths` já processados. `legacy_names` são nomes
+        processados antes desta base existir (StateStore.processed_filenames):
+        um ficheiro com um desses nomes, ainda sem conteúdo registado, é
+        aceite pelo nome e registado agora.
+        """
+        result, adopted = {}, []
+        for path, fingerprint in self.scan(paths).items():
+            rows = self._conn.execute(
+                "SELECT size, partial_hash, full_hash, filename, path, mtime_ns FROM processed_content "
+                "WHERE size = ? AND partial_hash = ?", (fingerprint.size, fingerprint.partial_hash))
+            for size, partial, full, filename, stored_path, mtime_ns in rows.fetchall():
+                if filename == path.name and stored_path == os.path.abspath(path):
+                    if mtime_ns in (None, fingerprint.mtime_ns) or full is None:
+                        result[path.name] = filename  # O mesmo ficheiro
+                        break
+                    # Alterado no mesmo sítio (mtime diferente): só o hash completo o confirma.
+                    if full == self._full_hash(path, fingerprint):
+                        result[path.name] = filename
+                        break
+                    continue
+                # Outro nome ou caminho (renomeado ou colisão do hash parcial): confirma pelo hash completo.
+                if full is None and os.path.exists(stored_path):
+                    full = file_hash(Path(stored_path))
+                    self._conn.execute(
+                        "UPDATE processed_content SET full_hash = ? WHERE size = ? AND partial_hash = ? AND filename = ?",
+                        (full, size, partial, filename))
+                # Sem o original para comparar, vale o hash parcial (inclui o tamanho e o início do ficheiro).
+                if full is None or full == self._full_hash(path, fingerprint):
+                    result[path.name] = filename
+                    break
+            else:
+                if path.name in legacy_names and self._conn.execute(
+                        "SELECT 1 FROM processed_content WHERE filename = ? LIMIT 1", (path.name,)).fetchone() is None:
+                    result[path.name] = path.name
+                    adopted.append(path)
+        self._conn.commit()
+        if adopted:
+            self.mark_processed(adopted)
+        return result
+
+    def mark_processed(self, paths: list[Path], stored_at: list[Path] | None = None):
+        """
+        Regista o conteúdo de ficheiros processados com sucesso (uma
+        transação), com o mtime e o hash completo para confirmar mais tarde
+        um ficheiro alterado no mesmo sítio. `stored_at`: onde os ficheiros
+        estão agora, se foram movidos depois da listagem.
+        """
+        now = time.time()
+        rows = []
+        for path, current in zip(paths, stored_at or paths):
+            fingerprint = self._known.get(os.path.abspath(path))
+            if fingerprint is None:
+                fingerprint = self.scan([current]).get(current)
+                if fingerprint is None:
+                    continue  # Já não existe: nada a registar
+            full = fingerprint.full_hash
+            if full is None:
+                try:
+                    full = file_hash(current)  # Acabado de ler para o lote: está na cache do sistema
+                except FileNotFoundError:
+                    pass
+            rows.append((fingerprint.size, fingerprint.partial_hash, full, path.name,
+                         os.path.abspath(current), now, fingerprint.mtime_ns))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO processed_content "
+                "(size, partial_hash, full_hash, filename, path, processed_at, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ficheiros já processados, pelo conteúdo.")
+    parser.add_argument("--db", type=Path, default=STATE_DB, help="Base de estado")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("scan", help="Conta os ficheiros já processados de uma pasta").add_argument("folder", type=Path)
+    args = parser.parse_args()
+
+    from watcher import IMAGE_PATTERNS, matches
+
+    start = time.perf_counter()
+    paths = sorted(Path(entry.path) for entry in os.scandir(args.folder)
+                   if entry.is_file() and matches(entry.name, IMAGE_PATTERNS))
+    index = FingerprintIndex(args.db)
+    try:
+        found = index.processed(paths)
+    finally:
+        index.close()
+    renamed = sum(1 for name, original in found.items() if name != original)
+    print(f"{args.folder}: {len(paths)} imagens, {len(found)} já processadas ({renamed} com outro nome), "
+          f"{len(paths) - len(found)} por processar ({time.perf_counter() - start:.2f}s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Agrupamento local de fotografias do mesmo produto (mesmo modelo e cor).
+
+Substitui a pergunta de similaridade feita à API: cada imagem reduzida dá
+origem a um pHash, um dHash e um histograma HSV (sem o fundo branco), tudo
+calculado com NumPy. Fotografias consecutivas ficam no mesmo grupo enquanto
+as cores forem parecidas e a forma (hash) ou a cor forem muito próximas.
+A API só é chamada para ler o texto da haste, uma vez por grupo.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+_HIST_BINS = (8, 4, 4)  # H, S, V
+
+
+@dataclass(frozen=True)
+class GroupingConfig:
+    """Limiares de agrupamento. Calibrar com sessões reais do estúdio."""
+    max_hist_distance: float = 0.35    # Acima disto, a cor é outra: novo grupo
+    strict_hist_distance: float = 0.12 # Abaixo disto, a cor basta para juntar
+    max_hash_distance: int = 22        # Distância de Hamming (em 64 bits) pHash/dHash
+    max_group_size: int = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    m[0, :] = np.sqrt(1.0 / n)
+    return m
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def phash(img: Image.Image) -> int:
+    gray = np.asarray(img.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS), dtype=np.float32)
+    coefficients = (_DCT @ gray @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE]
+    median = np.median(coefficients.ravel()[1:])  # sem a componente DC
+    return _bits_to_int(coefficients > median)
+
+
+def dhash(img: Image.Image) -> int:
+    gray = np.asarray(img.convert("L").resize((_HASH_SIZE + 1, _HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+
+def hsv_histogram(img: Image.Image) -> np.ndarray:
+    """Histograma HSV normalizado, ignorando o fundo (claro e pouco saturado)."""
+    small = img.convert("RGB")
+    small.thumbnail((256, 256))
+    hsv = np.asarray(small.convert("HSV"), dtype=np.uint16).reshape(-1, 3)
+    foreground = ~((hsv[:, 2] > 230) & (hsv[:, 1] < 26))
+    if foreground.sum() < 50:
+        foreground[:] = True
+    hsv = hsv[foreground]
+    h = hsv[:, 0] * _HIST_BINS[0] // 256
+    s = hsv[:, 1] * _HIST_BINS[1] // 256
+    v = hsv[:, 2] * _HIST_BINS[2] // 256
+    index = (h * _HIST_BINS[1] + s) * _HIST_BINS[2] + v
+    hist = np.bincount(index, minlength=int(np.prod(_HIST_BINS))).astype(np.float32)
+    return hist / hist.sum()
+
+
+def compute_features(img: Image.Image) -> dict:
+    """Características de uma imagem (serializáveis, para voltar dos processos de descodificação)."""
+    return {"phash": phash(img), "dhash": dhash(img), "hist": hsv_histogram(img)}
+
+
+def _hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    xor = np.bitwise_xor(a, b)
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _hist_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distância de Bhattacharyya simplificada (0 = iguais, 1 = disjuntos), por linha."""
+    return 1.0 - np.sqrt(a * b).sum(axis=1)
+
+
+def pairwise_distances(first: list[dict], second: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    """(distância de hash, distância de cor) entre os pares first[i] / second[i]."""
+    hashes_a = np.array([[f["phash"], f["dhash"]] for f in first], dtype=np.uint64)
+    hashes_b = np.array([[f["phash"], f["dhash"]] for f in second], dtype=np.uint64)
+    hash_distance = np.minimum(_hamming(hashes_a[:, 0], hashes_b[:, 0]), _hamming(hashes_a[:, 1], hashes_b[:, 1]))
+    hist_distance = _hist_distance(np.stack([f["hist"] for f in first]), np.stack([f["hist"] for f in second]))
+    return hash_distance, hist_distance
+
+
+def same_product(hash_distance, hist_distance, config: GroupingConfig):
+    """Decisão vetorizada: cada par é do mesmo produto?"""
+    return (hist_distance <= config.max_hist_distance) & (
+        (hist_distance <= config.strict_hist_distance) | (hash_distance <= config.max_hash_distance)
+    )
+
+
+def group_consecutive(features: list[dict], config: GroupingConfig = GroupingConfig()) -> list[list[int]]:
+    """Divide uma sequência de imagens em grupos de índices consecutivos."""
+    if not features:
+        return []
+    if len(features) == 1:
+        return [[0]]
+    hash_distance, hist_distance = pairwise_distances(features[:-1], features[1:])
+    same = same_product(hash_distance, hist_distance, config)
+    groups = [[0]]
+    for i, joined in enumerate(same, start=1):
+        if joined and len(groups[-1]) < config.max_group_size:
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return groups
@@ -0,0 +1,193 @@
+"""
+Métricas do processamento: tempos por etapa, bytes enviados, tokens e 429.
+
+Cada medição é uma linha JSON no ficheiro de métricas (escrito em blocos,
+para não pesar no processamento):
+
+    {"ts": 1718000000.1, "type": "timing", "stage": "api", "seconds": 2.31, "model": "...", ...}
+    {"ts": 1718000000.2, "type": "count", "name": "retry_429", "amount": 1, "model": "..."}
+
+No fim da execução é acrescentada uma linha "summary" e impresso um resumo
+com percentis por etapa. Com `profile_dir`, as etapas envolvidas com
+`profiled` correm também sob o cProfile (um perfil agregado por etapa).
+
+    python metrics.py processing_metrics.jsonl   # resumo de uma execução gravada
+"""
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+FLUSH_EVERY = 200 # Linhas em memória antes de escrever no ficheiro
+PERCENTILES = (50, 90, 99)
+
+
+class Metrics:
+    """Recolha de métricas partilhada pelas threads. Sem `path`, só em memória."""
+
+    def __init__(self, path: Path | None = None, profile_dir: Path | None = None):
+        self.path = Path(path) if path else None
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.run_id = uuid.uuid4().hex[:12]
+        self._timings = {}   # etapa -> lista de segundos
+        self._counters = {}  # nome -> total
+        self._buffer = []
+        self._profiles = {}  # etapa -> pstats.Stats agregado
+        self._lock = threading.Lock()
+
+    # --- Registo ---
+
+    def _emit(self, record: dict):
+        if self.path is None:
+            return
+        record = {"ts": round(time.time(), 3), "run": self.run_id, **record}
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(self._buffer) >= FLUSH_EVERY:
+            self._flush()
+
+    def _flush(self):
+        if self.path is None or not self._buffer:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer = []
+
+    def observe(self, stage: str, seconds: float, **fields):
+        """Regista a duração de uma ocorrência de `stage` (com campos extra opcionais)."""
+        with self._lock:
+            self._timings.setdefault(stage, []).append(seconds)
+            self._emit({"type": "timing", "stage": stage, "seconds": round(seconds, 6), **fields})
+
+    def count(self, name: str, amount: int = 1, **fields):
+        """Soma `amount` ao contador `name` (bytes, tokens, 429, ...)."""
+        if not amount:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            self._emit({"type": "count", "name": name, "amount": amount, **fields})
+
+    @contextmanager
+    def timer(self, stage: str, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **fields)
+
+    # --- Perfis (cProfile) ---
+
+    def profiled(self, stage: str, fn):
+        """Devolve `fn` a correr sob o cProfile (só com `profile_dir`); o perfil é somado por etapa."""
+        if self.profile_dir is None:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Outro perfil ativo nesta thread (etapas aninhadas): conta só no de fora.
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    if stage in self._profiles:
+                        self._profiles[stage].add(profile)
+                    else:
+                        self._profiles[stage] = pstats.Stats(profile, stream=io.StringIO())
+        return wrapper
+
+    def _dump_profiles(self):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        for stage, stats in self._profiles.items():
+            path = self.profile_dir / f"{stage}.prof"
+            stats.dump_stats(path)
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats("cumulative").print_stats(15)
+            print(f"\n--- Perfil '{stage}' ({path}) ---")
+            print(out.getvalue().strip())
+
+    # --- Resumo ---
+
+    def summary(self) -> dict:
+        with self._lock:
+            return summarize(self._timings, self._counters)
+
+    def close(self, verbose: bool = True):
+        """Escreve o resumo, grava os perfis e esvazia o buffer."""
+        summary = self.summary()
+        with self._lock:
+            self._emit({"type": "summary", **summary})
+            self._flush()
+        if verbose:
+            print_summary(summary)
+            if self.profile_dir is not None and self._profiles:
+                self._dump_profiles()
+
+
+def summarize(timings: dict, counters: dict) -> dict:
+    """Nº, total, média e percentis de cada etapa, mais os contadores."""
+    stages = {}
+    for stage, values in timings.items():
+        values = np.asarray(values, dtype=np.float64)
+        stages[stage] = {
+            "count": int(values.size),
+            "total": round(float(values.sum()), 3),
+            "mean": round(float(values.mean()), 4),
+            **{f"p{p}": round(float(np.percentile(values, p)), 4) for p in PERCENTILES},
+            "max": round(float(values.max()), 4),
+        }
+    return {"stages": stages, "counters": dict(counters)}
+
+
+def print_summary(summary: dict):
+    print("\n--- Métricas por etapa (segundos) ---")
+    header = f"{'etapa':<14}{'n':>7}{'total':>10}{'média':>9}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'máx':>9}"
+    print(header)
+    for stage, s in sorted(summary["stages"].items(), key=lambda item: -item[1]["total"]):
+        print(f"{stage:<14}{s['count']:>7}{s['total']:>10.2f}{s['mean']:>9.3f}"
+              + "".join(f"{s['p' + str(p)]:>9.3f}" for p in PERCENTILES) + f"{s['max']:>9.3f}")
+    if summary["counters"]:
+        print("Contadores:")
+        for name, total in sorted(summary["counters"].items()):
+            print(f"  {name:<22} {total}")
+
+
+def load_summary(path: Path, run_id: str | None = None) -> dict:
+    """Recalcula o resumo de uma execução a partir do JSONL (por omissão, a última)."""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    if run_id is None and records:
+        run_id = records[-1].get("run")
+    timings, counters = {}, {}
+    for record in records:
+        if record.get("run") != run_id:
+            continue
+        if record["type"] == "timing":
+            timings.setdefault(record["stage"], []).append(record["seconds"])
+        elif record["type"] == "count":
+            counters[record["name"]] = counters.get(record["name"], 0) + record["amount"]
+    return summarize(timings, counters)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python metrics.py <ficheiro de métricas> [id da execução]")
+        sys.exit(1)
+    print_summary(load_summary(Path(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else None))
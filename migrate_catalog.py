@@ -0,0 +1,326 @@
+"""
+Migração e deduplicação dos catálogos antigos para a base de estado.
+
+Junta, pela ordem indicada (do mais antigo para o mais recente), qualquer
+combinação de:
+  - `dados_oculos.json` do processar_oculos.py: lista plana de
+    {"referencia", "cor"}, sem nomes de ficheiro. Com --legacy-output (a
+    PASTA_SAIDA desse script, com <referência>/<cor>_<nome original>) os
+    ficheiros de cada cor são recuperados dessa pasta;
+  - `extracted_data.json`, `extracted_data2.json`, ...: formato aninhado;
+  - journals `*.journal.jsonl` ainda não compactados.
+O catálogo que já estiver na base entra primeiro.
+
+Os ficheiros JSON são lidos elemento a elemento (sem carregar a lista) e a
+deduplicação é uma só passagem com índices em dicionário: cada imagem é
+identificada pelo SHA-256 do conteúdo (quando é encontrada em --images ou
+na pasta antiga) ou, na falta dele, pelo nome. Repetições da mesma
+referência/cor/imagem são descartadas; o que não bate certo fica no
+relatório de conflitos, e vale a fonte mais recente:
+  - uma imagem atribuída a referências/cores diferentes;
+  - o mesmo nome de ficheiro com conteúdos diferentes;
+  - tamanhos diferentes para a mesma referência.
+
+    python migrate_catalog.py dados_oculos.json extracted_data2.json extracted_data.json \\
+        --legacy-output PASTA_SAIDA_ANTIGA --images PASTA_ENTRADA [--json extracted_data.json] [--dry-run]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from response_cache import file_hash
+from state_store import STATE_DB, StateStore
+
+HASH_WORKERS = 8
+READ_CHUNK = 1024 * 1024
+MAX_REPORTED_CONFLICTS = 50
+
+
+@dataclass
+class SourceGroup:
+    """Uma cor de uma referência, tal como vem de uma fonte (a imagem chave primeiro)."""
+    source: str
+    reference: str
+    sizes: tuple
+    color: str
+    files: list
+    paths: dict = field(default_factory=dict)  # nome -> caminho conhecido (para o hash)
+
+
+@dataclass
+class MergeReport:
+    sources: dict = field(default_factory=dict)  # fonte -> cores lidas
+    duplicates: int = 0
+    legacy_without_files: int = 0
+    hashed: int = 0
+    conflicts: list = field(default_factory=list)
+
+    def conflict(self, text: str):
+        self.conflicts.append(text)
+
+
+# --- Leitura das fontes ---
+
+def iter_json_array(path: Path, chunk_size: int = READ_CHUNK):
+    """Elementos de uma lista JSON, lidos por blocos (a lista nunca está toda em memória)."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, started = "", 0, False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer) or (started and buffer[pos] != "]"):
+                # Pode faltar texto para o próximo elemento: tenta descodificar, lê mais se não der.
+                try:
+                    if pos >= len(buffer):
+                        raise json.JSONDecodeError("fim do bloco", buffer, pos)
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    more = f.read(chunk_size)
+                    if not more:
+                        raise ValueError(f"{path}: lista JSON incompleta ou inválida")
+                    buffer, pos = buffer[pos:] + more, 0
+                    continue
+                yield item
+                pos = end
+                continue
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{path}: não é uma lista JSON")
+                started = True
+                pos += 1
+                continue
+            return  # "]"
+
+
+def _legacy_files(legacy_output: Path, reference: str, colors: set, cache: dict) -> dict:
+    """Cor -> {nome original: caminho} da pasta de uma referência (<cor>_<nome original>)."""
+    if reference not in cache:
+        by_color = {}
+        # Como o processar_oculos.py limpa a referência para o nome da pasta.
+        folder = legacy_output / reference.replace('/', '_').replace('\\', '_')
+        if folder.is_dir():
+            # A cor mais comprida primeiro: "C1_A_x.jpg" é da cor "C1_A", não de "C1".
+            ordered = sorted(colors, key=len, reverse=True)
+            for entry in os.scandir(folder):
+                color = next((c for c in ordered if entry.name.startswith(f"{c}_")), None)
+                if color is not None and entry.is_file():
+                    by_color.setdefault(color, {})[entry.name[len(color) + 1:]] = Path(entry.path)
+        cache[reference] = by_color
+    return cache[reference]
+
+
+def read_legacy(path: Path, legacy_output: Path | None, report: MergeReport):
+    """Lista plana do processar_oculos.py. Sem pasta antiga não há ficheiros: só é contado."""
+    records = [(str(item["referencia"]), str(item["cor"])) for item in iter_json_array(path)
+               if item.get("referencia") and item.get("cor")]
+    colors_by_ref = {}
+    for reference, color in records:
+        colors_by_ref.setdefault(reference, set()).add(color)
+    cache = {}
+    for reference, color in dict.fromkeys(records):  # Cada (referência, cor) uma vez, pela 1ª ocorrência
+        files = {}
+        if legacy_output is not None:
+            files = _legacy_files(legacy_output, reference, colors_by_ref[reference], cache).get(color, {})
+        if not files:
+            report.legacy_without_files += 1
+            continue
+        names = sorted(files)  # O script antigo não guardava a imagem chave
+        yield SourceGroup(path.name, reference, (None, None, None), color, names, files)
+
+
+def read_nested(path: Path):
+    """extracted_data.json (formato aninhado)."""
+    for entry in iter_json_array(path):
+        sizes = (entry.get("size1"), entry.get("size2"), entry.get("size3"))
+        for group in entry.get("image_files", []):
+            if group.get("key_file") and group.get("color"):
+                yield SourceGroup(path.name, str(entry["reference"]), sizes, group["color"],
+                                  [group["key_file"]] + list(group.get("additional_files", [])))
+
+
+def read_journal(path: Path):
+    """Journal do catálogo (uma cor por linha, ver catalog_journal.py)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Linha final interrompida
+            sizes = (record.get("size1"), record.get("size2"), record.get("size3"))
+            yield SourceGroup(path.name, str(record["reference"]), sizes, record["color"],
+                              [record["key_file"]] + list(record.get("additional_files", [])))
+
+
+def read_store(store: StateStore):
+    for entry in store.iter_catalogue():
+        sizes = (entry["size1"], entry["size2"], entry["size3"])
+        for group in entry["image_files"]:
+            yield SourceGroup("base de estado", entry["reference"], sizes, group["color"],
+                              [group["key_file"]] + group["additional_files"])
+
+
+def read_source(path: Path, legacy_output: Path | None, report: MergeReport):
+    if path.name.endswith(".jsonl"):
+        return read_journal(path)
+    first = next(iter_json_array(path), None)
+    if first is not None and "referencia" in first:
+        return read_legacy(path, legacy_output, report)
+    return read_nested(path)
+
+
+# --- Junção ---
+
+def _index_images(folders: list[Path]) -> dict:
+    """Nome -> caminho das imagens nas pastas indicadas (uma listagem por pasta)."""
+    index = {}
+    for folder in folders:
+        for entry in os.scandir(folder):
+            if entry.is_file():
+                index.setdefault(entry.name, Path(entry.path))
+    return index
+
+
+def merge(groups: list[SourceGroup], images: dict, report: MergeReport) -> list:
+    """
+    Uma passagem sobre as cores de todas as fontes, pela ordem. Devolve o
+    catálogo no formato aninhado, sem repetições.
+    """
+    # Hash de todos os ficheiros encontrados, em paralelo (o hashlib liberta o GIL).
+    paths = {}
+    for group in groups:
+        for name in group.files:
+            path = group.paths.get(name) or images.get(name)
+            if path is not None:
+                paths[path] = name
+    name_hash = {}  # nome -> hash do 1º ficheiro encontrado (para as fontes sem o ficheiro)
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        for (path, name), digest in zip(list(paths.items()), pool.map(file_hash, paths)):
+            paths[path] = digest
+            name_hash.setdefault(name, digest)
+    report.hashed = len(paths)
+
+    owner = {}       # identidade da imagem -> (referência, cor)
+    by_name = {}     # nome -> identidade (a base de estado indexa por nome)
+    merged = {}      # (referência, cor) -> {identidade: nome}, a chave primeiro
+    sizes = {}       # referência -> tamanhos
+    for group in groups:
+        ref_color = (group.reference, group.color)
+        if any(group.sizes):
+            previous = sizes.get(group.reference)
+            if previous is not None and any(previous) and previous != group.sizes:
+                report.conflict(f"{group.reference}: tamanhos {'/'.join(map(str, previous))} -> "
+                                f"{'/'.join(map(str, group.sizes))} ({group.source})")
+            sizes[group.reference] = group.sizes
+        else:
+            sizes.setdefault(group.reference, group.sizes)
+        target = merged.setdefault(ref_color, {})
+        for position, name in enumerate(group.files):
+            path = group.paths.get(name) or images.get(name)
+            if path is not None:
+                identity = ("sha256", paths[path])
+            elif name in name_hash:
+                identity = ("sha256", name_hash[name])
+            else:
+                identity = ("name", name)
+            previous = owner.get(identity)
+            if previous == ref_color:
+                report.duplicates += 1
+                if position == 0 and next(iter(target)) != identity:
+                    # A fonte mais recente escolheu outra imagem chave.
+                    target.pop(identity)
+                    merged[ref_color] = target = {identity: name, **target}
+                continue
+            if previous is not None:
+                report.conflict(f"{name}: {'/'.join(previous)} -> {'/'.join(ref_color)} ({group.source})")
+                merged[previous].pop(identity, None)
+            other = by_name.get(name)
+            if other is not None and other != identity:
+                report.conflict(f"{name}: o mesmo nome com outro conteúdo; fica o de {group.source}")
+                merged[owner.pop(other)].pop(other, None)
+            owner[identity] = ref_color
+            by_name[name] = identity
+            if position == 0:
+                merged[ref_color] = target = {identity: name, **target}
+            else:
+                target[identity] = name
+
+    catalogue = {}
+    for (reference, color), files in merged.items():
+        if not files:
+            report.conflict(f"{reference}/{color}: sem imagens depois da deduplicação (removida)")
+            continue
+        names = list(files.values())
+        entry = catalogue.setdefault(reference, {
+            "reference": reference,
+            **dict(zip(("size1", "size2", "size3"), sizes[reference])),
+            "image_files": [],
+        })
+        entry["image_files"].append({"color": color, "key_file": names[0], "additional_files": names[1:]})
+    return list(catalogue.values())
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Migra e deduplica catálogos antigos para a base de estado.")
+    parser.add_argument("sources", nargs="+", type=Path, help="Do mais antigo para o mais recente")
+    parser.add_argument("--legacy-output", type=Path, help="Pasta de saída do processar_oculos.py")
+    parser.add_argument("--images", type=Path, nargs="*", default=[], help="Pastas com as imagens (para o hash)")
+    parser.add_argument("--db", type=Path, default=STATE_DB, help="Base de estado (destino)")
+    parser.add_argument("--json", type=Path, help="Escreve também o catálogo aninhado neste ficheiro")
+    parser.add_argument("--dry-run", action="store_true", help="Só o relatório, sem gravar")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    report = MergeReport()
+    store = StateStore(args.db)
+    try:
+        groups = list(read_store(store))
+        report.sources["base de estado"] = len(groups)
+        for path in args.sources:
+            try:
+                read = list(read_source(path, args.legacy_output, report))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"ERRO: Não foi possível ler {path}: {e}")
+                sys.exit(1)
+            report.sources[path.name] = len(read)
+            groups += read
+
+        catalogue = merge(groups, _index_images(args.images), report)
+        colors = sum(len(entry["image_files"]) for entry in catalogue)
+        images = sum(1 + len(g["additional_files"]) for entry in catalogue for g in entry["image_files"])
+
+        print("Fontes (cores lidas):")
+        for source, count in report.sources.items():
+            print(f"  {source:<30} {count}")
+        if report.legacy_without_files:
+            print(f"Cores antigas sem ficheiros encontrados (ignoradas): {report.legacy_without_files}")
+        print(f"Imagens com hash do conteúdo: {report.hashed}")
+        print(f"Repetições descartadas: {report.duplicates}")
+        print(f"Resultado: {len(catalogue)} referências, {colors} cores, {images} imagens "
+              f"({time.perf_counter() - start:.1f}s).")
+        if report.conflicts:
+            print(f"Conflitos ({len(report.conflicts)}; vale a fonte mais recente):")
+            for text in report.conflicts[:MAX_REPORTED_CONFLICTS]:
+                print(f"  {text}")
+            if len(report.conflicts) > MAX_REPORTED_CONFLICTS:
+                print(f"  ... e mais {len(report.conflicts) - MAX_REPORTED_CONFLICTS}.")
+
+        if args.dry_run:
+            print("Nada gravado (--dry-run).")
+            return
+        store.import_entries(catalogue, replace=True)
+        print(f"Catálogo gravado em {args.db}.")
+        if args.json:
+            store.export_json(args.json)
+            print(f"Catálogo aninhado escrito em {args.json}.")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
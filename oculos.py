@@ -0,0 +1,251 @@
+"""
+Ponto de entrada único do processamento de óculos.
+
+    python oculos.py run [--watch] [--distributed] [--profile] [--dry-run] [--legacy]
+    python oculos.py status
+    python oculos.py export [destino.json|.csv|.jsonl|.parquet] [--format ...]
+    python oculos.py retry [ficheiros...] [--reason MOTIVO] [--all] [--list] [--purge] [--run]
+    python oculos.py bench [opções do benchmark.py]
+    python oculos.py migrate fontes... [opções do migrate_catalog.py]
+
+Opções comuns a todos os comandos: --input, --output, --batch-size e --db
+(as pastas também podem vir de OCULOS_ENTRADA / OCULOS_SAIDA no .env).
+
+Cada comando só importa o que usa. `status`, `export` e `retry` leem apenas a
+base de estado (SQLite): não carregam o Pillow, o numpy nem o
+google.generativeai, não configuram a API nem verificam a chave, por isso
+arrancam em milissegundos mesmo com dezenas de milhares de registos. O `run`
+usa o processar_oculos2 (cópia para a pasta de saída, extracted_data.json);
+com --legacy, o processar_oculos original (move os ficheiros, dados_oculos.json).
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import dotenv
+
+from state_store import STATE_DB
+from watcher import IMAGE_PATTERNS, matches
+
+
+def _format_time(timestamp: float | None) -> str:
+    if timestamp is None:
+        return "nunca"
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def _pipeline(args):
+    """processar_oculos2 configurado com as opções comuns (importa o Pillow, o numpy, ...)."""
+    import processar_oculos2 as pipeline
+
+    pipeline.configure(args.input, args.output, args.batch_size)
+    pipeline.STATE_DB = args.db
+    return pipeline
+
+
+def _run_pipeline(pipeline, args) -> int:
+    if not pipeline.PASTA_ENTRADA.is_dir():
+        print(f"ERRO: A pasta de entrada '{pipeline.PASTA_ENTRADA}' não foi encontrada.")
+        return 1
+    pipeline.load_models()
+    pipeline.main(watch=pipeline.WATCH or args.watch, distributed=pipeline.DISTRIBUTED or args.distributed,
+                  profile=pipeline.PROFILE or args.profile)
+    return 0
+
+
+# --- Comandos ---
+
+def cmd_run(args) -> int:
+    if args.legacy:
+        import processar_oculos as legacy
+
+        input_dir = str(args.input or legacy.PASTA_ENTRADA)
+        if not os.path.isdir(input_dir):
+            print(f"ERRO: A pasta de entrada '{input_dir}' não foi encontrada.")
+            return 1
+        legacy.configurar_api()
+        legacy.processar_lotes_com_gemini(input_dir, str(args.output or legacy.PASTA_SAIDA))
+        return 0
+
+    pipeline = _pipeline(args)
+    if args.dry_run:
+        if not pipeline.PASTA_ENTRADA.is_dir():
+            print(f"ERRO: A pasta de entrada '{pipeline.PASTA_ENTRADA}' não foi encontrada.")
+            return 1
+        pipeline.dry_run()
+        return 0
+    return _run_pipeline(pipeline, args)
+
+
+def cmd_status(args) -> int:
+    from budget import Budget
+    from failure_queue import FailureQueue
+    from state_store import StateStore
+
+    if not args.db.exists():
+        print(f"Sem base de estado em {args.db}: nada foi processado ainda.")
+        return 0
+    store = StateStore(args.db)
+    failures = FailureQueue(args.db)
+    usage = Budget(args.db)
+    try:
+        counts = store.counts()
+        print(f"Catálogo ({args.db}): {counts['refs']} referências, {counts['colors']} cores, "
+              f"{counts['files']} imagens processadas.")
+
+        input_dir = args.input or os.getenv("OCULOS_ENTRADA")
+        if input_dir and Path(input_dir).is_dir():
+            done = store.processed_filenames() | failures.blocked_filenames()
+            names = [entry.name for entry in os.scandir(input_dir)
+                     if entry.is_file() and matches(entry.name, IMAGE_PATTERNS)]
+            pending = sum(1 for name in names if name not in done)
+            print(f"Entrada ({input_dir}): {len(names)} imagens, {pending} por processar.")
+
+        summary = failures.summary()
+        if summary:
+            print("Falhas:")
+            for reason, files, dead, next_retry in summary:
+                print(f"  {reason:<20} {files:>6} ficheiros  ({dead} sem mais tentativas, "
+                      f"próxima: {_format_time(next_retry)})")
+        else:
+            print("Falhas: nenhuma.")
+
+        requests_today, cost_today = usage.today()
+        print(f"API hoje: {requests_today} pedidos, ${cost_today:.2f} (estimado).")
+    finally:
+        usage.close()
+        failures.close()
+        store.close()
+    return 0
+
+
+def cmd_export(args) -> int:
+    if not args.db.exists():
+        print(f"ERRO: A base de estado '{args.db}' não existe.")
+        return 1
+    fmt = args.format or args.destination.suffix.lstrip(".").lower() or "json"
+    if fmt == "json":
+        from state_store import StateStore
+
+        store = StateStore(args.db)
+        try:
+            store.export_json(args.destination)
+        finally:
+            store.close()
+        print(f"Catálogo exportado para {args.destination}.")
+        return 0
+
+    from catalog_query import CatalogQuery, export_rows
+
+    query = CatalogQuery(args.db)
+    try:
+        count = export_rows(query, args.destination, fmt)
+    except (ValueError, RuntimeError) as e:
+        print(f"ERRO: {e}")
+        return 1
+    finally:
+        query.close()
+    print(f"{count} imagens exportadas para {args.destination}.")
+    return 0
+
+
+def cmd_retry(args) -> int:
+    from failure_queue import FailureQueue, print_entries
+
+    queue = FailureQueue(args.db)
+    try:
+        if args.list:
+            print_entries(queue, args.reason)
+            return 0
+        if not (args.filenames or args.reason or args.all):
+            print("Indique ficheiros, --reason ou --all.")
+            return 1
+        action = queue.purge if args.purge else queue.requeue
+        count = action(args.filenames or None, args.reason)
+    finally:
+        queue.close()
+    print(f"{count} entradas {'apagadas' if args.purge else 'reenviadas'}.")
+    if args.run and count:
+        return _run_pipeline(_pipeline(args), args)
+    return 0
+
+
+def cmd_bench(args) -> int:
+    import benchmark
+
+    benchmark.main(args.forwarded_args)
+    return 0
+
+
+def cmd_migrate(args) -> int:
+    import migrate_catalog
+
+    migrate_catalog.main(args.forwarded_args)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--input", type=Path, help="Pasta de entrada (PASTA_ENTRADA)")
+    common.add_argument("--output", type=Path, help="Pasta de saída (PASTA_SAIDA)")
+    common.add_argument("--batch-size", type=int, help="Tamanho máximo de um lote (BATCH_SIZE)")
+    common.add_argument("--db", type=Path, default=STATE_DB, help="Base de estado")
+
+    parser = argparse.ArgumentParser(description="Processamento de fotografias de óculos.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", parents=[common], help="Processa a pasta de entrada")
+    run_parser.add_argument("--watch", action="store_true", help="Fica a vigiar a pasta (modo contínuo)")
+    run_parser.add_argument("--distributed", action="store_true", help="Vários trabalhadores na mesma pasta")
+    run_parser.add_argument("--profile", action="store_true", help="Perfis cProfile das etapas")
+    run_parser.add_argument("--dry-run", action="store_true", help="Só a projeção de pedidos, tokens e custo")
+    run_parser.add_argument("--legacy", action="store_true", help="Script original (move os ficheiros)")
+    run_parser.set_defaults(handler=cmd_run)
+
+    status_parser = commands.add_parser("status", parents=[common], help="Estado do catálogo e das falhas")
+    status_parser.set_defaults(handler=cmd_status)
+
+    export_parser = commands.add_parser("export", parents=[common], help="Exporta o catálogo da base de estado")
+    export_parser.add_argument("destination", nargs="?", type=Path, default=Path("extracted_data.json"))
+    export_parser.add_argument("--format", choices=("json", "csv", "jsonl", "parquet"),
+                               help="Por omissão, a extensão do destino (json: formato aninhado do catálogo)")
+    export_parser.set_defaults(handler=cmd_export)
+
+    retry_parser = commands.add_parser("retry", parents=[common], help="Volta a tentar ficheiros falhados")
+    retry_parser.add_argument("filenames", nargs="*")
+    retry_parser.add_argument("--reason", help="Só as falhas com este motivo")
+    retry_parser.add_argument("--all", action="store_true", help="Todas as falhas")
+    retry_actions = retry_parser.add_mutually_exclusive_group()
+    retry_actions.add_argument("--list", action="store_true", help="Só lista as falhas")
+    retry_actions.add_argument("--purge", action="store_true",
+                               help="Apaga da fila (os ficheiros voltam a ser processados normalmente)")
+    retry_actions.add_argument("--run", action="store_true", help="Processa logo a seguir")
+    retry_parser.set_defaults(handler=cmd_retry, watch=False, distributed=False, profile=False)
+
+    # As opções do bench e do migrate são as do benchmark.py / migrate_catalog.py e passam-lhes
+    # tal como vêm (ver main).
+    bench_parser = commands.add_parser("bench", help="Benchmark com o backend simulado (ver benchmark.py)",
+                                       add_help=False)
+    bench_parser.set_defaults(handler=cmd_bench)
+
+    migrate_parser = commands.add_parser("migrate", help="Junta e deduplica catálogos antigos (ver migrate_catalog.py)",
+                                         add_help=False)
+    migrate_parser.set_defaults(handler=cmd_migrate)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    dotenv.load_dotenv()
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command in ("bench", "migrate"):
+        args.forwarded_args = extra
+    elif extra:
+        parser.error(f"opções desconhecidas: {' '.join(extra)}")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
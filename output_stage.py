@@ -0,0 +1,224 @@
+"""
+Organização das imagens na pasta de saída (PASTA_SAIDA/<referência>/).
+
+Cada imagem de um produto fica como `<referência>_<cor>_<n>.<ext>`. O índice
+`n` é atribuído sem colisões por (referência, cor): o ficheiro de destino é
+sempre criado de forma exclusiva, por isso um segundo lote da mesma
+referência (ou outro trabalhador, ver claims.py) nunca escreve por cima. Uma
+imagem que já lá esteja com o mesmo conteúdo não é colocada de novo: com o
+mesmo tamanho, compara-se o SHA-256 (o content_hash calculado na
+descodificação; o dos ficheiros de saída é lido uma vez) ou, sem ele, o
+conteúdo byte a byte.
+
+Colocação, por ordem de preferência (modo "auto"):
+  - reflink (Linux, btrfs/XFS): cópia copy-on-write, instantânea;
+  - cópia normal, num conjunto de threads.
+O modo "hardlink" (instantâneo, mesmo disco) só é usado se for pedido: o
+ficheiro de saída e o de entrada passam a ser o mesmo, e retocar a imagem
+na pasta de saída altera o original (que seria processado e pago de novo,
+ver fingerprints.py).
+A extensão original é mantida; com `image_format` as imagens são convertidas
+(e nesse caso são sempre escritas de novo).
+"""
+import filecmp
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from response_cache import file_hash
+
+LINK_MODES = ("auto", "hardlink", "reflink", "copy")
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "TIFF": ".tiff"}
+DEFAULT_WORKERS = 8
+
+_FICLONE = 0x40049409  # ioctl do Linux para reflinks
+
+
+def safe_name(text) -> str:
+    """Texto utilizável num nome de ficheiro (sem separadores de pastas)."""
+    return str(text).replace('/', '_').replace('\\', '_').strip()
+
+
+def _reflink(src: Path, dest: Path):
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflink não suportado nesta plataforma")
+    import fcntl
+    with open(src, 'rb') as source, open(dest, 'xb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), _FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dest)
+            raise
+
+
+def _copy(src: Path, dest: Path):
+    with open(src, 'rb') as source, open(dest, 'xb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    shutil.copystat(src, dest)
+
+
+class OutputStage:
+    """Coloca as imagens na pasta de saída em paralelo, sem colisões de nomes."""
+
+    def __init__(self, root: Path, mode: str = "auto", image_format: str | None = None,
+                 quality: int = 92, workers: int = DEFAULT_WORKERS, on_error=None, metrics=None):
+        if mode not in LINK_MODES:
+            raise ValueError(f"Modo desconhecido: {mode} (use um de {LINK_MODES})")
+        self.root = Path(root)
+        self.mode = mode
+        self.image_format = image_format
+        self.quality = quality
+        self.on_error = on_error          # on_error(origem, exceção), chamado na thread da cópia
+        self.metrics = metrics            # metrics.Metrics opcional (etapa "copy")
+        self.counts = {}                  # método -> nº de imagens colocadas
+        self._next_index = {}             # (pasta, prefixo) -> próximo índice provável
+        self._existing = {}               # (pasta, prefixo) -> ficheiros já presentes
+        self._method = {}                 # (disco de origem, disco de destino) -> método
+        self._hashes = {}                 # ficheiro de saída -> SHA-256 do conteúdo
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output")
+
+    def _method_for(self, src: Path, target_dir: Path) -> str:
+        """Método a usar entre os discos de `src` e `target_dir`, testado uma vez por par."""
+        if self.image_format:
+            return "transcode"
+        if self.mode != "auto":
+            return self.mode
+        devices = (src.stat().st_dev, target_dir.stat().st_dev)
+        with self._lock:
+            if devices not in self._method:
+                probe = target_dir / f".probe-{uuid.uuid4().hex[:8]}"
+                try:
+                    self._write("reflink", src, probe)
+                except OSError:
+                    self._method[devices] = "copy"
+                else:
+                    probe.unlink()
+                    self._method[devices] = "reflink"
+            return self._method[devices]
+
+    def _index_state(self, target_dir: Path, prefix: str) -> tuple:
+        """Lista a pasta uma vez por (referência, cor): ficheiros existentes e maior índice."""
+        key = (target_dir, prefix)
+        with self._lock:
+            if key not in self._next_index:
+                pattern = re.compile(re.escape(prefix) + r"_(\d+)\.[^.]+$")
+                existing, highest = [], -1
+                if target_dir.exists():
+                    for entry in os.scandir(target_dir):
+                        match = pattern.match(entry.name)
+                        if match:
+                            existing.append(Path(entry.path))
+                            highest = max(highest, int(match.group(1)))
+                self._existing[key] = existing
+                self._next_index[key] = highest + 1
+            return key, list(self._existing[key])
+
+    def _hash_of(self, path: Path) -> str:
+        with self._lock:
+            digest = self._hashes.get(path)
+        if digest is None:
+            digest = file_hash(path)
+            with self._lock:
+                self._hashes[path] = digest
+        return digest
+
+    def _already_placed(self, src: Path, existing: list[Path], content_hash: str | None) -> Path | None:
+        if self.image_format:
+            return None
+        src_stat = src.stat()
+        for path in existing:
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_size != src_stat.st_size:
+                continue
+            if st.st_ino == src_stat.st_ino and st.st_dev == src_stat.st_dev:
+                return path  # Hardlink do próprio ficheiro
+            try:
+                same = (self._hash_of(path) == content_hash) if content_hash else filecmp.cmp(src, path, shallow=False)
+            except FileNotFoundError:
+                continue
+            if same:
+                return path
+        return None
+
+    def _write(self, method: str, src: Path, dest: Path):
+        if method == "hardlink":
+            os.link(src, dest)
+        elif method == "reflink":
+            _reflink(src, dest)
+            shutil.copystat(src, dest)
+        elif method == "copy":
+            _copy(src, dest)
+        else:
+            with Image.open(src) as img, open(dest, 'xb') as target:
+                if self.image_format == "JPEG" and img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                img.save(target, self.image_format, quality=self.quality)
+
+    def place(self, src: Path, reference: str, color: str, content_hash: str | None = None) -> Path:
+        """
+        Coloca `src` em root/<referência>/ com o próximo índice livre. Devolve o
+        destino. `content_hash`: SHA-256 de `src`, se já for conhecido.
+        """
+        target_dir = self.root / safe_name(reference)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        prefix = f"{safe_name(reference)}_{safe_name(color)}"
+        key, existing = self._index_state(target_dir, prefix)
+        duplicate = self._already_placed(src, existing, content_hash)
+        if duplicate is not None:
+            return duplicate
+
+        extension = FORMAT_EXTENSIONS[self.image_format] if self.image_format else src.suffix.lower()
+        method = self._method_for(src, target_dir)
+        while True:
+            with self._lock:
+                index = self._next_index[key]
+                self._next_index[key] += 1
+            dest = target_dir / f"{prefix}_{index}{extension}"
+            start = time.perf_counter()
+            try:
+                self._write(method, src, dest)
+            except FileExistsError:
+                continue  # Índice ocupado (outro trabalhador ou ficheiro antigo): o seguinte
+            except Exception:
+                dest.unlink(missing_ok=True)  # Nada de ficheiros meio escritos
+                raise
+            if self.metrics is not None:
+                self.metrics.observe("copy", time.perf_counter() - start, method=method)
+            with self._lock:
+                self._existing[key].append(dest)
+                if content_hash and method != "transcode":
+                    self._hashes[dest] = content_hash
+                self.counts[method] = self.counts.get(method, 0) + 1
+            return dest
+
+    def _place_reporting(self, src: Path, reference: str, color: str, content_hash: str | None) -> Path | None:
+        try:
+            return self.place(src, reference, color, content_hash)
+        except Exception as e:
+            if self.on_error:
+                self.on_error(src, e)
+            return None
+
+    def submit(self, sources: list[Path], reference: str, color: str,
+               content_hashes: list[str | None] | None = None) -> list[Future]:
+        """Coloca as imagens de um produto em segundo plano (`content_hashes`: um por imagem, se conhecidos)."""
+        hashes = content_hashes or [None] * len(sources)
+        return [self._pool.submit(self._place_reporting, src, reference, color, digest)
+                for src, digest in zip(sources, hashes)]
+
+    def close(self):
+        """Espera pelas colocações pendentes."""
+        self._pool.shutdown(wait=True)
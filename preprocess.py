@@ -0,0 +1,194 @@
+"""
+Redução das imagens antes do envio à API.
+
+As fotografias do estúdio têm 20–40 MP; enviá-las em resolução total torna
+cada pedido lento e caro em tokens. Aqui cada imagem é:
+  - recortada (opcionalmente) à caixa do produto, detetada contra o fundo;
+  - reduzida até um lado maior alvo;
+  - recodificada em JPEG/WebP com qualidade ajustável.
+
+Com uma zona da haste configurada (`temple_box`), guarda-se também um
+recorte dessa zona em maior resolução, usado na leitura do texto
+"Referência Tamanho[]Tamanho-Tamanho Cor". Sem ela não há recorte: seria o
+produto inteiro numa resolução maior, mais caro em tokens e sem mais foco.
+"""
+import hashlib
+import io
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image, ImageChops, ImageOps
+
+from grouping import compute_features
+from text_detector import text_score
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass(frozen=True)
+class PreprocessConfig:
+    """Parâmetros da redução. Os valores por omissão servem para o estúdio atual."""
+    long_edge: int = 1536               # Lado maior da imagem enviada (px)
+    crop_to_product: bool = True        # Recortar à caixa do produto
+    image_format: str = "JPEG"          # "JPEG" ou "WEBP"
+    quality: int = 85
+    crop_margin: float = 0.04           # Margem à volta do produto (fração do lado)
+    background_threshold: int = 24      # Diferença mínima de cinzento para "não é fundo"
+    detail_long_edge: int = 3072        # Lado maior do recorte da haste (0 desativa)
+    # Zona da haste, relativa à caixa do produto: (esquerda, topo, direita, fundo)
+    # em frações de 0 a 1, p. ex. (0.0, 0.55, 1.0, 1.0). None (posição variável): sem recorte.
+    temple_box: tuple | None = None
+    compute_features: bool = True       # Hashes/histograma e pontuação de texto (análise local)
+
+
+@dataclass
+class PreparedImage:
+    """Imagem pronta a enviar: bytes codificados e dimensões finais."""
+    name: str
+    data: bytes
+    mime_type: str
+    size: tuple
+    detail_data: bytes | None = None
+    detail_size: tuple | None = None
+    original_size: tuple = field(default=(0, 0))
+    content_hash: str = ""              # SHA-256 do ficheiro original
+    features: dict | None = None        # Ver grouping.compute_features
+    text_score: float = 0.0             # Ver text_detector.text_score
+    captured_at: float | None = None    # Momento da captura (EXIF), em segundos
+    timings: dict = field(default_factory=dict)  # Etapa ("read", "decode", "encode") -> segundos
+
+    def as_part(self) -> dict:
+        """Parte inline aceite por `generate_content`."""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    def detail_part(self) -> dict | None:
+        if self.detail_data is None:
+            return None
+        return {"mime_type": self.mime_type, "data": self.detail_data}
+
+
+def find_product_bbox(img: Image.Image, threshold: int, margin: float) -> tuple | None:
+    """
+    Caixa do produto contra um fundo uniforme (cor tirada das margens).
+    Devolve None se nada se destacar do fundo.
+    """
+    probe = img.convert("L")
+    probe.thumbnail((512, 512))
+    w, h = probe.size
+    border = [probe.getpixel((x, 0)) for x in range(w)] + [probe.getpixel((x, h - 1)) for x in range(w)]
+    border += [probe.getpixel((0, y)) for y in range(h)] + [probe.getpixel((w - 1, y)) for y in range(h)]
+    background = sorted(border)[len(border) // 2]
+
+    diff = ImageChops.difference(probe, Image.new("L", probe.size, background))
+    mask = diff.point(lambda v: 255 if v > threshold else 0)
+    box = mask.getbbox()
+    if box is None:
+        return None
+
+    sx, sy = img.width / w, img.height / h
+    mx, my = int(img.width * margin), int(img.height * margin)
+    left = max(0, int(box[0] * sx) - mx)
+    top = max(0, int(box[1] * sy) - my)
+    right = min(img.width, int(box[2] * sx) + mx)
+    bottom = min(img.height, int(box[3] * sy) + my)
+    return left, top, right, bottom
+
+
+def _encode(img: Image.Image, config: PreprocessConfig) -> bytes:
+    buffer = io.BytesIO()
+    if config.image_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=config.quality, method=4)
+    else:
+        img.save(buffer, format="JPEG", quality=config.quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _fit(img: Image.Image, long_edge: int) -> Image.Image:
+    if max(img.size) <= long_edge:
+        return img
+    scale = long_edge / max(img.size)
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+
+_EXIF_IFD = 0x8769
+_EXIF_DATETIME_ORIGINAL = 36867
+_EXIF_DATETIME = 306
+
+
+def capture_time(img: Image.Image) -> float | None:
+    """Momento da captura segundo o EXIF (DateTimeOriginal), ou None."""
+    try:
+        exif = img.getexif()
+        value = exif.get_ifd(_EXIF_IFD).get(_EXIF_DATETIME_ORIGINAL) or exif.get(_EXIF_DATETIME)
+        if not value:
+            return None
+        return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S").timestamp()
+    except Exception:
+        return None
+
+
+def prepare_image(img: Image.Image, name: str, config: PreprocessConfig) -> PreparedImage:
+    """Reduz uma imagem já aberta e devolve os bytes a enviar."""
+    original_size = img.size
+    captured_at = capture_time(img)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    product = img
+    if config.crop_to_product:
+        box = find_product_bbox(img, config.background_threshold, config.crop_margin)
+        if box is not None:
+            product = img.crop(box)
+
+    upload = _fit(product, config.long_edge)
+    prepared = PreparedImage(
+        name=name,
+        data=_encode(upload, config),
+        mime_type=MIME_TYPES.get(config.image_format, "image/jpeg"),
+        size=upload.size,
+        original_size=original_size,
+        features=compute_features(upload) if config.compute_features else None,
+        text_score=text_score(upload) if config.compute_features else 0.0,
+        captured_at=captured_at,
+    )
+
+    if config.detail_long_edge and config.temple_box is not None:
+        l, t, r, b = config.temple_box
+        pw, ph = product.size
+        temple = product.crop((int(l * pw), int(t * ph), int(r * pw), int(b * ph)))
+        detail = _fit(temple, config.detail_long_edge)
+        prepared.detail_data = _encode(detail, config)
+        prepared.detail_size = detail.size
+    return prepared
+
+
+def prepare_bytes(raw: bytes, name: str, config: PreprocessConfig) -> PreparedImage:
+    """
+    Descodifica (uma única vez) e reduz uma imagem lida para memória.
+    Uma imagem corrompida ou truncada lança exceção no `load()`.
+    """
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(raw)) as img:
+        # Em JPEG, descodifica logo numa escala reduzida (DCT) quando possível.
+        target = max(config.long_edge, config.detail_long_edge if config.temple_box is not None else 0)
+        img.draft("RGB", (target, target))
+        img.load()
+        decoded = time.perf_counter()
+        prepared = prepare_image(img, name, config)
+    prepared.content_hash = hashlib.sha256(raw).hexdigest()
+    prepared.timings["decode"] = decoded - start
+    prepared.timings["encode"] = time.perf_counter() - decoded
+    return prepared
+
+
+def prepare_path(path: Path, config: PreprocessConfig) -> PreparedImage:
+    """Lê, descodifica e reduz a imagem em `path`."""
+    start = time.perf_counter()
+    raw = Path(path).read_bytes()
+    read_seconds = time.perf_counter() - start
+    prepared = prepare_bytes(raw, Path(path).name, config)
+    prepared.timings["read"] = read_seconds
+    return prepared
@@ -1,96 +1,247 @@
+import atexit
+import bisect
 import os
 import json
 import re
-import shutil
+import socket
+import sys
 import time
+from dataclasses import replace
 from pathlib import Path
-import google.generativeai as genai
-from PIL import Image
 import dotenv
 import time
 
+from dispatcher import (
+    QuotaExhaustedError,
+    RateLimiter,
+    call_with_quota,
+    dispatch_ordered,
+    pack_batches,
+)
+from backends import create_backend
+from budget import OUTPUT_TOKENS_PER_BATCH, Budget, BudgetExceededError, plan_run, print_plan, request_tokens
+from catalog_journal import CatalogCorruptError, CatalogJournal
+from batching import AdaptiveBatcher, BatchingConfig, is_file_boundary
+from claims import ClaimManager
+from failure_queue import (
+    API_ERROR,
+    BUDGET,
+    CORRUPT,
+    EMPTY_REFERENCE,
+    INVALID_RESPONSE,
+    NO_KEY,
+    QUOTA,
+    SAVE_ERROR,
+    FailureQueue,
+)
+from event_log import EventLog
+from fingerprints import FingerprintIndex
+from decode_pipeline import DEFAULT_DECODE_WORKERS, DecodedBatch, prefetch_batches
+from grouping import GroupingConfig
+from metrics import Metrics
+from output_stage import OutputStage, safe_name
+from text_detector import rank_candidates
+from validation import validate_result
+from watcher import IMAGE_PATTERNS, FolderWatcher, matches
+from preprocess import PreparedImage, PreprocessConfig
+from response_cache import ResponseCache, make_key, prompt_fingerprint
+from state_store import StateStore
+from structured_output import BATCH_SCHEMA, GROUP_SCHEMA, conform, packed_schema, parse_response
+
 # --- CONFIGURAÇÃO ---
 # 1. Chave de API e Pastas (do seu script)
 
 dotenv.load_dotenv()  # Carrega variáveis do arquivo .env
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-PASTA_SAIDA = Path(r"C:\Documentos\SARON\ImagensProcessadas")
-PASTA_ENTRADA = Path(r"C:\Documentos\SARON\ImagensPreProcessadas")
+# As pastas podem também vir do .env (OCULOS_ENTRADA / OCULOS_SAIDA) ou das
+# opções --input / --output do oculos.py.
+PASTA_SAIDA = Path(os.getenv("OCULOS_SAIDA") or r"C:\Documentos\SARON\ImagensProcessadas")
+PASTA_ENTRADA = Path(os.getenv("OCULOS_ENTRADA") or r"C:\Documentos\SARON\ImagensPreProcessadas")
 # --------------------
 
 # --- Constantes do Script ---
-LOG_FILE = Path("processing_events.log") # Único ficheiro de log
-DATA_FILE = Path("extracted_data.json")
-BATCH_SIZE = 5
+LOG_FILE = Path("processing_events.jsonl") # Registo de eventos (JSONL com rotação, ver event_log.py)
+DATA_FILE = Path("extracted_data.json") # Catálogo compactado
+JOURNAL_FILE = Path("extracted_data.journal.jsonl") # Journal de lotes ainda não compactados
+STATE_DB = Path("processing_state.sqlite") # Estado indexado do processamento
+BATCH_SIZE = 5 # Tamanho máximo de um lote (e dos blocos de descodificação)
+# Cascata de modelos: cada lote vai primeiro ao modelo rápido e só sobe ao
+# seguinte se a resposta falhar a validação ou vier com confiança abaixo de
+# MIN_CONFIDENCE (ver validation.py). Com um só modelo não há cascata.
+MODEL_CASCADE = ['gemini-2.5-flash', 'gemini-2.5-pro']
+MIN_CONFIDENCE = 0.8
+# Uma resposta "sem imagem chave" é normalmente correta (o grupo não tem o
+# texto à vista). Com True também sobe de modelo, se o rápido falhar texto pequeno.
+ESCALATE_NOT_FOUND = False
+# 'gemini' (API real), 'record' (API real, grava as respostas em RECORDINGS_FILE)
+# ou 'mock' (local, sem quota; ver backends.py e benchmark.py)
+BACKEND = 'gemini'
+RECORDINGS_FILE = "gemini_recordings.{model}.jsonl"
+MAX_BATCHES_IN_FLIGHT = 4 # Pedidos (de PACK_BATCHES lotes) enviados em paralelo à API
+USE_RESPONSE_CACHE = True # Reutiliza respostas já obtidas para as mesmas imagens
+# Redução das imagens antes do envio (ver preprocess.py)
+PREPROCESS = PreprocessConfig(long_edge=1536, crop_to_product=True, image_format="JPEG", quality=85)
+# Envia também o recorte ampliado da haste de cada imagem (precisa de PREPROCESS.temple_box)
+SEND_TEMPLE_DETAIL = False
+DECODE_WORKERS = DEFAULT_DECODE_WORKERS # Processos a descodificar imagens
+# Lotes descodificados à espera (limita a memória usada; pelo menos o suficiente para ocupar os processos)
+PREFETCH_BATCHES = max(2, DECODE_WORKERS // BATCH_SIZE + 1)
+# Pedidos submetidos e ainda não gravados (contrapressão entre a API e a gravação, ver dispatch_ordered)
+PIPELINE_AHEAD = 2 * MAX_BATCHES_IN_FLIGHT
+# Agrupamento local (ver grouping.py): cada lote enviado é um grupo do mesmo
+# produto e a API só lê o texto. Com False, a API também compara as imagens.
+LOCAL_GROUPING = True
+GROUPING = GroupingConfig()
+# Com LOCAL_GROUPING, só as N imagens do grupo com mais probabilidade de ter
+# texto na haste (ver text_detector.py) são enviadas, no recorte ampliado.
+# As restantes só seguem se nenhuma candidata tiver o texto.
+TEXT_CANDIDATES = 1
+# Fronteiras de lote adaptativas (ver batching.py): pausas EXIF, saltos na
+# numeração e semelhança visual. Lotes sem imagem chave são re-janelados.
+BATCHING = BatchingConfig(max_batch_size=GROUPING.max_group_size if LOCAL_GROUPING else BATCH_SIZE)
+# Lotes enviados num só pedido (ver PROMPT_PACKED): com quotas de pedidos por
+# minuto, 4 lotes por pedido dão ~4x mais lotes por minuto. 1 = um pedido por lote.
+PACK_BATCHES = 4
+# Falhas ficam numa fila persistente com novas tentativas agendadas (ver
+# failure_queue.py). No fim, espera-se até este tempo por uma tentativa próxima.
+MAX_RETRY_WAIT = 300
+# Modo contínuo (ou `python processar_oculos2.py --watch`): fica a vigiar a
+# pasta de entrada e processa as fotografias à medida que chegam (ver watcher.py).
+WATCH = False
+WATCH_SETTLE_SECONDS = 2 # Tamanho e data inalterados durante este tempo = ficheiro completo
+WATCH_POLL_SECONDS = 1
+WATCH_QUIET_SECONDS = BATCHING.time_gap_seconds # Sem chegadas durante este tempo = produto completo
+WATCH_MAX_PENDING = BATCH_SIZE * PACK_BATCHES * MAX_BATCHES_IN_FLIGHT
+
+# Vários trabalhadores (cada máquina com a sua GOOGLE_API_KEY no .env) na mesma
+# pasta partilhada (ou ativar com --distributed). Cada um reserva segmentos de
+# CLAIM_SIZE ficheiros (ver claims.py); o catálogo fica na pasta de saída, com
+# um journal por trabalhador. Dê a cada trabalhador um OCULOS_WORKER_ID fixo.
+DISTRIBUTED = False
+WORKER_ID = os.getenv("OCULOS_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+CLAIMS_DIR = PASTA_ENTRADA / ".claims"
+CLAIM_SIZE = 50
+LEASE_SECONDS = 120 # Sem batimentos durante este tempo = trabalhador morto, segmento reclamado
+SHARED_DATA_FILE = PASTA_SAIDA / DATA_FILE.name
+
+# Organização da pasta de saída (ver output_stage.py). "auto" usa reflinks quando
+# o disco o permite (sem cópia) e cópias em paralelo nos outros casos; "hardlink"
+# também evita a cópia, mas a saída passa a ser o próprio ficheiro de entrada.
+# OUTPUT_FORMAT = None mantém o formato original; "JPEG" converte tudo.
+OUTPUT_LINK_MODE = "auto"
+OUTPUT_FORMAT = None
+OUTPUT_WORKERS = 8
+
+# Métricas por etapa (JSONL, resumo com percentis no fim; ver metrics.py).
+# Com PROFILE (ou --profile) as etapas principais correm sob o cProfile.
+METRICS_FILE = Path("processing_metrics.jsonl")
+PROFILE = False
+PROFILE_DIR = Path("profiles")
+
+# Orçamento (ver budget.py), em USD; None = sem limite. O consumo de cada dia
+# fica na base de estado, por isso o limite diário vale entre execuções. Sem
+# margem, a cascata fica pelo modelo mais barato e os lotes restantes ficam
+# para depois (no limite diário, para o dia seguinte). --dry-run mostra a
+# projeção de pedidos, tokens, custo e duração sem chamar a API.
+RUN_BUDGET_USD = None
+DAILY_BUDGET_USD = None
 # PAUSE_AFTER_BATCHES = 0
 
 # --- Configuração da API Gemini ---
-try:
-    genai.configure(api_key=GOOGLE_API_KEY)
-except Exception as e:
-    print(f"Erro ao configurar a API do Gemini: {e}")
-    print("Verifique se a sua GOOGLE_API_KEY está correta.")
-    exit()
-
-# Modelo a ser usado
-try:
-    model = genai.GenerativeModel('gemini-2.5-pro')
-    print("Modelo 'gemini-2.5-pro' carregado com sucesso.")
-except Exception as e:
-    print(f"Erro ao carregar o modelo 'gemini-2.5-pro': {e}")
-    print("Verifique se o nome do modelo está correto ou se a API Key tem acesso.")
-    exit()
+# Preenchidos por load_models() (ver abaixo), nunca ao importar o módulo.
+backends = {}  # modelo -> backend
+response_cache = None
+output_stage = None  # Criado no main(), com a pasta de saída
+metrics = Metrics()  # Só em memória até o main() abrir o ficheiro de métricas
+event_log = None  # Aberto no primeiro evento (ver log_event)
+budget = None  # Criado no main(); sem ele, as chamadas não são contabilizadas
+fingerprints = None  # Criado no main(): conteúdos já processados (ver fingerprints.py)
+batch_counter = 0  # Lotes concluídos nesta execução
+
+
+def configure(input_dir: Path | None = None, output_dir: Path | None = None, batch_size: int | None = None):
+    """Muda as pastas e o tamanho dos lotes (e as constantes que dependem deles) antes do main()."""
+    global PASTA_ENTRADA, PASTA_SAIDA, BATCH_SIZE, BATCHING, WATCH_MAX_PENDING, CLAIMS_DIR, SHARED_DATA_FILE, \
+        PREFETCH_BATCHES
+    if input_dir is not None:
+        PASTA_ENTRADA = Path(input_dir)
+        CLAIMS_DIR = PASTA_ENTRADA / ".claims"
+    if output_dir is not None:
+        PASTA_SAIDA = Path(output_dir)
+        SHARED_DATA_FILE = PASTA_SAIDA / DATA_FILE.name
+    if batch_size is not None:
+        BATCH_SIZE = batch_size
+        if not LOCAL_GROUPING:
+            BATCHING = replace(BATCHING, max_batch_size=batch_size)
+        WATCH_MAX_PENDING = BATCH_SIZE * PACK_BATCHES * MAX_BATCHES_IN_FLIGHT
+        PREFETCH_BATCHES = max(2, DECODE_WORKERS // BATCH_SIZE + 1)
+
+
+def load_models():
+    """
+    Cria o backend de cada modelo da cascata e abre o cache de respostas.
+    Só no processo principal: no Windows os processos de descodificação
+    reimportam este módulo e não devem configurar a API nem abrir o cache.
+    """
+    global response_cache
+    for model_name in MODEL_CASCADE:
+        try:
+            backends[model_name] = create_backend(BACKEND, model_name, GOOGLE_API_KEY,
+                                                  recordings=Path(RECORDINGS_FILE.format(model=model_name)))
+            print(f"Modelo '{model_name}' carregado com sucesso (backend '{BACKEND}').")
+        except Exception as e:
+            print(f"Erro ao carregar o modelo '{model_name}': {e}")
+            print("Verifique se a sua GOOGLE_API_KEY está correta e se tem acesso ao modelo.")
+            exit()
+
+    # Cache de respostas (evita pagar de novo por lotes já analisados)
+    if USE_RESPONSE_CACHE:
+        response_cache = ResponseCache()
+
+# Limites de quota de cada modelo, partilhados por todos os lotes em voo
+rate_limiters = {model_name: RateLimiter.for_model(model_name) for model_name in MODEL_CASCADE}
 
 # --- Funções Auxiliares de Log e Dados ---
 
-def log_event(status: str, message: str, filenames: list = None):
-    """Registra um evento (sucesso, falha, aviso) no log único."""
-    try:
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        with open(LOG_FILE, 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] [{status:^15}] {message}\n")
-            if filenames:
-                for name in filenames:
-                    f.write(f"                   - {name}\n")
-    except Exception as e:
-        print(f"Aviso: Não foi possível escrever no arquivo de log: {e}")
+def log_event(status: str, message: str, filenames: list = None, **fields):
+    """
+    Regista um evento (sucesso, falha, aviso) no registo estruturado. Não
+    bloqueia: a escrita é feita em segundo plano. Campos habituais: batch,
+    reference, color, model, error_class, seconds.
+    """
+    global event_log
+    if event_log is None:
+        event_log = EventLog(LOG_FILE, STATE_DB)
+        atexit.register(event_log.close)  # Saída a meio (erro, Ctrl+C): não perde os eventos em fila
+    event_log.write(status, message, filenames, **fields)
 
 
-def load_data() -> list:
-    """Carrega o JSON de dados extraídos."""
-    if not DATA_FILE.exists():
-        return []
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        print(f"Aviso: {DATA_FILE} está corrompido ou vazio. A criar um novo.")
-        return []
-    except Exception as e:
-        print(f"Aviso: Não foi possível ler {DATA_FILE}: {e}")
-        return []
+def open_state_store(journal: CatalogJournal) -> StateStore:
+    """Abre a base de estado. Se estiver vazia, reconstrói-a a partir do catálogo."""
+    store = StateStore(STATE_DB)
+    if store.is_empty():
+        count = store.import_entries(journal.entries())
+        if count:
+            print(f"Importadas {count} entradas de {DATA_FILE} para {STATE_DB}.")
+    return store
 
-def load_processed_files_from_json(data_list: list) -> set:
-    """Extrai todos os nomes de ficheiros do JSON de dados (sucessos)."""
-    filenames = set()
-    try:
-        for entry in data_list:
-            if "image_files" in entry:
-                for img_group in entry["image_files"]:
-                    if "key_file" in img_group and img_group["key_file"]:
-                        filenames.add(img_group["key_file"])
-                    if "additional_files" in img_group:
-                        filenames.update(img_group["additional_files"])
-    except Exception as e:
-        print(f"Aviso: Não foi possível ler nomes de ficheiros do JSON: {e}")
-        log_event("ERRO_JSON", f"Não foi possível ler nomes de ficheiros do JSON: {e}")
-    return filenames
 
-def save_data(data_list: list, new_data: dict, key_file: str, additional_files: list):
+def find_processed(paths: list[Path], legacy_names: set = frozenset()) -> set:
+    """Nomes de `paths` cujo conteúdo já foi processado, com este ou outro nome (ver fingerprints.py)."""
+    found = fingerprints.processed(paths, legacy_names)
+    renamed = sorted(name for name, original in found.items() if name != original)
+    if renamed:
+        print(f"{len(renamed)} ficheiros já processados com outro nome serão ignorados.")
+        log_event("JA_PROCESSADO", "Conteúdo já processado com outro nome",
+                  [f"{name} = {found[name]}" for name in renamed])
+    return set(found)
+
+def save_data(journal: CatalogJournal, store: StateStore, new_data: dict, key_file: str,
+              additional_files: list) -> bool:
     """
-    Salva os dados no JSON, usando a nova estrutura aninhada.
-    Se a referência existir, mescla o novo grupo de cor/ficheiros.
+    Salva os dados no catálogo, usando a nova estrutura aninhada.
+    O lote é gravado no journal (durável) e depois no índice de estado.
     """
     
     new_ref = new_data.get('reference')
@@ -99,91 +250,42 @@ def save_data(data_list: list, new_data: dict, key_file: str, additional_files:
     if not all([new_ref, new_color, key_file]):
         print("Aviso: Nova entrada incompleta. Faltando ref, cor ou imagem chave.")
         log_event("ERRO_SAVE", "Nova entrada incompleta", [key_file])
-        return
-
-    # Cria a nova entrada de ficheiro (para a cor específica)
-    new_file_entry = {
-        "color": new_color,
-        "key_file": key_file,
-        "additional_files": additional_files
-    }
+        return False
 
-    found_ref = False
-    for entry in data_list:
-        if entry.get('reference') == new_ref:
-            found_ref = True
-            
-            # Garante que 'image_files' existe
-            image_files_list = entry.setdefault('image_files', [])
-            
-            # Verifica se esta cor já foi processada
-            found_color = False
-            for img_group in image_files_list:
-                if img_group.get('color') == new_color:
-                    # A cor já existe. Apenas por segurança, atualiza os ficheiros.
-                    img_group['key_file'] = key_file
-                    img_group['additional_files'] = additional_files
-                    found_color = True
-                    break
-            
-            if not found_color:
-                image_files_list.append(new_file_entry)
-            
-            break # Referência encontrada e processada
-
-    # Se a referência não foi encontrada, cria uma nova entrada
-    if not found_ref:
-        transformed_entry = {
-            "reference": new_ref,
-            "size1": new_data.get('size1'),
-            "size2": new_data.get('size2'),
-            "size3": new_data.get('size3'),
-            "image_files": [new_file_entry] # Adiciona a nova entrada de ficheiro
-        }
-        data_list.append(transformed_entry)
-
-    # Salva a lista completa
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data_list, f, indent=2, ensure_ascii=False)
+        with metrics.timer("save"):
+            journal.append(new_data, key_file, additional_files)
+            store.record_batch(new_data, key_file, additional_files)
+        return True
     except Exception as e:
-        print(f"Aviso: Não foi possível salvar {DATA_FILE}: {e}")
-        log_event("ERRO_SAVE", f"Não foi possível salvar {DATA_FILE}: {e}")
-
+        print(f"Aviso: Não foi possível salvar o lote: {e}")
+        log_event("ERRO_SAVE", f"Não foi possível salvar o lote: {e}", [key_file], reference=new_ref,
+                  error_class=type(e).__name__)
+        return False
 
-def validate_image(image_path: Path) -> bool:
-    """Verifica se a imagem é válida usando Pillow."""
+def export_data(journal: CatalogJournal):
+    """Compacta o journal no extracted_data.json (escrita atómica)."""
     try:
-        with Image.open(image_path) as img:
-            img.verify() 
-        with Image.open(image_path) as img:
-            img.load() 
-        return True
+        journal.close()
+        print(f"Dados salvos em {journal.json_path}.")
     except Exception as e:
-        print(f"   [AVISO] Imagem corrompida ou inválida: {image_path.name}: {e}")
-        log_event("IMG_CORROMPIDA", f"Imagem corrompida: {e}", [image_path.name])
-        return False
+        print(f"Aviso: Não foi possível salvar {journal.json_path}: {e}")
+        log_event("ERRO_SAVE", f"Não foi possível salvar {journal.json_path}: {e}", error_class=type(e).__name__)
 
-# --- NOVA FUNÇÃO DE API ÚNICA ---
 
-def call_gemini_process_batch(batch_paths: list[Path]) -> dict | None:
-    """
-    Envia o LOTE INTEIRO para la API e pede para:
-    1. Encontrar a imagem chave (com texto).
-    2. Extrair os dados dessa imagem.
-    3. Encontrar todas as imagens similares (mesmo modelo e cor).
-    """
-    print(f"   > Analisando lote de {len(batch_paths)} imagens com Gemini...")
-    pil_images = []
-    file_names = []
-    
-    try:
-        for p in batch_paths:
-            pil_images.append(Image.open(p))
-            file_names.append(p.name)
+def report_invalid_images(decoded: DecodedBatch, failures: FailureQueue):
+    """Regista as imagens que falharam a descodificação (corrompidas ou inválidas)."""
+    metrics.count("invalid_images", len(decoded.errors))
+    for name, error in decoded.errors.items():
+        print(f"   [AVISO] Imagem corrompida ou inválida: {name}: {error}")
+        log_event("IMG_CORROMPIDA", f"Imagem corrompida: {error}", [name], error_class=error.split(":")[0])
+        # Nunca volta a ser tentada automaticamente.
+        failures.record([name], CORRUPT, error)
+
+# --- NOVA FUNÇÃO DE API ÚNICA ---
 
-        prompt = f"""
-        Analise o lote de imagens de óculos fornecido. Os nomes de ficheiro são: {json.dumps(file_names)}
+PROMPT_PROCESS_BATCH = """
+        Analise o lote de imagens de óculos fornecido. Os nomes de ficheiro são: {file_names}
 
         Siga estas 3 etapas:
 
@@ -204,9 +306,13 @@ def call_gemini_process_batch(batch_paths: list[Path]) -> dict | None:
                 "size3": "VALOR_TAMANHO3",
                 "color": "VALOR_COR"
             }},
-            "matched_filenames": ["ficheiro_chave.jpg", "ficheiro_similar_1.jpg", "ficheiro_similar_2.jpg"]
+            "matched_filenames": ["ficheiro_chave.jpg", "ficheiro_similar_1.jpg", "ficheiro_similar_2.jpg"],
+            "raw_text": "TEXTO_DA_HASTE_TAL_COMO_ESTÁ_ESCRITO",
+            "confidence": 0.0
         }}
 
+        Em "raw_text" copie o texto da haste exatamente como o leu. Em "confidence" indique, de 0 a 1, a certeza de que todos os carateres foram bem lidos.
+
         Se NENHUMA imagem no lote contiver o texto de referência no formato exato, responda com:
         {{
             "key_image_name": null,
@@ -214,191 +320,919 @@ def call_gemini_process_batch(batch_paths: list[Path]) -> dict | None:
             "matched_filenames": []
         }}
         """
+PROMPT_TEMPLE_DETAIL = """
+        Depois das imagens do lote seguem recortes ampliados da zona da haste, um por imagem e pela mesma ordem.
+        Use-os apenas para ler o texto de referência com mais precisão.
+        """
 
-        api_payload = [prompt] + pil_images
-        
-        response = model.generate_content(api_payload)
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "").strip()
-        
-        data = json.loads(cleaned_response)
-        
-        if data and data.get("data"):
-            return data
+# Usado com LOCAL_GROUPING: as imagens já foram agrupadas localmente.
+# Lotes re-janelados (que juntam grupos) usam o PROMPT_PROCESS_BATCH.
+PROMPT_READ_GROUP = """
+        As imagens fornecidas mostram todas o mesmo modelo de óculos, na mesma cor. Os nomes de ficheiro são: {file_names}
+
+        Siga estas 2 etapas:
+
+        1.  **Encontrar a Imagem Chave:** Examine todas as imagens. Encontre a UMA imagem que contém o texto de referência na haste no formato "Referência Tamanho[]Tamanho2-Tamanho3 Cor" (ex: "0037 54[]18-145 C4").
+
+        2.  **Extrair Dados:** Da imagem chave encontrada na Etapa 1, extraia os 5 componentes: Referência, Tamanho, Tamanho2, Tamanho3, e Cor.
+
+        Responda APENAS com um objeto JSON no seguinte formato:
+
+        {{
+            "key_image_name": "nome_do_ficheiro_com_texto.jpg",
+            "data": {{
+                "reference": "VALOR_REFERENCIA",
+                "size1": "VALOR_TAMANHO1",
+                "size2": "VALOR_TAMANHO2",
+                "size3": "VALOR_TAMANHO3",
+                "color": "VALOR_COR"
+            }},
+            "raw_text": "TEXTO_DA_HASTE_TAL_COMO_ESTÁ_ESCRITO",
+            "confidence": 0.0
+        }}
+
+        Em "raw_text" copie o texto da haste exatamente como o leu. Em "confidence" indique, de 0 a 1, a certeza de que todos os carateres foram bem lidos.
+
+        Se NENHUMA imagem contiver o texto de referência no formato exato, responda com:
+        {{
+            "key_image_name": null,
+            "data": null
+        }}
+        """
+# Vários lotes independentes num só pedido (PACK_BATCHES > 1). As instruções
+# de cada lote são as do PROMPT_PROCESS_BATCH ou do PROMPT_READ_GROUP.
+PROMPT_PACKED = """
+        Este pedido contém {num_batches} lotes independentes de imagens de óculos, uns a seguir aos outros.
+        Cada lote começa com uma linha "LOTE n" com os nomes de ficheiro das suas imagens, seguida das imagens desse lote.
+        Trate cada lote em separado, como se fosse um pedido à parte: nunca compare nem misture imagens de lotes diferentes.
+
+        Instruções para cada lote:
+        {instructions}
+
+        Responda APENAS com um objeto JSON com a resposta de cada lote, no formato indicado nas instruções,
+        acrescentando o número do lote em "batch":
+
+        {{
+            "batches": [
+                {{"batch": 1, "key_image_name": ..., "data": ...}},
+                {{"batch": 2, "key_image_name": ..., "data": ...}}
+            ]
+        }}
+
+        A lista "batches" tem de ter exatamente {num_batches} elementos, um por lote, pela ordem dos lotes.
+        """
+# O modelo, o prompt e a redução aplicada às imagens determinam a resposta.
+PROMPT_FINGERPRINTS = {}
+for _model_name in MODEL_CASCADE:
+    PROMPT_FINGERPRINTS[_model_name, True] = prompt_fingerprint(
+        _model_name,
+        PROMPT_PROCESS_BATCH + (PROMPT_TEMPLE_DETAIL if SEND_TEMPLE_DETAIL else "") + repr(PREPROCESS),
+    )
+    PROMPT_FINGERPRINTS[_model_name, False] = prompt_fingerprint(_model_name, PROMPT_READ_GROUP + repr(PREPROCESS))
+
+
+def _to_cache_entry(result: dict | None, file_names: list[str]) -> dict:
+    """Troca os nomes de ficheiro da resposta por posições no lote."""
+    if not result:
+        return {"key_index": None, "data": None, "matched_indices": []}
+    key_name = result.get("key_image_name")
+    return {
+        "key_index": file_names.index(key_name) if key_name in file_names else None,
+        "data": result.get("data"),
+        "matched_indices": [i for i, name in enumerate(file_names) if name in (result.get("matched_filenames") or [])],
+        "raw_text": result.get("raw_text"),
+        "confidence": result.get("confidence"),
+    }
+
+
+def _from_cache_entry(entry: dict, file_names: list[str]) -> dict:
+    """Reconstrói a resposta com os nomes de ficheiro do lote atual."""
+    if not entry.get("data") or entry.get("key_index") is None:
+        return {"key_image_name": None, "data": None, "matched_filenames": []}
+    return {
+        "key_image_name": file_names[entry["key_index"]],
+        "data": entry["data"],
+        "matched_filenames": [file_names[i] for i in entry["matched_indices"]],
+        "raw_text": entry.get("raw_text"),
+        "confidence": entry.get("confidence"),
+    }
+
+
+def _batch_parts(prepared: list[PreparedImage], compare: bool) -> list:
+    """Partes (imagens) de um lote, pela ordem que o prompt descreve."""
+    if not compare:
+        # Só se lê o texto: basta o recorte ampliado da haste, se houver (PREPROCESS.temple_box).
+        return [img.detail_part() or img.as_part() for img in prepared]
+    parts = [img.as_part() for img in prepared]
+    if SEND_TEMPLE_DETAIL:
+        parts += [img.detail_part() or img.as_part() for img in prepared]
+    return parts
+
+
+def _batch_prompt(compare: bool, file_names: str) -> str:
+    if compare:
+        prompt = PROMPT_PROCESS_BATCH.format(file_names=file_names)
+        return prompt + PROMPT_TEMPLE_DETAIL if SEND_TEMPLE_DETAIL else prompt
+    return PROMPT_READ_GROUP.format(file_names=file_names)
+
+
+def _cache_lookup(model_name: str, prepared: list[PreparedImage], compare: bool) -> tuple[str | None, dict | None]:
+    """(chave, resposta em cache). A chave depende do conteúdo das imagens, não dos nomes."""
+    if response_cache is None:
+        return None, None
+    try:
+        cache_key = make_key([img.content_hash for img in prepared], PROMPT_FINGERPRINTS[model_name, compare])
+        cached = response_cache.get(cache_key)
+    except Exception as e:
+        print(f"   Aviso: Cache de respostas indisponível: {e}")
+        return None, None
+    if cached is None:
+        return cache_key, None
+    return cache_key, _from_cache_entry(cached, [img.name for img in prepared])
+
+
+def _response_schema(compare: bool) -> dict:
+    return BATCH_SCHEMA if compare else GROUP_SCHEMA
+
+
+def _request_tokens(batches: list[list[PreparedImage]], compare: bool) -> int:
+    """Tokens de entrada de um pedido, pelas dimensões das imagens enviadas (ver _batch_parts)."""
+    sizes = []
+    for prepared in batches:
+        if not compare:
+            sizes += [img.detail_size or img.size for img in prepared]
+            continue
+        sizes += [img.size for img in prepared]
+        if SEND_TEMPLE_DETAIL:
+            sizes += [img.detail_size or img.size for img in prepared]
+    return request_tokens(sizes)
+
+
+def _call_api(model_name: str, api_payload: list, file_names: list[str], schema: dict, estimated_tokens: int):
+    """
+    Chamada ao modelo com as quotas do modelo e saída estruturada (`schema`).
+    Devolve o JSON lido de forma tolerante (ver structured_output.py).
+    Lança BudgetExceededError (sem chamar a API) se a chamada não couber no orçamento.
+    """
+    def on_quota_retry(attempt, delay, error):
+        print(f"   ! Quota excedida (429) em {model_name}. Nova tentativa {attempt} dentro de {delay:.0f}s...")
+        log_event("QUOTA_429", f"Quota de {model_name} excedida, nova tentativa em {delay:.0f}s", file_names,
+                  model=model_name, error_class=type(error).__name__, seconds=round(delay, 1))
+        metrics.count("retry_429", model=model_name)
+
+    backend = backends[model_name]
+    image_parts = [part for part in api_payload if isinstance(part, dict)]
+    upload_bytes = sum(len(part["data"]) for part in image_parts)
+
+    def generate():
+        # Latência de cada tentativa; o resto do tempo é espera pela quota.
+        with metrics.timer("api", model=model_name, images=len(image_parts), bytes=upload_bytes):
+            return backend.generate(api_payload, schema)
+
+    reserved = budget.reserve(model_name, estimated_tokens) if budget is not None else None
+    start = time.perf_counter()
+    try:
+        response_text = call_with_quota(
+            generate,
+            rate_limiters[model_name],
+            estimated_tokens,
+            on_retry=on_quota_retry,
+        )
+    except Exception:
+        if reserved is not None:
+            budget.release(model_name, reserved)
+        raise
+    metrics.observe("api_total", time.perf_counter() - start, model=model_name)
+    metrics.count("requests", model=model_name)
+    metrics.count("bytes_uploaded", upload_bytes, model=model_name)
+    usage = backend.last_usage()
+    for name, tokens in usage.items():
+        metrics.count(name, tokens, model=model_name)
+    if budget is not None:
+        budget.record(model_name, usage.get("prompt_tokens", estimated_tokens),
+                      usage.get("output_tokens", OUTPUT_TOKENS_PER_BATCH), reserved)
+    with metrics.timer("parse", model=model_name):
+        return parse_response(response_text)
+
+
+def call_model(model_name: str, prepared: list[PreparedImage], compare: bool = True) -> dict | None:
+    """
+    Envia o LOTE INTEIRO (já descodificado e reduzido) para um modelo e pede para:
+    1. Encontrar a imagem chave (com texto).
+    2. Extrair os dados dessa imagem.
+    3. Encontrar todas as imagens similares (mesmo modelo e cor).
+    Com compare=False as imagens já são do mesmo grupo e a etapa 3 não é pedida.
+
+    Devolve a resposta tal como veio (por validar, com "data" nulo se não
+    houver imagem chave), ou None em caso de erro.
+    Lança QuotaExhaustedError se a quota continuar esgotada após as novas tentativas.
+    """
+    file_names = [img.name for img in prepared]
+    _, cached = _cache_lookup(model_name, prepared, compare)
+    if cached is not None:
+        print(f"   > Resposta do lote obtida do cache ({model_name}, sem chamada à API).")
+        return cached
+
+    print(f"   > Analisando lote de {len(prepared)} imagens com {model_name}...")
+    
+    try:
+        # Imagens reduzidas e recodificadas em vez do ficheiro original
+        upload_bytes = sum(len(img.data) for img in prepared)
+        print(f"   > {upload_bytes / 1024:.0f} KB a enviar após redução.")
+
+        api_payload = [_batch_prompt(compare, json.dumps(file_names))] + _batch_parts(prepared, compare)
+        schema = _response_schema(compare)
+        response = _call_api(model_name, api_payload, file_names, schema, _request_tokens([prepared], compare))
+        data, problems = conform(response, schema)
+        if problems:
+            raise ValueError(f"resposta fora do esquema: {'; '.join(problems[:3])}")
+        if not compare and data:
+            # Sem comparação pedida à API; process_pack junta o resto do grupo.
+            data["matched_filenames"] = file_names
+        return data or None
+
+    except QuotaExhaustedError:
+        # Não é uma falha do lote: quem chamou volta a tentar mais tarde.
+        raise
+    except Exception as e:
+        print(f"   ! Erro na chamada à API Gemini ({model_name}): {e}")
+        log_event("ERRO_API", f"Chamada a {model_name} falhou: {e}", file_names, model=model_name,
+                  error_class=type(e).__name__)
+        return None
+
+
+def _send_pack(model_name: str, requests: list[tuple]) -> list | None:
+    """
+    Um único pedido com vários lotes (todos com o mesmo `compare`). Devolve
+    uma resposta por lote (None nas que vieram estragadas), ou None se a
+    resposta inteira não puder ser lida.
+    """
+    compare = requests[0][1]
+    schema = _response_schema(compare)
+    all_names = [img.name for prepared, _ in requests for img in prepared]
+    prompt = PROMPT_PACKED.format(
+        num_batches=len(requests),
+        instructions=_batch_prompt(compare, "os indicados na linha LOTE de cada lote"),
+    )
+    api_payload = [prompt]
+    for number, (prepared, _) in enumerate(requests, 1):
+        file_names = [img.name for img in prepared]
+        api_payload.append(f"LOTE {number}. Os nomes de ficheiro são: {json.dumps(file_names)}")
+        api_payload += _batch_parts(prepared, compare)
+
+    print(f"   > Analisando {len(requests)} lotes ({len(all_names)} imagens) num só pedido a {model_name}...")
+    try:
+        data = _call_api(model_name, api_payload, all_names, packed_schema(schema),
+                         _request_tokens([prepared for prepared, _ in requests], compare))
+        entries = data.get("batches") if isinstance(data, dict) else None
+        if not isinstance(entries, list):
+            raise ValueError("resposta sem a lista 'batches'")
+    except QuotaExhaustedError:
+        raise
+    except Exception as e:
+        print(f"   ! Resposta agrupada de {model_name} inválida: {e}")
+        log_event("ERRO_API", f"Pedido agrupado a {model_name} falhou: {e}", all_names, model=model_name,
+                  error_class=type(e).__name__)
+        return None
+
+    # Cada elemento indica o seu lote; sem índice, conta a posição.
+    by_number = {}
+    for position, entry in enumerate(entries, 1):
+        if isinstance(entry, dict):
+            by_number.setdefault(entry.get("batch", position), entry)
+    answers = []
+    for number, (prepared, _) in enumerate(requests, 1):
+        entry = by_number.get(number)
+        if entry is None:
+            answers.append(None)
+            continue
+        entry.pop("batch", None)
+        entry, problems = conform(entry, schema)
+        if problems:
+            answers.append(None)
+            continue
+        file_names = [img.name for img in prepared]
+        if entry.get("data") and entry.get("key_image_name") not in file_names:
+            # Imagem de outro lote: a resposta misturou os lotes.
+            answers.append(None)
+            continue
+        if not compare:
+            entry["matched_filenames"] = file_names
+        answers.append(entry)
+    return answers
+
+
+def call_model_packed(model_name: str, requests: list[tuple]) -> list:
+    """
+    Envia vários lotes (prepared, compare) num só pedido, para poupar pedidos
+    por minuto. Uma resposta agrupada estragada é dividida ao meio e reenviada;
+    os lotes que vieram estragados numa resposta boa são reenviados à parte.
+    Devolve uma resposta (ou None) por lote, pela ordem de `requests`.
+    """
+    results = [None] * len(requests)
+    if len({compare for _, compare in requests}) > 1:
+        # O prompt depende de `compare`: um pedido agrupado por tipo.
+        for flag in (True, False):
+            indices = [i for i, (_, compare) in enumerate(requests) if compare == flag]
+            for i, result in zip(indices, call_model_packed(model_name, [requests[i] for i in indices])):
+                results[i] = result
+        return results
+
+    to_send = []
+    for i, (prepared, compare) in enumerate(requests):
+        _, cached = _cache_lookup(model_name, prepared, compare)
+        if cached is not None:
+            results[i] = cached
         else:
-            return None
+            to_send.append(i)
+    if len(to_send) < len(requests):
+        print(f"   > {len(requests) - len(to_send)} lotes obtidos do cache ({model_name}, sem chamada à API).")
+    if len(to_send) <= 1:
+        for i in to_send:
+            results[i] = call_model(model_name, *requests[i])
+        return results
+
+    answers = _send_pack(model_name, [requests[i] for i in to_send])
+    bad = [i for i, answer in zip(to_send, answers or []) if answer is None]
+    if answers is None or len(bad) == len(to_send):
+        # Nada aproveitável: divide o pedido ao meio.
+        half = len(to_send) // 2
+        for part in (to_send[:half], to_send[half:]):
+            for i, result in zip(part, call_model_packed(model_name, [requests[i] for i in part])):
+                results[i] = result
+        return results
+
+    for i, answer in zip(to_send, answers):
+        if answer is not None:
+            results[i] = answer
+    if bad:
+        print(f"   > {len(bad)} lotes com resposta estragada. A reenviar...")
+        for i, result in zip(bad, call_model_packed(model_name, [requests[i] for i in bad])):
+            results[i] = result
+    return results
 
+
+def _cache_answer(model_name: str, request: tuple, result: dict | None, accepted: bool):
+    """
+    Guarda no cache a resposta de `model_name` a `request` (prepared,
+    compare) se a cascata a aceitou; uma rejeitada (validação ou confiança)
+    sai do cache, para que a próxima tentativa volte a perguntar ao modelo.
+    """
+    if response_cache is None:
+        return
+    prepared, compare = request
+    try:
+        cache_key = make_key([img.content_hash for img in prepared], PROMPT_FINGERPRINTS[model_name, compare])
+        if accepted:
+            response_cache.put(cache_key, _to_cache_entry(result, [img.name for img in prepared]))
+        else:
+            response_cache.discard(cache_key)
     except Exception as e:
-        print(f"   ! Erro na chamada à API Gemini (process_batch): {e}")
-        log_event("ERRO_API", f"Chamada à API falhou: {e}")
+        print(f"   Aviso: Cache de respostas indisponível: {e}")
+
+
+def _budget_limit(model_name: str, request: tuple) -> BudgetExceededError | None:
+    """O limite que impede enviar `request` (prepared, compare) a `model_name`, ou None."""
+    if budget is None:
         return None
-    finally:
-        # Garante que todas as imagens PIL sejam fechadas
-        [img.close() for img in pil_images]
+    prepared, compare = request
+    try:
+        budget.check(model_name, _request_tokens([prepared], compare))
+    except BudgetExceededError as e:
+        return e
+    return None
+
+
+def call_gemini_process_batches(requests: list[tuple]) -> list:
+    """
+    Percorre a cascata de modelos para vários lotes (prepared, compare):
+    cada lote só é reenviado ao modelo seguinte se a resposta falhar a
+    validação ou vier com confiança baixa. No último modelo a confiança não
+    conta, só a validação. O modelo que resolveu o lote fica em
+    `resultado["model"]`. Devolve uma resposta por lote: None se não houver
+    imagem chave, ou {"data": None, "failure": motivo} se o último modelo
+    falhar (ver failure_queue.py).
+
+    Se o modelo seguinte não couber no orçamento (budget.py), uma resposta
+    válida mas com confiança baixa é aceite tal como está; as outras ficam
+    para quando houver margem.
+    """
+    results = [None] * len(requests)
+    pending = list(range(len(requests)))
+    for tier, model_name in enumerate(MODEL_CASCADE):
+        last_tier = tier == len(MODEL_CASCADE) - 1
+        answers = call_model_packed(model_name, [requests[i] for i in pending])
+        escalate = []
+        for i, result in zip(pending, answers):
+            file_names = [img.name for img in requests[i][0]]
+            if result is not None and not result.get("data") and (last_tier or not ESCALATE_NOT_FOUND):
+                # Sem imagem chave: é uma resposta válida, também guardada no cache.
+                _cache_answer(model_name, requests[i], result, accepted=True)
+                continue
+            if result is None:
+                problems = ["erro na chamada"]
+            else:
+                problems = validate_result(result, file_names, 0.0 if last_tier else MIN_CONFIDENCE)
+                _cache_answer(model_name, requests[i], result, accepted=not problems)
+            if not problems:
+                result["model"] = model_name
+                results[i] = result
+            elif last_tier:
+                if result is None:
+                    results[i] = {"data": None, "failure": API_ERROR, "error": f"{model_name}: erro na chamada"}
+                elif result.get("data"):
+                    print(f"   ! Resposta de {model_name} rejeitada: {'; '.join(problems)}")
+                    log_event("RESPOSTA_INVALIDA", f"{model_name}: {'; '.join(problems)}", file_names,
+                              model=model_name, reference=result["data"].get("reference"),
+                              error_class=INVALID_RESPONSE)
+                    results[i] = {"data": None, "failure": INVALID_RESPONSE,
+                                  "error": f"{model_name}: {'; '.join(problems)}"}
+            else:
+                next_model = MODEL_CASCADE[tier + 1]
+                limit = _budget_limit(next_model, requests[i])
+                if limit is None:
+                    print(f"   > {model_name}: {'; '.join(problems)}. A subir para {next_model}...")
+                    log_event("ESCALADA", f"{model_name} -> {next_model}: {'; '.join(problems)}", file_names,
+                              model=model_name, reference=((result or {}).get("data") or {}).get("reference"))
+                    escalate.append(i)
+                elif result is not None and result.get("data") and not validate_result(result, file_names, 0.0):
+                    # Só a confiança ficou abaixo do mínimo: fica a resposta do modelo mais barato.
+                    print(f"   > {model_name}: {'; '.join(problems)}. Sem orçamento para {next_model}: resposta aceite.")
+                    log_event("DESCIDA", f"{next_model} sem orçamento ({limit}); aceite a resposta de {model_name}",
+                              file_names, model=model_name, reference=result["data"].get("reference"))
+                    result["model"] = model_name
+                    results[i] = result
+                else:
+                    results[i] = {"data": None, "failure": BUDGET, "error": f"{next_model}: {limit}",
+                                  "retry_at": limit.retry_at}
+        pending = escalate
+        if not pending:
+            break
+    return results
 
 
 # --- Lógica Principal (Atualizada) ---
 
-def main():
-    print("Iniciando script de processamento de óculos...")
-    print(f"Pasta de Entrada: {PASTA_ENTRADA}")
-    print(f"Pasta de Saída: {PASTA_SAIDA}")
-    log_event("SCRIPT_START", "Script iniciado.")
+def process_pack(pack: list[DecodedBatch]) -> list:
+    """
+    Chama a API para as imagens válidas de vários lotes (corre numa thread do
+    dispatcher). Devolve uma resposta (ou None) por lote, pela ordem de `pack`.
+    """
+    results = [None] * len(pack)
+    requests = []  # (índice no pacote, imagens, compare)
+    for i, decoded in enumerate(pack):
+        if not decoded.images:
+            continue
+        if not LOCAL_GROUPING or decoded.retry:
+            # Um lote re-janelado pode juntar produtos: a API compara as imagens.
+            requests.append((i, decoded.images, True))
+        else:
+            # Primeiro só as candidatas com texto provável; o resto do grupo em recurso.
+            scores = {img.name: img.text_score for img in decoded.images}
+            candidates = set(rank_candidates(scores, TEXT_CANDIDATES))
+            requests.append((i, [img for img in decoded.images if img.name in candidates], False))
 
-    # 1. Setup inicial
-    PASTA_SAIDA.mkdir(exist_ok=True)
+    fallback = []
+    answers = call_gemini_process_batches([(prepared, compare) for _, prepared, compare in requests])
+    for (i, prepared, compare), answer in zip(requests, answers):
+        results[i] = answer
+        sent = {img.name for img in prepared}
+        others = [img for img in pack[i].images if img.name not in sent]
+        if answer is None and not compare and others:
+            fallback.append((i, others, False))
+    if fallback:
+        print(f"   > Texto não encontrado nas candidatas de {len(fallback)} lotes. A enviar as restantes imagens...")
+        answers = call_gemini_process_batches([(prepared, compare) for _, prepared, compare in fallback])
+        for (i, _, _), answer in zip(fallback, answers):
+            results[i] = answer
+
+    for i, decoded in enumerate(pack):
+        if results[i] and results[i].get("data") and LOCAL_GROUPING and not decoded.retry:
+            # O grupo já foi formado localmente: todas as imagens pertencem-lhe.
+            results[i]["matched_filenames"] = [img.name for img in decoded.images]
+    return results
+
+
+def handle_batch_result(current_batch: list[Path], valid_images_in_batch: list[Path],
+                        api_result: dict | None, journal: CatalogJournal, store: StateStore,
+                        batcher: AdaptiveBatcher, processed_files: set, failures: FailureQueue,
+                        content_hashes: dict | None = None):
+    """
+    Guarda os dados de um lote concluído e, depois de gravados, organiza os
+    ficheiros (thread principal). `content_hashes`: nome -> SHA-256 das imagens.
+    """
+
+    # Imagens inválidas: já registadas por 'report_invalid_images'.
+    if not valid_images_in_batch:
+        print("   [AVISO] Nenhuma imagem válida neste lote. A saltar.")
+        return
+
+    # print the name of images being sent
+    print("   Imagens válidas neste lote:")
+    for img in valid_images_in_batch:
+        print(f"     - {img.name}")
+
+    # 4.3. Processar resultado da API
+    valid_names = [p.name for p in valid_images_in_batch]
+    if api_result and api_result.get("failure"):
+        # Erro da API ou resposta inválida: nova tentativa agendada (ver failure_queue.py).
+        print(f"   [FALHA] {api_result.get('error')}. O lote será tentado de novo mais tarde.")
+        log_event("FALHA_API", api_result.get("error", ""), valid_names, batch=batch_counter,
+                  error_class=api_result["failure"])
+        failures.record(valid_names, api_result["failure"], api_result.get("error", ""),
+                        retry_at=api_result.get("retry_at"))
+        return
+
+    if not api_result or not api_result.get("data"):
+        print("   [FALHA] Nenhuma imagem chave encontrada pela API neste lote.")
+        # Loga o lote original
+        log_event("FALHA_API", "Nenhuma imagem chave encontrada no lote", [p.name for p in current_batch],
+                  batch=batch_counter, error_class=NO_KEY)
+        
+        # Re-janela o lote (deslizar, depois dividir); só desiste depois disso.
+        exhausted = batcher.record_failure(valid_names)
+        failures.record(exhausted, NO_KEY, "Nenhuma imagem chave encontrada")
+        if len(exhausted) < len(valid_images_in_batch):
+            print("   O lote será re-janelado e reenviado na próxima passagem.")
+        return
+
+    # 4.4. Sucesso - Extrair dados da resposta
+    parsed_data = api_result["data"]
+    key_image_name = api_result["key_image_name"]
     
-    # Guarda falhas (corrompidas, falhas de API) APENAS desta sessão
-    # para evitar loops infinitos dentro da mesma execução.
-    # Não é lido do disco.
-    failed_files_session = set()
+    key_image_path = None
+    for p in valid_images_in_batch:
+        if p.name == key_image_name:
+            key_image_path = p
+            break
     
-    tipos_de_imagem = ('*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff')
-    batch_counter = 0
+    if not key_image_path:
+         print(f"   [ERRO] API retornou key_image '{key_image_name}' mas não foi encontrado no lote. A saltar.")
+         log_event("ERRO_INTERNO", f"API retornou '{key_image_name}' mas não foi encontrado", [p.name for p in current_batch],
+                   batch=batch_counter, reference=parsed_data.get("reference"), error_class=INVALID_RESPONSE)
+         failures.record(valid_names, INVALID_RESPONSE, f"Imagem chave '{key_image_name}' fora do lote")
+         return
+
+    print(f"   [SUCESSO] Imagem Chave encontrada pela API ({api_result.get('model')}): {key_image_name}")
+    print(f"   Dados extraídos: {parsed_data}")
+
+    matched_filenames = api_result["matched_filenames"]
+    matched_paths = [p for p in current_batch if p.name in matched_filenames]
+    
+    # Pasta de saída da referência
+    reference_clean = safe_name(parsed_data["reference"])
+    if not reference_clean:
+            print(f"   [ERRO] Referência extraída está vazia. A ignorar lote.")
+            log_event("ERRO_DADOS", "Referência extraída está vazia", [p.name for p in current_batch],
+                      batch=batch_counter, error_class=EMPTY_REFERENCE)
+            failures.record(valid_names, EMPTY_REFERENCE, "Referência extraída está vazia")
+            return
+
+    # 4.5. Salvar dados (no novo formato)
+    # Prepara os ficheiros adicionais (todos os 'matched' exceto o 'key')
+    additional_files = [p.name for p in matched_paths if p.name != key_image_name]
+    if save_data(journal, store, parsed_data, key_image_name, additional_files):
+        # 4.6. Organizar arquivos, só depois de gravados: uma falha na gravação é
+        # tentada de novo sem deixar imagens na pasta de saída.
+        # Em segundo plano: índices sem colisões por (referência, cor), sem cópia quando possível.
+        print(f"   A organizar {len(matched_paths)} arquivos em {PASTA_SAIDA / reference_clean}")
+        output_stage.submit(matched_paths, reference_clean, parsed_data['color'],
+                            [(content_hashes or {}).get(p.name) for p in matched_paths])
+        processed_files.update(p.name for p in matched_paths)
+        failures.clear([p.name for p in matched_paths])
+        if fingerprints is not None:
+            fingerprints.mark_processed(matched_paths)
+    else:
+        failures.record([p.name for p in matched_paths], SAVE_ERROR, "Não foi possível salvar o lote")
+        return
+    
+    # Loga o sucesso
+    log_event("SUCESSO", f"Ref {parsed_data['reference']} Cor {parsed_data['color']} [{api_result.get('model')}]",
+              [p.name for p in matched_paths], batch=batch_counter, reference=parsed_data['reference'],
+              color=parsed_data['color'], model=api_result.get('model'))
+
+
+def record_decode_metrics(decoded_batches):
+    """Passa os lotes descodificados, registando os tempos medidos nos processos de descodificação."""
+    for decoded in decoded_batches:
+        for image in decoded.images:
+            for stage, seconds in image.timings.items():
+                metrics.observe(stage, seconds)
+        yield decoded
+
+
+def project_run(files: list[Path]):
+    """Projeção de pedidos, tokens, custo e duração para `files`, com a configuração atual."""
+    return plan_run(
+        files, MODEL_CASCADE, PREPROCESS.long_edge, BATCHING.max_batch_size, PACK_BATCHES, MAX_BATCHES_IN_FLIGHT,
+        lambda prev, cur: is_file_boundary(prev, cur, BATCHING),
+        candidates_per_group=TEXT_CANDIDATES if LOCAL_GROUPING else None,
+        detail_long_edge=PREPROCESS.detail_long_edge if SEND_TEMPLE_DETAIL else 0,
+        detail_box=PREPROCESS.temple_box,
+    )
+
+
+def fit_to_budget(files: list[Path]) -> list[Path]:
+    """
+    Corta `files` ao que cabe na margem do orçamento, numa fronteira entre
+    produtos. A projeção é por excesso: a passagem seguinte volta a medir a
+    margem com o custo real.
+    """
+    remaining = budget.remaining() if budget is not None else None
+    if remaining is None:
+        return files
+    count = project_run(files).affordable(remaining)
+    while 0 < count < len(files) and not is_file_boundary(files[count - 1], files[count], BATCHING):
+        count -= 1
+    if count < len(files):
+        print(f"[ORÇAMENTO] Margem de ${max(remaining, 0):.2f}: {count} de {len(files)} ficheiros nesta passagem.")
+    return files[:count]
 
-    # 4. Processar lotes (agora com um loop while)
+
+def run_passes(all_files: list[Path], journal: CatalogJournal, store: StateStore, failures: FailureQueue,
+               batcher: AdaptiveBatcher, processed_files: set, wait_for_retries: bool = True) -> set:
+    """
+    Processa os ficheiros pendentes de `all_files`. Cada passagem divide os
+    ficheiros pendentes em lotes e mantém até MAX_BATCHES_IN_FLIGHT pedidos
+    em voo, com a descodificação, a API e a gravação sobrepostas; os lotes
+    são gravados pela ordem em que foram formados, seja qual for a ordem em
+    que a API responde. Ficheiros que não pertenciam ao modelo do seu lote voltam a ser
+    agrupados na passagem seguinte. Com orçamento (RUN_BUDGET_USD,
+    DAILY_BUDGET_USD) só é enviado o que cabe na margem; devolve os
+    ficheiros adiados por falta dele.
+    """
+    global batch_counter
+    deferred = set()  # Sem margem no orçamento da execução: ficam para uma próxima execução
     while True:
-        # 2. Encontrar arquivos para processar (DENTRO DO LOOP)
-        # Lê todos os ficheiros da pasta
-        all_files = []
-        for tipo in tipos_de_imagem:
-            all_files.extend(PASTA_ENTRADA.glob(tipo))
-            
-        # Carrega os dados de SUCESSO (do JSON) a cada iteração
-        all_data = load_data()
-        files_in_json = load_processed_files_from_json(all_data)
-        
-        # Combina ficheiros de SUCESSO (do json) com falhas DESTA SESSÃO
-        all_skipped_files = files_in_json.union(failed_files_session)
+        # Filtra os ficheiros de SUCESSO e as falhas cuja nova tentativa ainda não chegou
+        blocked = failures.blocked_filenames()
+        unprocessed_files = [p for p in all_files
+                             if p.name not in processed_files and p.name not in blocked and p.name not in deferred]
+        affordable = fit_to_budget(unprocessed_files)
+        if not affordable and unprocessed_files:
+            log_event("ORCAMENTO", f"Sem margem no orçamento; {len(unprocessed_files)} ficheiros adiados",
+                      [p.name for p in unprocessed_files])
+            deferred.update(p.name for p in unprocessed_files)
+        unprocessed_files = affordable
 
-        # Filtra usando o set combinado 'all_skipped_files'
-        unprocessed_files = sorted([p for p in all_files if p.name not in all_skipped_files])
-        
         if not unprocessed_files:
+            if deferred:
+                print(f"{len(deferred)} ficheiros adiados por falta de orçamento.")
+            next_retry = failures.next_retry_at()
+            if wait_for_retries and next_retry is not None and next_retry - time.time() <= MAX_RETRY_WAIT:
+                # Uma falha transitória vai poder ser tentada em breve: espera por ela.
+                wait_seconds = max(0.0, next_retry - time.time())
+                print(f"\nA aguardar {wait_seconds:.0f}s pela próxima tentativa agendada...")
+                time.sleep(wait_seconds)
+                continue
+            if next_retry is not None:
+                print(f"Ficheiros em espera para nova tentativa a partir de "
+                      f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_retry))}.")
             print("Nenhum arquivo novo para processar.")
-            break # Sai do loop while
+            return deferred
 
         total_files_remaining = len(unprocessed_files)
-        total_batches_remaining = (total_files_remaining + BATCH_SIZE - 1) // BATCH_SIZE
         print(f"\nEncontrados {total_files_remaining} arquivos novos para processar.")
 
-        # 3. Criar lote dinâmico
-        current_batch = unprocessed_files[:BATCH_SIZE]
-        
-        batch_counter += 1
-        print(f"\n--- Processando Lote {batch_counter} (Aprox. {total_batches_remaining} lotes restantes) ---")
-        
-        # 4.1. Validar imagens ANTES de enviar à API
-        valid_images_in_batch = []
-        for img_path in current_batch:
-            if validate_image(img_path):
-                valid_images_in_batch.append(img_path)
-            else:
-                # Se a imagem é inválida, 'validate_image' já logou.
-                # Adicionamos ao set em memória para a próxima iteração do while.
-                failed_files_session.add(img_path.name) 
-
-        if not valid_images_in_batch:
-            print("   [AVISO] Nenhuma imagem válida neste lote. A saltar.")
-            continue # Próxima iteração do loop while
-
-        # print the name of images being sent
-        print("   Imagens válidas neste lote:")
-        for img in valid_images_in_batch:
-            print(f"     - {img.name}")
-
-        #time.sleep(30)
-        # 4.2. Chamar a API (UMA SÓ VEZ)
-        api_result = call_gemini_process_batch(valid_images_in_batch)
-
-        # 4.3. Processar resultado da API
-        if not api_result or not api_result.get("data"):
-            print("   [FALHA] Nenhuma imagem chave encontrada pela API neste lote.")
-            # Loga o lote original
-            log_event("FALHA_API", "Nenhuma imagem chave encontrada no lote", [p.name for p in current_batch])
-            
-            # Adiciona todos os ficheiros deste lote ao set de falhas da sessão
-            for img_path in current_batch:
-                failed_files_session.add(img_path.name)
-            continue # Próxima iteração do loop while
-
-        # 4.4. Sucesso - Extrair dados da resposta
-        parsed_data = api_result["data"]
-        key_image_name = api_result["key_image_name"]
-        
-        key_image_path = None
-        for p in valid_images_in_batch:
-            if p.name == key_image_name:
-                key_image_path = p
-                break
-        
-        if not key_image_path:
-             print(f"   [ERRO] API retornou key_image '{key_image_name}' mas não foi encontrado no lote. A saltar.")
-             log_event("ERRO_INTERNO", f"API retornou '{key_image_name}' mas não foi encontrado", [p.name for p in current_batch])
-             # Loga todos os ficheiros do lote como "processados" (falhados)
-             for img_path in current_batch:
-                 failed_files_session.add(img_path.name)
-             continue
-
-        print(f"   [SUCESSO] Imagem Chave encontrada pela API: {key_image_name}")
-        print(f"   Dados extraídos: {parsed_data}")
-
-        matched_filenames = api_result["matched_filenames"]
-        matched_paths = [p for p in current_batch if p.name in matched_filenames]
-        
-        # 4.5. Organizar arquivos
-        reference_clean = str(parsed_data["reference"]).replace('/', '_').replace('\\', '_').strip()
-        if not reference_clean:
-                print(f"   [ERRO] Referência extraída está vazia. A ignorar lote.")
-                log_event("ERRO_DADOS", "Referência extraída está vazia", [p.name for p in current_batch])
-                # Loga todos os ficheiros do lote como "processados" (falhados)
-                for img_path in current_batch:
-                    failed_files_session.add(img_path.name)
-                continue
-                
-        target_dir = PASTA_SAIDA / reference_clean
-        target_dir.mkdir(exist_ok=True)
-        
-        print(f"   Movendo {len(matched_paths)} arquivos para {target_dir}")
-        
-        i = 0
-        for file_path in matched_paths:
+        # 3. Criar lotes desta passagem. A descodificação é feita em blocos fixos;
+        # os lotes enviados são cortados nas fronteiras prováveis entre produtos.
+        decode_chunks = [unprocessed_files[i:i + BATCH_SIZE] for i in range(0, total_files_remaining, BATCH_SIZE)]
+        print(f"A processar em lotes adaptativos ({PACK_BATCHES} por pedido, {MAX_BATCHES_IN_FLIGHT} pedidos em paralelo).")
+
+        # Etapas sobrepostas: descodificação e corte em lotes numa thread, a API em
+        # MAX_BATCHES_IN_FLIGHT threads e a gravação aqui, pela ordem dos lotes.
+        decoded_chunks = record_decode_metrics(
+            prefetch_batches(decode_chunks, PREPROCESS, DECODE_WORKERS, PREFETCH_BATCHES))
+        decoded_batches = batcher.batches(decoded_chunks)
+
+        packs = pack_batches(decoded_batches, PACK_BATCHES)
+        handle = metrics.profiled("handle", handle_batch_result)
+        api = metrics.profiled("api_pack", process_pack)
+        for pack, future in dispatch_ordered(packs, api, MAX_BATCHES_IN_FLIGHT, PIPELINE_AHEAD):
             try:
-                shutil.copy(str(file_path), str(target_dir / f"{parsed_data['reference']}_{parsed_data['color']}_{str(i)}.jpg"))
-            except Exception as e:
-                print(f"   [ERRO] Falha ao mover {file_path.name}: {e}")
-                log_event("ERRO_MOVIMENTO", f"Falha ao mover {file_path.name}: {e}", [file_path.name])
-                if (target_dir / file_path.name).exists():
-                        print(f"   Ficheiro já existia no destino.")
-            i += 1
-        
-        # 4.6. Salvar dados (no novo formato)
-        # Prepara os ficheiros adicionais (todos os 'matched' exceto o 'key')
-        additional_files = [p.name for p in matched_paths if p.name != key_image_name]
-        save_data(all_data, parsed_data, key_image_name, additional_files)
-        
-        # Loga o sucesso
-        log_event("SUCESSO", f"Ref {parsed_data['reference']} Cor {parsed_data['color']}", [p.name for p in matched_paths])
+                api_results = future.result()
+            except BudgetExceededError as e:
+                names = [img.name for decoded in pack for img in decoded.images]
+                print(f"\n   [ORÇAMENTO] {e}. {len(pack)} lotes adiados.")
+                log_event("ORCAMENTO", f"Lotes adiados: {e}", names, error_class=BUDGET)
+                for decoded in pack:
+                    report_invalid_images(decoded, failures)
+                if e.retry_at is None:
+                    deferred.update(names)
+                else:
+                    failures.record(names, BUDGET, str(e), retry_at=e.retry_at)
+                continue
+            except QuotaExhaustedError as e:
+                # Os lotes voltam quando o recuo da quota terminar (ver failure_queue.py).
+                print(f"\n   [QUOTA] Quota esgotada após várias tentativas. {len(pack)} lotes serão reenviados.")
+                log_event("QUOTA_ESGOTADA", f"Lotes adiados: {e}", [p.name for decoded in pack for p in decoded.paths],
+                          error_class=QUOTA)
+                for decoded in pack:
+                    report_invalid_images(decoded, failures)
+                    failures.record([img.name for img in decoded.images], QUOTA, str(e))
+                continue
+            # Resultados separados por lote, para o fluxo habitual de cópia e gravação.
+            for decoded, api_result in zip(pack, api_results):
+                current_batch = decoded.paths
+                batch_counter += 1
+                print(f"\n--- Lote {batch_counter} concluído ({', '.join(p.name for p in current_batch)}) ---")
+                report_invalid_images(decoded, failures)
+                handle(current_batch, decoded.valid_paths, api_result, journal, store,
+                       batcher, processed_files, failures, {img.name: img.content_hash for img in decoded.images})
 
-        
-        # 4.7. Pausa (Req 4)
-        # Verifica se a pausa é necessária e se ainda há ficheiros para processar
-        # Recalcula os ficheiros restantes (sem os que acabaram de ser processados com sucesso)
-        # remaining_after_success = len(unprocessed_files) - len(matched_paths)
-        
-        # if batch_counter % PAUSE_AFTER_BATCHES == 0 and remaining_after_success > 0:
-        #     print(f"\n--- Pausado após {batch_counter} lotes. ---")
-        #     try:
-        #         input("Pressione Enter para continuar (ou CTRL+C para parar)...")
-        #     except KeyboardInterrupt:
-        #         print("\nProcessamento interrompido pelo usuário.")
-        #         log_event("SCRIPT_STOP", "Script interrompido pelo usuário.")
-        #         break # Sai do loop while
+
+def run_claimed_segments(all_files: list[Path], journal: CatalogJournal, store: StateStore,
+                         failures: FailureQueue, batcher: AdaptiveBatcher, processed_files: set,
+                         claims: ClaimManager, wait_for_retries: bool = True):
+    """
+    Modo distribuído: reserva segmentos de ficheiros livres até não haver
+    mais e processa cada um com `run_passes`. As falhas de um segmento ficam
+    com este trabalhador (a fila de falhas é local) e são tentadas no fim.
+    """
+    while True:
+        blocked = failures.blocked_filenames()
+        candidates = [p for p in all_files if p.name not in processed_files and p.name not in blocked]
+        claim = claims.claim(candidates, CLAIM_SIZE, lambda prev, cur: is_file_boundary(prev, cur, BATCHING))
+        if claim is None:
+            break
+        print(f"\n[CLAIM] Segmento reservado por {WORKER_ID}: {claim.paths[0].name} a "
+              f"{claim.paths[-1].name} ({len(claim.paths)} ficheiros).")
+        log_event("CLAIM", f"Segmento reservado por {WORKER_ID}", claim.filenames)
+        try:
+            deferred = run_passes(claim.paths, journal, store, failures, batcher, processed_files,
+                                  wait_for_retries=False)
+        except BaseException:
+            # Interrompido: o segmento volta a ficar livre (os lotes já gravados são idempotentes).
+            claims.release(claim)
+            raise
+        if deferred:
+            # Sem orçamento: o segmento fica livre para outro trabalhador e este não reserva mais.
+            claims.release(claim)
+            break
+        claims.complete(claim)
+
+    failed = {entry[0] for entry in failures.entries()}
+    retries = [p for p in all_files if p.name in failed and p.name not in processed_files]
+    if retries:
+        run_passes(retries, journal, store, failures, batcher, processed_files, wait_for_retries)
+    else:
+        print("Nenhum segmento livre para processar.")
+
+
+def report_output_error(file_path: Path, error: Exception):
+    """Falha ao colocar uma imagem na pasta de saída (chamada na thread da cópia)."""
+    print(f"   [ERRO] Falha ao mover {file_path.name}: {error}")
+    log_event("ERRO_MOVIMENTO", f"Falha ao mover {file_path.name}: {error}", [file_path.name],
+              error_class=type(error).__name__)
+
+
+def watch_folder(all_files: list[Path], journal: CatalogJournal, store: StateStore, failures: FailureQueue,
+                 batcher: AdaptiveBatcher, processed_files: set, claims: ClaimManager | None = None):
+    """
+    Modo contínuo: fica à espera de novas fotografias na pasta de entrada.
+    Uma passagem começa quando as chegadas param durante WATCH_QUIET_SECONDS
+    (o produto em curso está completo), quando há WATCH_MAX_PENDING ficheiros
+    à espera ou quando uma nova tentativa agendada chega ao prazo.
+    """
+    watcher = FolderWatcher(PASTA_ENTRADA, IMAGE_PATTERNS, WATCH_SETTLE_SECONDS, WATCH_POLL_SECONDS,
+                            known={p.name for p in all_files})
+    mode = "eventos do sistema de ficheiros" if watcher.uses_events else f"listagem a cada {WATCH_POLL_SECONDS}s"
+    print(f"\nModo contínuo ({mode}): a aguardar novas fotografias. Ctrl+C para terminar.")
+    log_event("WATCH_START", f"Modo contínuo iniciado ({mode}).")
+    pending = 0
+    last_arrival = time.monotonic()
+    try:
+        while True:
+            new_files = watcher.wait(WATCH_POLL_SECONDS)
+            if new_files:
+                for path in new_files:
+                    bisect.insort(all_files, path)
+                # Uma cópia renomeada de uma fotografia já processada não conta como nova.
+                processed_files.update(find_processed(new_files))
+                pending += len(new_files)
+                last_arrival = time.monotonic()
+                print(f"   + {len(new_files)} fotografias novas ({pending} à espera).")
+            quiet = time.monotonic() - last_arrival >= WATCH_QUIET_SECONDS
+            if (pending and (quiet or pending >= WATCH_MAX_PENDING)) or failures.has_due():
+                if claims is not None:
+                    run_claimed_segments(all_files, journal, store, failures, batcher, processed_files, claims,
+                                         wait_for_retries=False)
+                else:
+                    run_passes(all_files, journal, store, failures, batcher, processed_files, wait_for_retries=False)
+                pending = 0
+                print("\nA aguardar novas fotografias...")
+    except KeyboardInterrupt:
+        print("\nModo contínuo interrompido.")
+        log_event("WATCH_STOP", "Modo contínuo interrompido.")
+    finally:
+        watcher.close()
+
+
+def dry_run():
+    """Projeção para os ficheiros pendentes de PASTA_ENTRADA, sem chamar a API."""
+    all_files = sorted(p for p in PASTA_ENTRADA.iterdir() if p.is_file() and matches(p.name, IMAGE_PATTERNS))
+    store = StateStore(STATE_DB)
+    failures = FailureQueue(STATE_DB)
+    index = FingerprintIndex(STATE_DB)
+    projection_budget = Budget(STATE_DB, RUN_BUDGET_USD, DAILY_BUDGET_USD)
+    try:
+        excluded = set(index.processed(all_files, store.processed_filenames())) | failures.blocked_filenames()
+        pending = [p for p in all_files if p.name not in excluded]
+        print(f"Projeção para {PASTA_ENTRADA} ({len(all_files) - len(pending)} ficheiros já processados ou em espera):")
+        print_plan(project_run(pending), projection_budget)
+    finally:
+        projection_budget.close()
+        index.close()
+        failures.close()
+        store.close()
+
+
+def main(watch: bool = WATCH, distributed: bool = DISTRIBUTED, profile: bool = PROFILE):
+    global batch_counter, output_stage, metrics, event_log, budget, fingerprints
+    start = time.perf_counter()
+    print("Iniciando script de processamento de óculos...")
+    print(f"Pasta de Entrada: {PASTA_ENTRADA}")
+    print(f"Pasta de Saída: {PASTA_SAIDA}")
+    if distributed:
+        print(f"Modo distribuído: trabalhador '{WORKER_ID}'.")
+    log_event("SCRIPT_START", "Script iniciado.")
+
+    # 1. Setup inicial
+    PASTA_SAIDA.mkdir(exist_ok=True)
+    batch_counter = 0
+    metrics = Metrics(METRICS_FILE, PROFILE_DIR if profile else None)
+
+    # 2. Encontrar arquivos para processar (uma única vez; no modo contínuo
+    # os ficheiros novos são acrescentados pelo FolderWatcher)
+    with metrics.timer("scan"):
+        all_files = sorted(p for p in PASTA_ENTRADA.iterdir() if p.is_file() and matches(p.name, IMAGE_PATTERNS))
+
+    # Falhas anteriores de cada ficheiro nesta sessão (re-janelamento)
+    batcher = AdaptiveBatcher(BATCHING, GROUPING, attempts={})
+
+    # Catálogo (JSON + journal) e ficheiros de SUCESSO, lidos uma vez e atualizados a cada lote
+    try:
+        if distributed:
+            journal = CatalogJournal(SHARED_DATA_FILE, SHARED_DATA_FILE.with_name(
+                f"{SHARED_DATA_FILE.stem}.{WORKER_ID}.journal.jsonl"), shared=True)
+        else:
+            journal = CatalogJournal(DATA_FILE, JOURNAL_FILE)
+    except CatalogCorruptError as e:
+        # Não recomeça do zero: um catálogo vazio faria reprocessar (e pagar) tudo.
+        print(f"ERRO: {e}. Corrija ou remova o ficheiro antes de continuar.")
+        log_event("ERRO_JSON", str(e))
+        return
+    store = open_state_store(journal)
+    # Pelo conteúdo: um nome da câmara reutilizado é processado, um ficheiro renomeado não.
+    # Os nomes do catálogo só contam para ficheiros de antes do índice de impressões digitais.
+    fingerprints = FingerprintIndex(STATE_DB)
+    with metrics.timer("fingerprints"):
+        processed_files = find_processed(all_files, store.processed_filenames())
+    # Falhas (corrompidas, falhas de API, ...) com a próxima tentativa agendada
+    failures = FailureQueue(STATE_DB)
+    claims = ClaimManager(CLAIMS_DIR, WORKER_ID, LEASE_SECONDS) if distributed else None
+    output_stage = OutputStage(PASTA_SAIDA, OUTPUT_LINK_MODE, OUTPUT_FORMAT, workers=OUTPUT_WORKERS,
+                               on_error=report_output_error, metrics=metrics)
+    budget = Budget(STATE_DB, RUN_BUDGET_USD, DAILY_BUDGET_USD)
+
+    # 4. Processar lotes
+    try:
+        if claims is not None:
+            run_claimed_segments(all_files, journal, store, failures, batcher, processed_files, claims,
+                                 wait_for_retries=not watch)
+        else:
+            run_passes(all_files, journal, store, failures, batcher, processed_files, wait_for_retries=not watch)
+        if watch:
+            watch_folder(all_files, journal, store, failures, batcher, processed_files, claims)
+    finally:
+        if claims is not None:
+            claims.close()
+        output_stage.close()
+        placed = ", ".join(f"{count} por {method}" for method, count in sorted(output_stage.counts.items()))
+        print(f"Imagens organizadas em {PASTA_SAIDA}: {placed or 'nenhuma'}.")
+        # Compactação final do journal no JSON
+        export_data(journal)
+        store.close()
+        failures.close()
+        fingerprints.close()
+        fingerprints = None
+        metrics.close()
+        spent = ", ".join(f"{count} a {model}" for model, count in sorted(budget.run_requests.items()))
+        print(f"Custo estimado desta execução: ${budget.run_cost:.2f} ({spent or 'sem pedidos'}).")
+        budget.close()
 
     print("\nProcessamento concluído.")
-    log_event("SCRIPT_END", "Processamento concluído.")
+    log_event("SCRIPT_END", "Processamento concluído.", batch=batch_counter, seconds=round(time.perf_counter() - start, 1))
+    event_log.close()
+    atexit.unregister(event_log.close)
+    event_log = None
 
 if __name__ == "__main__":
     if not PASTA_ENTRADA.is_dir():
         print(f"ERRO: A pasta de entrada '{PASTA_ENTRADA}' não foi encontrada.")
+    elif "--dry-run" in sys.argv:
+        dry_run()
     else:
-        main()
\ No newline at end of file
+        load_models()
+        main(watch=WATCH or "--watch" in sys.argv, distributed=DISTRIBUTED or "--distributed" in sys.argv,
+             profile=PROFILE or "--profile" in sys.argv)
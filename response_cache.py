@@ -0,0 +1,129 @@
+"""
+Cache em disco das respostas do Gemini, endereçado pelo conteúdo.
+
+A chave de cada entrada é o hash do conteúdo de cada imagem enviada mais
+uma impressão digital do prompt e do modelo. Se as mesmas imagens voltarem
+a ser analisadas com o mesmo prompt, a resposta vem do disco e a chamada à
+API é evitada. Entradas antigas ou em excesso são removidas (LRU).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_FILE = Path("gemini_cache.sqlite")
+MAX_CACHE_ENTRIES = 100_000
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+MAX_CACHE_AGE_DAYS = 180
+_EVICT_EVERY_PUTS = 200
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 do conteúdo do ficheiro."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_fingerprint(model_name: str, prompt_template: str) -> str:
+    """Impressão digital do par modelo/prompt. Mudar qualquer um invalida o cache."""
+    return hashlib.sha256(f"{model_name}\0{prompt_template}".encode('utf-8')).hexdigest()
+
+
+def make_key(image_hashes: list[str], fingerprint: str) -> str:
+    """Chave de um pedido: hashes das imagens (pela ordem enviada) + impressão digital."""
+    return hashlib.sha256("\0".join([fingerprint, *image_hashes]).encode('ascii')).hexdigest()
+
+
+class ResponseCache:
+    """Cache SQLite, seguro para uso a partir de várias threads."""
+
+    def __init__(self, path: Path = CACHE_FILE, max_entries: int = MAX_CACHE_ENTRIES,
+                 max_bytes: int = MAX_CACHE_BYTES, max_age_days: float = MAX_CACHE_AGE_DAYS):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                   key TEXT PRIMARY KEY,
+                   value TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str):
+        """Devolve o valor guardado (já descodificado) ou None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value):
+        """Guarda um valor serializável em JSON."""
+        encoded = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, len(encoded), now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            due = self._puts % _EVICT_EVERY_PUTS == 0
+        if due:
+            self.evict()
+
+    def discard(self, key: str):
+        """Remove uma entrada (resposta rejeitada depois de guardada)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self):
+        """Remove entradas expiradas e, se necessário, as menos usadas recentemente."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                # Remove as mais antigas (por uso) até ficar abaixo de 90% dos limites.
+                target_count = int(self.max_entries * 0.9)
+                target_bytes = int(self.max_bytes * 0.9)
+                excess_count = max(0, count - target_count)
+                removed = 0
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+                doomed = []
+                for key, size in rows:
+                    if len(doomed) >= excess_count and total - removed <= target_bytes:
+                        break
+                    doomed.append((key,))
+                    removed += size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,207 @@
+"""
+Estado persistente do processamento numa base SQLite indexada.
+
+Substitui a releitura do `extracted_data.json` a cada lote: os ficheiros já
+processados, as referências e as cores ficam em tabelas indexadas e são
+atualizados de forma incremental, uma transação por lote. O JSON é mantido
+pelo journal do catálogo (catalog_journal.py) e pode também ser regenerado
+a partir desta base a pedido:
+
+    python state_store.py export [destino.json]
+"""
+import json
+import os
+import sqlite3
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+STATE_DB = Path("processing_state.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    reference TEXT PRIMARY KEY,
+    size1 TEXT,
+    size2 TEXT,
+    size3 TEXT,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS colors (
+    reference TEXT NOT NULL,
+    color TEXT NOT NULL,
+    key_file TEXT NOT NULL,
+    additional_files TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (reference, color)
+);
+CREATE INDEX IF NOT EXISTS idx_colors_color ON colors(color);
+CREATE INDEX IF NOT EXISTS idx_colors_position ON colors(reference, position);
+CREATE INDEX IF NOT EXISTS idx_refs_position ON refs(position);
+CREATE INDEX IF NOT EXISTS idx_refs_sizes ON refs(size1, size2, size3);
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    reference TEXT NOT NULL,
+    color TEXT NOT NULL,
+    role TEXT NOT NULL,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_ref_color ON files(reference, color);
+"""
+
+
+def merge_files(key_file: str, additional_files: list, new_key_file: str, new_additional: list) -> tuple:
+    """
+    Ficheiros de uma (referência, cor) depois de mais um lote do mesmo
+    produto (dividido pelo re-janelamento ou pelo limite do grupo): a imagem
+    chave existente mantém-se e os ficheiros novos são acrescentados, sem
+    repetições. Reaplicar o mesmo lote não muda nada.
+    """
+    known = {key_file, *additional_files}
+    merged = list(additional_files)
+    for name in [new_key_file, *new_additional]:
+        if name not in known:
+            known.add(name)
+            merged.append(name)
+    return key_file, merged
+
+
+class StateStore:
+    """Referências, cores e ficheiros processados, em SQLite."""
+
+    def __init__(self, path: Path = STATE_DB):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def is_empty(self) -> bool:
+        return self._conn.execute("SELECT 1 FROM refs LIMIT 1").fetchone() is None
+
+    def processed_filenames(self) -> set:
+        """Nomes de todos os ficheiros já processados com sucesso."""
+        return {row[0] for row in self._conn.execute("SELECT filename FROM files")}
+
+    def counts(self) -> dict:
+        """Nº de referências, cores e ficheiros processados."""
+        return {table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("refs", "colors", "files")}
+
+    def is_processed(self, filename: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM files WHERE filename = ?", (filename,)).fetchone() is not None
+
+    def lookup_file(self, filename: str) -> tuple | None:
+        """(referência, cor) de um ficheiro processado, ou None."""
+        return self._conn.execute("SELECT reference, color FROM files WHERE filename = ?", (filename,)).fetchone()
+
+    def _record(self, reference: str, sizes: tuple, color: str, key_file: str, additional_files: list):
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM refs WHERE reference = ?", (reference,)).fetchone() is None:
+            position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM refs").fetchone()[0]
+            conn.execute("INSERT INTO refs VALUES (?, ?, ?, ?, ?)", (reference, *sizes, position))
+
+        existing = conn.execute(
+            "SELECT position, key_file, additional_files FROM colors WHERE reference = ? AND color = ?",
+            (reference, color),
+        ).fetchone()
+        if existing is None:
+            position = conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM colors WHERE reference = ?", (reference,)
+            ).fetchone()[0]
+        else:
+            # A cor já existe (outro lote do mesmo produto): os ficheiros são juntados.
+            position = existing[0]
+            key_file, additional_files = merge_files(existing[1], json.loads(existing[2]), key_file, additional_files)
+        conn.execute(
+            "INSERT OR REPLACE INTO colors VALUES (?, ?, ?, ?, ?)",
+            (reference, color, key_file, json.dumps(additional_files, ensure_ascii=False), position),
+        )
+        now = time.time()
+        rows = [(key_file, reference, color, "key", now)]
+        rows += [(name, reference, color, "additional", now) for name in additional_files]
+        conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+
+    def record_batch(self, data: dict, key_file: str, additional_files: list):
+        """Regista o resultado de um lote (uma transação)."""
+        sizes = (data.get('size1'), data.get('size2'), data.get('size3'))
+        with self._conn:
+            self._record(data['reference'], sizes, data['color'], key_file, additional_files)
+
+    def import_json(self, json_path: Path) -> int:
+        """Importa um `extracted_data.json` (formato aninhado). Devolve o nº de cores."""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return self.import_entries(json.load(f))
+
+    def import_entries(self, data_list: list, replace: bool = False) -> int:
+        """
+        Importa entradas no formato aninhado. Com `replace`, o catálogo atual
+        é substituído (na mesma transação). Devolve o nº de cores.
+        """
+        count = 0
+        with self._conn:
+            if replace:
+                for table in ("files", "colors", "refs"):
+                    self._conn.execute(f"DELETE FROM {table}")
+            for entry in data_list:
+                sizes = (entry.get('size1'), entry.get('size2'), entry.get('size3'))
+                for group in entry.get('image_files', []):
+                    if not group.get('key_file') or not group.get('color'):
+                        continue
+                    self._record(entry['reference'], sizes, group['color'], group['key_file'],
+                                 group.get('additional_files', []))
+                    count += 1
+        return count
+
+    def iter_catalogue(self):
+        """Gera as entradas no formato aninhado de `extracted_data.json`, por ordem de inserção."""
+        refs = self._conn.execute("SELECT reference, size1, size2, size3 FROM refs ORDER BY position")
+        for reference, size1, size2, size3 in refs:
+            groups = self._conn.execute(
+                "SELECT color, key_file, additional_files FROM colors WHERE reference = ? ORDER BY position",
+                (reference,),
+            ).fetchall()
+            yield {
+                "reference": reference,
+                "size1": size1,
+                "size2": size2,
+                "size3": size3,
+                "image_files": [
+                    {"color": color, "key_file": key_file, "additional_files": json.loads(additional)}
+                    for color, key_file, additional in groups
+                ],
+            }
+
+    def export_json(self, json_path: Path):
+        """
+        Escreve o catálogo em JSON (escrita atómica: ficheiro temporário +
+        rename). As referências são escritas uma a uma, sem montar a lista.
+        """
+        json_path = Path(json_path)
+        tmp_path = json_path.with_name(json_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # Mesmo texto que json.dump(lista, indent=2).
+            f.write("[")
+            empty = True
+            for entry in self.iter_catalogue():
+                f.write("\n" if empty else ",\n")
+                f.write(textwrap.indent(json.dumps(entry, indent=2, ensure_ascii=False), "  "))
+                empty = False
+            f.write("]" if empty else "\n]")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, json_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        print("Uso: python state_store.py export [destino.json]")
+        sys.exit(1)
+    destino = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("extracted_data.json")
+    store = StateStore()
+    store.export_json(destino)
+    store.close()
+    print(f"Catálogo exportado para {destino}.")
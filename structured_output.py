@@ -0,0 +1,218 @@
+"""
+Respostas estruturadas: esquemas JSON das respostas e leitura tolerante.
+
+Os esquemas seguem o formato `response_schema` da API Gemini (tipos OBJECT,
+ARRAY, STRING, NUMBER, INTEGER, `nullable`), que obriga o modelo a devolver
+JSON com esses campos. A mesma definição é verificada localmente com
+`conform`, que também corrige o que é inofensivo (números em campos de texto).
+
+`parse_response` lê o texto da resposta mesmo com prosa à volta, cercas
+```json, vírgulas finais ou uma resposta cortada a meio: neste último caso
+devolve o maior prefixo completo, com os objetos que ficaram por fechar
+marcados com PARTIAL_KEY. `conform` rejeita esses objetos (uma lista cortada
+a meio, como matched_filenames, ainda passaria no esquema, mais curta): o
+lote é reenviado em vez de ser guardado no cache e no catálogo. Num pedido
+agrupado, os lotes completos antes do corte são aproveitados.
+"""
+import json
+import re
+
+# Marca os objetos fechados à força ao reparar uma resposta cortada
+PARTIAL_KEY = "__partial__"
+
+_DATA_SCHEMA = {
+    "type": "OBJECT",
+    "nullable": True,
+    "properties": {
+        "reference": {"type": "STRING"},
+        "size1": {"type": "STRING"},
+        "size2": {"type": "STRING"},
+        "size3": {"type": "STRING"},
+        "color": {"type": "STRING"},
+    },
+    "required": ["reference", "size1", "size2", "size3", "color"],
+}
+
+# Resposta de um lote com comparação (PROMPT_PROCESS_BATCH)
+BATCH_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "key_image_name": {"type": "STRING", "nullable": True},
+        "data": _DATA_SCHEMA,
+        "matched_filenames": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "raw_text": {"type": "STRING", "nullable": True},
+        "confidence": {"type": "NUMBER", "nullable": True},
+    },
+    "required": ["key_image_name", "data", "matched_filenames"],
+}
+
+# Resposta de um grupo já formado localmente (PROMPT_READ_GROUP)
+GROUP_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {k: v for k, v in BATCH_SCHEMA["properties"].items() if k != "matched_filenames"},
+    "required": ["key_image_name", "data"],
+}
+
+# Resposta de imagem única do processar_oculos.py
+EXTRACT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "referencia": {"type": "STRING", "nullable": True},
+        "cor": {"type": "STRING", "nullable": True},
+    },
+    "required": ["referencia", "cor"],
+}
+
+
+def packed_schema(batch_schema: dict) -> dict:
+    """Vários lotes num só pedido: lista 'batches' com o número de cada lote."""
+    item = {
+        "type": "OBJECT",
+        "properties": {"batch": {"type": "INTEGER"}, **batch_schema["properties"]},
+        "required": ["batch"] + batch_schema["required"],
+    }
+    return {
+        "type": "OBJECT",
+        "properties": {"batches": {"type": "ARRAY", "items": item}},
+        "required": ["batches"],
+    }
+
+
+# --- Verificação local ---
+
+def conform(value, schema: dict, path: str = "$"):
+    """
+    Verifica `value` contra `schema`. Devolve (valor corrigido, problemas);
+    lista de problemas vazia = conforme. Números em campos STRING passam a
+    texto e texto numérico em campos NUMBER/INTEGER passa a número.
+    """
+    if value is None:
+        return None, ([] if schema.get("nullable") else [f"{path}: valor nulo"])
+    kind = schema["type"]
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            return value, [f"{path}: esperado um objeto"]
+        if value.get(PARTIAL_KEY):
+            return value, [f"{path}: resposta cortada"]
+        problems = [f"{path}.{name}: em falta" for name in schema.get("required", []) if name not in value]
+        fixed = dict(value)
+        for name, sub in schema.get("properties", {}).items():
+            if name in value:
+                fixed[name], sub_problems = conform(value[name], sub, f"{path}.{name}")
+                problems += sub_problems
+        return fixed, problems
+    if kind == "ARRAY":
+        if not isinstance(value, list):
+            return value, [f"{path}: esperada uma lista"]
+        fixed, problems = [], []
+        for i, item in enumerate(value):
+            item, item_problems = conform(item, schema["items"], f"{path}[{i}]")
+            fixed.append(item)
+            problems += item_problems
+        return fixed, problems
+    if kind == "STRING":
+        if isinstance(value, str):
+            return value, []
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value), []
+        return value, [f"{path}: esperado texto"]
+    if kind in ("NUMBER", "INTEGER"):
+        if isinstance(value, str):
+            try:
+                value = float(value.strip().replace(",", "."))
+            except ValueError:
+                return value, [f"{path}: esperado um número"]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return value, [f"{path}: esperado um número"]
+        if kind == "INTEGER":
+            if value != int(value):
+                return value, [f"{path}: esperado um inteiro"]
+            value = int(value)
+        return value, []
+    return value, []
+
+
+# --- Leitura tolerante ---
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", text))
+
+
+def _scan(text: str, start: int):
+    """
+    Percorre o JSON que começa em `start`. Devolve (fim, cortes): `fim` é o
+    índice a seguir ao fecho do valor de topo (None se o texto acabar antes)
+    e `cortes` são pares (posição, fechos) onde o prefixo pode ser fechado.
+    """
+    stack = []
+    cuts = []
+    in_string = escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c in _CLOSERS:
+            stack.append(_CLOSERS[c])
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return i + 1, cuts
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif c == ",":
+            cuts.append((i, "".join(reversed(stack))))
+    return None, cuts
+
+
+def parse_response(text: str):
+    """
+    Lê o JSON de uma resposta do modelo. Tenta, por ordem: o texto inteiro,
+    o conteúdo de uma cerca ```json, o primeiro objeto equilibrado no meio de
+    prosa e, por fim, o maior prefixo de uma resposta cortada, com
+    PARTIAL_KEY nos objetos que ficaram por fechar. Lança ValueError se nada
+    for aproveitável.
+    """
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    fenced = _FENCE_RE.search(text)
+    candidates = [fenced.group(1).strip()] if fenced else []
+    candidates.append(text)
+    for candidate in candidates:
+        starts = [i for i in (candidate.find("{"), candidate.find("[")) if i >= 0]
+        if not starts:
+            continue
+        start = min(starts)
+        end, cuts = _scan(candidate, start)
+        if end is not None:
+            try:
+                return _loads(candidate[start:end])
+            except json.JSONDecodeError:
+                pass
+        # Resposta cortada: fecha o maior prefixo que ainda for JSON válido,
+        # marcando os objetos incompletos.
+        for position, closers in reversed(cuts):
+            closers = closers.replace("}", f', "{PARTIAL_KEY}": true}}')
+            try:
+                return _loads(candidate[start:position] + closers)
+            except json.JSONDecodeError:
+                continue
+    raise ValueError(f"Resposta sem JSON aproveitável: {text[:80]!r}")
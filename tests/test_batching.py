@@ -0,0 +1,52 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+from PIL import Image
+
+import batching
+from batching import AdaptiveBatcher, BatchingConfig, is_file_boundary
+from decode_pipeline import DecodedBatch
+from grouping import GroupingConfig
+
+NAMES = [f"RUS_{i:04d}.jpg" for i in range(12)]
+
+
+def _windows(attempts: dict) -> list:
+    images = [SimpleNamespace(name=name, captured_at=None, features=None) for name in NAMES]
+    decoded = DecodedBatch(paths=[Path(name) for name in NAMES], images=images, errors={})
+    batcher = AdaptiveBatcher(BatchingConfig(use_visual=False), GroupingConfig(), attempts)
+    return [[path.name for path in batch.paths] for batch in batcher.batches([decoded])]
+
+
+def test_fresh_files_are_cut_at_the_size_cap():
+    assert _windows({}) == [NAMES[0:5], NAMES[5:10], NAMES[10:12]]
+
+
+def test_window_that_failed_once_slides_into_the_next_one():
+    assert _windows(dict.fromkeys(NAMES[0:5], 1)) == [NAMES[0:10], NAMES[10:12]]
+
+
+def test_window_that_failed_twice_is_bisected():
+    assert _windows(dict.fromkeys(NAMES[0:5], 2)) == [NAMES[0:2], NAMES[2:5], NAMES[5:10], NAMES[10:12]]
+
+
+def test_attempts_are_read_once_per_pass():
+    attempts = {}
+    images = [SimpleNamespace(name=name, captured_at=None, features=None) for name in NAMES]
+    batcher = AdaptiveBatcher(BatchingConfig(use_visual=False), GroupingConfig(), attempts)
+    batches = batcher.batches([DecodedBatch(paths=[Path(n) for n in NAMES], images=images, errors={})])
+    attempts.update(dict.fromkeys(NAMES, 2))  # Falhas registadas durante a passagem
+    assert [len(batch.paths) for batch in batches] == [5, 5, 2]
+
+
+def test_file_boundaries_reuse_cached_capture_times(tmp_path, monkeypatch):
+    paths = []
+    for name in ("RUS_0001.jpg", "RUS_0002.jpg"):
+        Image.new("RGB", (8, 8)).save(tmp_path / name)
+        paths.append(tmp_path / name)
+    reads = []
+    monkeypatch.setattr(batching, "capture_time", lambda img: reads.append(img) or 100.0)
+    monkeypatch.setattr(batching, "_capture_times", {})
+    for _ in range(3):
+        assert not is_file_boundary(paths[0], paths[1], BatchingConfig())
+    assert len(reads) == 2
@@ -0,0 +1,104 @@
+import pytest
+from PIL import Image
+
+import budget as budget_module
+from budget import OUTPUT_TOKENS_PER_BATCH, Budget, BudgetExceededError, Plan, cost, plan_run
+
+MODEL = "gemini-2.5-flash"
+TOKENS = 10_000_000  # Uma chamada de ~3 USD, para os limites serem fáceis de atingir
+
+
+@pytest.fixture
+def make_budget(tmp_path):
+    budgets = []
+
+    def make(**kwargs):
+        kwargs.setdefault("quotas", {})
+        budget = Budget(tmp_path / "state.sqlite", **kwargs)
+        budgets.append(budget)
+        return budget
+
+    yield make
+    for budget in budgets:
+        budget.close()
+
+
+def test_reserve_counts_in_flight_calls_and_release_restores_margin(make_budget):
+    budget = make_budget(run_budget=10.0)
+    expected = cost(MODEL, TOKENS, OUTPUT_TOKENS_PER_BATCH)
+    reserved = budget.reserve(MODEL, TOKENS)
+    assert reserved == pytest.approx(expected)
+    assert budget.remaining() == pytest.approx(10.0 - expected)
+    assert budget._reserved_requests[MODEL] == 1
+    budget.release(MODEL, reserved)
+    assert budget.remaining() == pytest.approx(10.0)
+    assert budget._reserved_requests[MODEL] == 0
+    assert budget.run_cost == 0.0
+
+
+def test_reservations_stop_at_the_run_budget(make_budget):
+    budget = make_budget(run_budget=7.0)
+    first = budget.reserve(MODEL, TOKENS)
+    budget.reserve(MODEL, TOKENS)
+    with pytest.raises(BudgetExceededError) as error:
+        budget.reserve(MODEL, TOKENS)  # A terceira passaria o limite com as duas em voo
+    assert error.value.retry_at is None
+    budget.release(MODEL, first)
+    budget.reserve(MODEL, TOKENS)
+
+
+def test_record_moves_the_reservation_to_the_persisted_usage(make_budget):
+    budget = make_budget(daily_budget=100.0)
+    reserved = budget.reserve(MODEL, TOKENS)
+    budget.record(MODEL, 1000, 100, reserved=reserved)
+    spent = cost(MODEL, 1000, 100)
+    assert budget.run_cost == pytest.approx(spent)
+    assert budget.run_requests == {MODEL: 1}
+    assert budget.today(MODEL) == (1, pytest.approx(spent))
+    assert budget.remaining() == pytest.approx(100.0 - spent)
+    # O consumo do dia fica na base: outra execução vê-o.
+    assert make_budget(daily_budget=100.0).today() == (1, pytest.approx(spent))
+
+
+def test_daily_limits_retry_after_midnight(make_budget):
+    budget = make_budget(daily_budget=1.0, quotas={MODEL: {"rpd": 1}})
+    with pytest.raises(BudgetExceededError) as error:
+        budget.check(MODEL, TOKENS)
+    assert error.value.retry_at is not None
+    budget.record(MODEL, 10, 10)
+    with pytest.raises(BudgetExceededError, match="pedidos"):
+        budget.check(MODEL, 10)
+
+
+def test_remaining_without_limits_is_none(make_budget):
+    assert make_budget().remaining() is None
+
+
+def test_affordable_counts_files_from_the_start():
+    plan = Plan(files=4, file_costs=[1.0, 2.0, 3.0, 4.0])
+    assert plan.affordable(None) == 4
+    assert plan.affordable(0.5) == 0
+    assert plan.affordable(3.0) == 2
+    assert plan.affordable(5.9) == 2
+    assert plan.affordable(100.0) == 4
+
+
+def test_plan_run_reuses_cached_sizes(tmp_path, monkeypatch):
+    files = []
+    for index in range(3):
+        path = tmp_path / f"IMG_{index}.jpg"
+        Image.new("RGB", (800, 600)).save(path)
+        files.append(path)
+    first = plan_run(files, [MODEL], 1024, 8, 1, 1)
+    assert len(first.file_costs) == 3
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cabeçalho reaberto")
+
+    monkeypatch.setattr(Image, "open", fail)
+    assert plan_run(files, [MODEL], 1024, 8, 1, 1).file_costs == first.file_costs
+    monkeypatch.undo()
+
+    Image.new("RGB", (1600, 1200)).save(files[0])  # Alterado: o mtime muda
+    budget_module._image_sizes[files[0]] = (0, (800, 600))  # Garante um mtime diferente do guardado
+    assert budget_module._image_size(files[0]) == (1600, 1200)
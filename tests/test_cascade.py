@@ -0,0 +1,58 @@
+import pytest
+
+import processar_oculos2 as pipeline
+from backends import MockBackend
+from dispatcher import RateLimiter
+from failure_queue import INVALID_RESPONSE
+from preprocess import PreparedImage
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def cascade(tmp_path, monkeypatch):
+    """Cascata com backends simulados, cache de respostas e registos em tmp_path."""
+    monkeypatch.setattr(pipeline, "LOG_FILE", tmp_path / "processing_events.jsonl")
+    monkeypatch.setattr(pipeline, "STATE_DB", tmp_path / "processing_state.sqlite")
+    monkeypatch.setattr(pipeline, "event_log", None)
+    monkeypatch.setattr(pipeline, "budget", None)
+    monkeypatch.setattr(pipeline, "rate_limiters",
+                        {name: RateLimiter(name, 10 ** 9, 10 ** 12) for name in pipeline.MODEL_CASCADE})
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    monkeypatch.setattr(pipeline, "response_cache", cache)
+
+    def install(**mock_options):
+        backends = {name: MockBackend(**mock_options) for name in pipeline.MODEL_CASCADE}
+        monkeypatch.setattr(pipeline, "backends", backends)
+        return backends
+
+    yield install
+    if pipeline.event_log is not None:
+        pipeline.event_log.close()
+    cache.close()
+
+
+def _batch(*names):
+    return [PreparedImage(name, name.encode() * 64, "image/jpeg", (8, 8), content_hash=name) for name in names]
+
+
+def _api_calls(backends):
+    return sum(backend.stats.calls for backend in backends.values())
+
+
+def test_rejected_answers_are_not_replayed_from_the_cache(cascade):
+    backends = cascade(misread_rate=1.0)
+    request = (_batch("a.jpg", "b.jpg"), True)
+    for attempt in range(1, 4):
+        (result,) = pipeline.call_gemini_process_batches([request])
+        assert result["failure"] == INVALID_RESPONSE
+        assert _api_calls(backends) == 2 * attempt  # Cada tentativa volta a perguntar aos dois modelos
+
+
+def test_accepted_answers_are_served_from_the_cache(cascade):
+    backends = cascade()
+    request = (_batch("a.jpg", "b.jpg"), True)
+    (first,) = pipeline.call_gemini_process_batches([request])
+    assert first["model"] == pipeline.MODEL_CASCADE[0]
+    (second,) = pipeline.call_gemini_process_batches([request])
+    assert _api_calls(backends) == 1
+    assert second["data"] == first["data"]
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+from pathlib import Path
+
+from catalog_journal import CatalogJournal
+
+DATA = {"reference": "1234", "size1": "54", "size2": "18", "size3": "145", "color": "C1"}
+
+
+def test_replay_after_crash_ignores_and_cuts_incomplete_last_line(tmp_path):
+    json_path = tmp_path / "extracted_data.json"
+    journal = CatalogJournal(json_path)
+    journal.append(DATA, "a.jpg", ["b.jpg"])
+    journal._journal.close()  # Falha sem compactar
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"reference": "9999", "col')
+
+    replayed = CatalogJournal(json_path)
+    assert replayed.get("1234", "C1") == {"color": "C1", "key_file": "a.jpg", "additional_files": ["b.jpg"]}
+    assert replayed.get("9999", "C1") is None
+    replayed.append({**DATA, "color": "C2"}, "c.jpg", [])
+
+    lines = journal.journal_path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["color"] for line in lines] == ["C1", "C2"]
+    replayed.close()
+
+
+def test_second_batch_of_same_colour_merges_files(tmp_path):
+    journal = CatalogJournal(tmp_path / "extracted_data.json")
+    journal.append(DATA, "a.jpg", ["b.jpg", "c.jpg"])
+    journal.append(DATA, "z.jpg", ["c.jpg", "d.jpg"])
+    assert journal.get("1234", "C1") == {
+        "color": "C1", "key_file": "a.jpg", "additional_files": ["b.jpg", "c.jpg", "z.jpg", "d.jpg"]}
+    journal.compact()
+    journal.close()
+    assert json.loads((tmp_path / "extracted_data.json").read_text(encoding="utf-8"))[0]["image_files"] == [
+        {"color": "C1", "key_file": "a.jpg", "additional_files": ["b.jpg", "c.jpg", "z.jpg", "d.jpg"]}]
+def _worker(tmp_path, name, compact_every=500):
+    json_path = tmp_path / "extracted_data.json"
+    return CatalogJournal(json_path, tmp_path / f"extracted_data.{name}.journal.jsonl",
+                          compact_every=compact_every, shared=True)
+
+
+def _write_records(folder, name, count):
+    """Trabalhador noutro processo: grava `count` cores, compactando a cada 3 registos."""
+    journal = _worker(Path(folder), name, compact_every=3)
+    for i in range(count):
+        journal.append({**DATA, "reference": f"{name}-{i}"}, f"{name}-{i}.jpg", [])
+    journal.close()
+
+
+def test_shared_mode_replays_workers_in_write_order(tmp_path):
+    second, first = _worker(tmp_path, "b"), _worker(tmp_path, "a")
+    second.append(DATA, "x.jpg", [])
+    first.append({**DATA, "color": "C2"}, "y.jpg", [])
+    second.close()
+    first.close()
+
+    reader = _worker(tmp_path, "c")
+    assert [group["color"] for group in reader.entries()[0]["image_files"]] == ["C1", "C2"]
+    reader.close()
+
+
+def test_shared_compaction_keeps_other_workers_records(tmp_path):
+    first, second = _worker(tmp_path, "a"), _worker(tmp_path, "b")
+    first.append(DATA, "a.jpg", [])
+    second.append({**DATA, "color": "C2"}, "b.jpg", [])
+    first.compact()
+    second.compact()
+    first.close()
+    second.close()
+
+    saved = json.loads((tmp_path / "extracted_data.json").read_text(encoding="utf-8"))
+    assert {group["color"] for group in saved[0]["image_files"]} == {"C1", "C2"}
+
+
+def test_shared_mode_folds_legacy_journal_once(tmp_path):
+    legacy = CatalogJournal(tmp_path / "extracted_data.json")
+    legacy.append(DATA, "a.jpg", [])
+    legacy._journal.close()
+
+    worker = _worker(tmp_path, "a")
+    assert not (tmp_path / "extracted_data.journal.jsonl").exists()
+    assert worker.get("1234", "C1")["key_file"] == "a.jpg"
+    worker.close()
+
+
+def test_workers_in_separate_processes_lose_no_records(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_write_records, args=(tmp_path, f"w{i}", 20)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    reader = _worker(tmp_path, "leitor")
+    references = {entry["reference"] for entry in reader.entries()}
+    reader.compact()
+    reader.close()
+    assert references == {f"w{i}-{j}" for i in range(4) for j in range(20)}
+    saved = json.loads((tmp_path / "extracted_data.json").read_text(encoding="utf-8"))
+    assert len(saved) == 80
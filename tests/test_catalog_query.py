@@ -0,0 +1,93 @@
+import csv
+import json
+
+import pytest
+
+import catalog_query
+from catalog_query import EXPORT_COLUMNS, CatalogQuery, export_rows
+from state_store import StateStore
+
+DATA = {"reference": "1234", "size1": "54", "size2": "18", "size3": "145", "color": "C1"}
+ROWS = [
+    ("9999", "50", "20", "140", "C0", "x.jpg", "key", 0),
+    ("1234", "54", "18", "145", "C1", "a.jpg", "key", 0),
+    ("1234", "54", "18", "145", "C1", "b.jpg", "additional", 1),
+    ("1234", "54", "18", "145", "C1", "c.jpg", "additional", 2),
+    ("1234", "54", "18", "145", "C2", "d.jpg", "key", 0),
+]
+
+
+@pytest.fixture
+def query(tmp_path):
+    state = StateStore(tmp_path / "state.sqlite")
+    state.record_batch({"reference": "9999", "size1": "50", "size2": "20", "size3": "140", "color": "C0"}, "x.jpg", [])
+    state.record_batch(DATA, "a.jpg", ["b.jpg", "c.jpg"])
+    state.record_batch({**DATA, "color": "C2"}, "d.jpg", [])
+    state.close()
+    catalog = CatalogQuery(tmp_path / "state.sqlite")
+    yield catalog
+    catalog.close()
+
+
+def test_missing_database_is_an_error(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        CatalogQuery(tmp_path / "nao_existe.sqlite")
+
+
+def test_lookups_use_the_catalogue(query):
+    assert query.file("c.jpg") == {"reference": "1234", "color": "C1", "role": "additional",
+                                   "size1": "54", "size2": "18", "size3": "145"}
+    assert query.file("z.jpg") is None
+    assert query.images("1234") == {"C1": ["a.jpg", "b.jpg", "c.jpg"], "C2": ["d.jpg"]}
+    assert query.images("1234", "C2") == {"C2": ["d.jpg"]}
+    assert query.references_with_color("C1") == ["1234"]
+    assert query.references_with_sizes(54, 18, 145) == ["1234"]
+
+
+def test_iter_rows_follows_catalogue_order(query):
+    assert list(query.iter_rows()) == ROWS
+
+
+def test_export_csv(tmp_path, query):
+    destination = tmp_path / "catalogo.csv"
+    assert export_rows(query, destination) == len(ROWS)
+    with open(destination, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == list(EXPORT_COLUMNS)
+    assert rows[1:] == [[str(value) for value in row] for row in ROWS]
+    assert not (tmp_path / "catalogo.csv.tmp").exists()
+
+
+def test_export_jsonl(tmp_path, query):
+    destination = tmp_path / "catalogo.txt"
+    assert export_rows(query, destination, "jsonl") == len(ROWS)
+    lines = destination.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [dict(zip(EXPORT_COLUMNS, row)) for row in ROWS]
+
+
+def test_export_rejects_unknown_format(tmp_path, query):
+    with pytest.raises(ValueError):
+        export_rows(query, tmp_path / "catalogo.xlsx")
+    assert not (tmp_path / "catalogo.xlsx").exists()
+
+
+def test_failed_export_keeps_the_previous_file(tmp_path, query, monkeypatch):
+    destination = tmp_path / "catalogo.jsonl"
+    destination.write_text("anterior\n", encoding="utf-8")
+
+    def fail(rows, f):
+        next(rows)
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(catalog_query, "_write_jsonl", fail)
+    with pytest.raises(OSError):
+        export_rows(query, destination)
+    assert destination.read_text(encoding="utf-8") == "anterior\n"
+    assert not (tmp_path / "catalogo.jsonl.tmp").exists()
+
+
+def test_export_parquet(tmp_path, query):
+    pq = pytest.importorskip("pyarrow.parquet")
+    destination = tmp_path / "catalogo.parquet"
+    assert export_rows(query, destination) == len(ROWS)
+    assert [tuple(row.values()) for row in pq.read_table(destination).to_pylist()] == ROWS
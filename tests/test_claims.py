@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+from claims import ClaimManager
+
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _files(folder: Path, count: int) -> list[Path]:
+    folder.mkdir(exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = folder / f"RUS_{i:04d}.jpg"
+        path.touch()
+        paths.append(path)
+    return paths
+
+
+def _work(claims_dir, worker_id, paths, results):
+    """Trabalhador: reserva e conclui segmentos até não haver nada livre."""
+    manager = ClaimManager(Path(claims_dir), worker_id, lease_seconds=5)
+    done = []
+    while True:
+        claim = manager.claim(paths, 3)
+        if claim is None:
+            break
+        time.sleep(0.01)
+        done += claim.filenames
+        manager.complete(claim)
+    manager.close()
+    results.put((worker_id, done))
+
+
+def _claim_and_die(claims_dir, paths, claimed):
+    """Trabalhador que morre com o lease na mão (sem libertar nem concluir)."""
+    manager = ClaimManager(Path(claims_dir), "morto", lease_seconds=0.4)
+    claim = manager.claim(paths, 3)
+    claimed.put(claim.filenames)
+    claimed.close()
+    claimed.join_thread()  # os._exit não espera pela thread da fila
+    os._exit(0)
+
+
+def _claim_and_hold(claims_dir, paths, claimed, hold_seconds):
+    manager = ClaimManager(Path(claims_dir), "vivo", lease_seconds=0.4)
+    claim = manager.claim(paths, 3)
+    claimed.put(claim.filenames)
+    time.sleep(hold_seconds)
+    lost = claim.lost
+    manager.complete(claim)
+    manager.close()
+    claimed.put(lost)
+
+
+def test_workers_in_separate_processes_share_the_files_without_overlap(tmp_path):
+    paths = _files(tmp_path / "input", 40)
+    results = CONTEXT.Queue()
+    workers = [CONTEXT.Process(target=_work, args=(tmp_path / ".claims", f"w{i}", paths, results))
+               for i in range(4)]
+    for worker in workers:
+        worker.start()
+    done = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+    processed = [name for _, names in done for name in names]
+    assert sorted(processed) == [p.name for p in paths]
+
+
+def test_lease_of_a_dead_worker_expires_and_is_reclaimed(tmp_path):
+    paths = _files(tmp_path / "input", 6)
+    claimed = CONTEXT.Queue()
+    dead = CONTEXT.Process(target=_claim_and_die, args=(tmp_path / ".claims", paths, claimed))
+    dead.start()
+    lost_files = claimed.get(timeout=30)
+    dead.join()
+
+    manager = ClaimManager(tmp_path / ".claims", "sobrevivente", lease_seconds=0.4)
+    try:
+        first = manager.claim(paths, 3)
+        assert set(first.filenames).isdisjoint(lost_files)  # O lease ainda não expirou
+        manager.complete(first)
+        deadline = time.monotonic() + 10
+        reclaimed = None
+        while reclaimed is None and time.monotonic() < deadline:
+            reclaimed = manager.claim(paths, 3)
+            time.sleep(0.1)
+        assert reclaimed.filenames == lost_files
+        manager.complete(reclaimed)
+    finally:
+        manager.close()
+
+
+def test_live_worker_keeps_its_lease(tmp_path):
+    paths = _files(tmp_path / "input", 3)
+    claimed = CONTEXT.Queue()
+    alive = CONTEXT.Process(target=_claim_and_hold, args=(tmp_path / ".claims", paths, claimed, 2.0))
+    alive.start()
+    claimed.get(timeout=30)
+
+    manager = ClaimManager(tmp_path / ".claims", "outro", lease_seconds=0.4)
+    try:
+        deadline = time.monotonic() + 1.5  # Várias vezes o lease_seconds
+        while time.monotonic() < deadline:
+            assert manager.claim(paths, 3) is None
+            time.sleep(0.1)
+    finally:
+        manager.close()
+    assert claimed.get(timeout=30) is False  # O trabalhador vivo nunca perdeu o lease
+    alive.join()
+
+
+def test_heartbeat_does_not_bring_back_an_expired_lease(tmp_path):
+    paths = _files(tmp_path / "input", 3)
+    slow = ClaimManager(tmp_path / ".claims", "lento", lease_seconds=3600)
+    other = ClaimManager(tmp_path / ".claims", "outro", lease_seconds=3600)
+    try:
+        claim = slow.claim(paths, 3)
+        # O outro trabalhador deu o lease como expirado e reservou os mesmos ficheiros.
+        other._expire(claim.name, None)
+        taken = other.claim(paths, 3)
+        assert taken.name == claim.name
+
+        slow._beat()
+        assert claim.lost
+        slow.complete(claim)
+        assert (tmp_path / ".claims" / claim.name).exists()
+        assert other.taken_filenames() >= set(taken.filenames)
+        other.complete(taken)
+    finally:
+        slow.close()
+        other.close()
+
+
+def test_heartbeat_renews_without_rewriting_the_lease(tmp_path):
+    paths = _files(tmp_path / "input", 3)
+    manager = ClaimManager(tmp_path / ".claims", "w", lease_seconds=3600)
+    try:
+        claim = manager.claim(paths, 3)
+        lease = tmp_path / ".claims" / claim.name
+        content, mtime = lease.read_text(encoding="utf-8"), lease.stat().st_mtime_ns
+        time.sleep(0.01)
+        manager._beat()
+        assert not claim.lost
+        assert lease.read_text(encoding="utf-8") == content
+        assert lease.stat().st_mtime_ns != mtime
+        manager.release(claim)
+        assert not lease.exists()
+    finally:
+        manager.close()
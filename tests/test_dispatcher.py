@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+from backends import MockBackend
+from dispatcher import (QuotaExhaustedError, TokenBucket, call_with_quota, dispatch_ordered, pack_batches,
+                        parse_retry_delay)
+
+
+class RecordingLimiter:
+    """RateLimiter sem esperas: regista as pausas pedidas."""
+
+    def __init__(self):
+        self.acquired = 0
+        self.pauses = []
+
+    def acquire(self, estimated_tokens: int):
+        self.acquired += 1
+
+    def pause(self, seconds: float):
+        self.pauses.append(seconds)
+
+
+def test_token_bucket_starts_full_and_waits_after_drain():
+    bucket = TokenBucket(6000)  # 100 por segundo
+    start = time.monotonic()
+    bucket.acquire(6000)
+    assert time.monotonic() - start < 0.05
+    bucket.drain()
+    start = time.monotonic()
+    bucket.acquire(10)
+    assert time.monotonic() - start >= 0.08
+
+
+def test_token_bucket_caps_requests_larger_than_capacity():
+    bucket = TokenBucket(60, capacity=5)
+    start = time.monotonic()
+    bucket.acquire(1000)  # Limitado à capacidade: passa com o balde cheio
+    assert time.monotonic() - start < 0.05
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("429 Resource has been exhausted. Please retry in 12.5s.", 12.5),
+    ("429 Quota exceeded [retry_delay { seconds: 7 }]", 7.0),
+    ("429 Resource has been exhausted", None),
+])
+def test_parse_retry_delay(message, expected):
+    assert parse_retry_delay(Exception(message)) == expected
+
+
+def test_call_with_quota_waits_for_the_server_hint_then_gives_up():
+    backend = MockBackend(quota_error_rate=1.0, retry_seconds=3)
+    limiter = RecordingLimiter()
+    retries = []
+    with pytest.raises(QuotaExhaustedError):
+        call_with_quota(lambda: backend.generate(["olá"]), limiter, 100, max_retries=2,
+                        on_retry=lambda attempt, delay, error: retries.append(attempt))
+    assert limiter.acquired == 3
+    assert limiter.pauses == [4.0, 4.0]  # Espera do servidor + 1s de margem
+    assert retries == [1, 2]
+
+
+def test_call_with_quota_falls_back_to_exponential_backoff():
+    errors = [Exception("429 Resource has been exhausted")] * 2
+    limiter = RecordingLimiter()
+
+    def fn():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    assert call_with_quota(fn, limiter, 100) == "ok"
+    assert limiter.pauses == [31.0, 61.0]
+
+
+def test_call_with_quota_propagates_other_errors():
+    def fn():
+        raise ValueError("outro erro")
+
+    limiter = RecordingLimiter()
+    with pytest.raises(ValueError):
+        call_with_quota(fn, limiter, 100)
+    assert limiter.pauses == []
+
+
+def test_dispatch_ordered_yields_in_batch_order_not_completion_order():
+    def worker(batch):
+        time.sleep(0.05 if batch == 0 else 0.0)  # O primeiro lote é o último a terminar
+        return batch * 10
+
+    results = [(batch, future.result()) for batch, future in dispatch_ordered(range(6), worker, 4, 8)]
+    assert results == [(i, i * 10) for i in range(6)]
+
+
+def test_dispatch_ordered_pulls_at_most_max_ahead_batches():
+    pulled = []
+
+    def batches():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    results = dispatch_ordered(batches(), lambda batch: batch, 2, 3)
+    next(results)
+    time.sleep(0.2)
+    assert len(pulled) == 3  # O lote entregue ainda ocupa a vaga até ao próximo next()
+    results.close()
+
+
+def test_dispatch_ordered_reraises_feed_errors_after_earlier_batches():
+    def batches():
+        yield 1
+        yield 2
+        raise RuntimeError("descodificação falhou")
+
+    seen = []
+    with pytest.raises(RuntimeError):
+        for batch, future in dispatch_ordered(batches(), lambda batch: batch, 2, 4):
+            seen.append(future.result())
+    assert seen == [1, 2]
+
+
+def test_dispatch_ordered_runs_batches_concurrently():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def worker(batch):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    for _, future in dispatch_ordered(range(8), worker, 4, 8):
+        future.result()
+    assert 1 < peak[0] <= 4
+
+
+def test_pack_batches():
+    assert list(pack_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from failure_queue import API_ERROR, CORRUPT, MAX_BACKOFF_SECONDS, NO_KEY, FailureQueue, next_retry_time
+
+
+@pytest.fixture
+def failures(tmp_path):
+    queue = FailureQueue(tmp_path / "state.sqlite")
+    yield queue
+    queue.close()
+
+
+def test_backoff_doubles_per_attempt_until_the_limit():
+    assert next_retry_time(API_ERROR, 1, 0) == 30
+    assert next_retry_time(API_ERROR, 3, 0) == 120
+    assert next_retry_time(API_ERROR, 8, 0) is None
+    assert next_retry_time(NO_KEY, 2, 0) == 12 * 3600
+    assert next_retry_time(CORRUPT, 1, 0) is None
+    assert next_retry_time("motivo_desconhecido", 20, 0) is None
+    assert next_retry_time("motivo_desconhecido", 7, 0) == min(MAX_BACKOFF_SECONDS, 30 * 2 ** 6)
+
+
+def test_record_counts_attempts_and_schedules_the_next_one(failures):
+    failures.record(["a.jpg"], API_ERROR, "timeout")
+    failures.record(["a.jpg"], API_ERROR, "timeout")
+    (name, reason, attempts, error, last_failed, next_retry), = failures.entries()
+    assert (name, reason, attempts, error) == ("a.jpg", API_ERROR, 2, "timeout")
+    assert next_retry == pytest.approx(last_failed + 60)
+    assert failures.blocked_filenames() == {"a.jpg"}
+    assert not failures.has_due()
+    assert failures.has_due(now=next_retry)
+    assert failures.next_retry_at() == next_retry
+
+
+def test_new_reason_restarts_the_count(failures):
+    failures.record(["a.jpg"], API_ERROR)
+    failures.record(["a.jpg"], API_ERROR)
+    failures.record(["a.jpg"], NO_KEY)
+    assert failures.entries()[0][1:3] == (NO_KEY, 1)
+
+
+def test_retry_at_postpones_the_backoff(failures):
+    later = time.time() + 3600
+    failures.record(["a.jpg"], API_ERROR, retry_at=later)
+    assert failures.entries()[0][5] == later
+
+
+def test_corrupt_and_exhausted_files_are_dead(failures):
+    assert failures.record(["bad.jpg"], CORRUPT) == ["bad.jpg"]
+    for _ in range(2):
+        dead = failures.record(["a.jpg"], NO_KEY)
+    assert dead == []
+    assert failures.record(["a.jpg"], NO_KEY) == ["a.jpg"]
+    assert failures.blocked_filenames(now=time.time() + 10 * MAX_BACKOFF_SECONDS) == {"bad.jpg", "a.jpg"}
+
+
+def test_requeue_makes_files_due_now_with_a_fresh_count(failures):
+    failures.record(["bad.jpg"], CORRUPT)
+    failures.record(["a.jpg", "b.jpg"], API_ERROR)
+    assert failures.requeue(reason=CORRUPT) == 1
+    assert failures.blocked_filenames() == {"a.jpg", "b.jpg"}
+    assert failures.record(["bad.jpg"], CORRUPT) == ["bad.jpg"]  # Contagem a zero, mas continua corrompido
+
+    assert failures.requeue(["a.jpg"]) == 1
+    assert failures.blocked_filenames() == {"bad.jpg", "b.jpg"}
+    assert failures.record(["a.jpg"], API_ERROR) == []
+    assert [row[2] for row in failures.entries() if row[0] == "a.jpg"] == [1]
+
+
+def test_purge_and_clear_remove_entries(failures):
+    failures.record(["a.jpg", "b.jpg", "c.jpg"], API_ERROR)
+    assert failures.purge(["a.jpg"]) == 1
+    failures.clear(["b.jpg"])
+    assert [row[0] for row in failures.entries()] == ["c.jpg"]
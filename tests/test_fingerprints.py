@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from fingerprints import PARTIAL_BYTES, FingerprintIndex
+
+BIG = 3 * PARTIAL_BYTES  # O meio do ficheiro fica fora do hash parcial
+
+
+@pytest.fixture
+def index(tmp_path):
+    fingerprints = FingerprintIndex(tmp_path / "state.sqlite")
+    yield fingerprints
+    fingerprints.close()
+
+
+def write(path, content: bytes, mtime_ns: int | None = None):
+    path.write_bytes(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def photo(middle: bytes = b"m") -> bytes:
+    return b"a" * PARTIAL_BYTES + middle * PARTIAL_BYTES + b"z" * PARTIAL_BYTES
+
+
+def test_renamed_file_is_already_processed(tmp_path, index):
+    original = write(tmp_path / "IMG_0001.jpg", photo())
+    index.mark_processed([original])
+    renamed = tmp_path / "oculos.jpg"
+    original.rename(renamed)
+    assert index.processed([renamed]) == {"oculos.jpg": "IMG_0001.jpg"}
+
+
+def test_reused_camera_name_with_new_content_is_processed_again(tmp_path, index):
+    path = write(tmp_path / "IMG_0001.jpg", b"primeira")
+    index.mark_processed([path])
+    path.unlink()
+    write(path, b"outra fotografia", mtime_ns=10**18)
+    assert index.processed([path]) == {}
+
+
+def test_in_place_change_is_confirmed_by_the_full_hash(tmp_path, index):
+    path = write(tmp_path / "IMG_0001.jpg", photo(), mtime_ns=10**18)
+    index.mark_processed([path])
+    assert index.processed([path]) == {"IMG_0001.jpg": "IMG_0001.jpg"}
+
+    write(path, photo(), mtime_ns=2 * 10**18)  # Só o mtime muda
+    assert index.processed([path]) == {"IMG_0001.jpg": "IMG_0001.jpg"}
+
+    write(path, photo(b"x"), mtime_ns=3 * 10**18)  # Mesmo tamanho, início e fim; outro meio
+    assert len(photo(b"x")) == BIG
+    assert index.processed([path]) == {}
+
+
+def test_fingerprints_persist_and_unchanged_files_are_not_read(tmp_path, monkeypatch):
+    path = write(tmp_path / "IMG_0001.jpg", photo())
+    index = FingerprintIndex(tmp_path / "state.sqlite")
+    first = index.scan([path])[path]
+    index.close()
+    reopened = FingerprintIndex(tmp_path / "state.sqlite")
+    try:
+        monkeypatch.setattr("fingerprints.partial_hash", lambda *args: pytest.fail("ficheiro relido"))
+        assert reopened.scan([path]) == {path: first}
+    finally:
+        reopened.close()
+
+
+def test_legacy_names_are_adopted_once(tmp_path, index):
+    path = write(tmp_path / "IMG_0001.jpg", b"antiga")
+    assert index.is_empty()
+    assert index.processed([path], legacy_names={"IMG_0001.jpg"}) == {"IMG_0001.jpg": "IMG_0001.jpg"}
+    assert not index.is_empty()
+    # Com conteúdo registado para o nome, um ficheiro novo com o mesmo nome já não é aceite pelo nome.
+    write(path, b"nova fotografia", mtime_ns=10**18)
+    assert index.processed([path], legacy_names={"IMG_0001.jpg"}) == {}
+
+
+def test_vanished_files_are_skipped(tmp_path, index):
+    present = write(tmp_path / "IMG_0001.jpg", b"existe")
+    assert list(index.scan([tmp_path / "IMG_0002.jpg", present])) == [present]
+    index.mark_processed([tmp_path / "IMG_0002.jpg"])
+    assert index.is_empty()
@@ -0,0 +1,81 @@
+from migrate_catalog import MergeReport, SourceGroup, merge
+
+SIZES = ("54", "18", "145")
+
+
+def _group(source, reference, color, files, sizes=SIZES, paths=None):
+    return SourceGroup(source, reference, sizes, color, files, paths or {})
+
+
+def _colors(catalogue):
+    return {(entry["reference"], group["color"]): [group["key_file"]] + group["additional_files"]
+            for entry in catalogue for group in entry["image_files"]}
+
+
+def test_repeated_groups_are_deduplicated_and_newest_key_wins():
+    report = MergeReport()
+    catalogue = merge([
+        _group("antigo.json", "1234", "C1", ["a.jpg", "b.jpg"]),
+        _group("novo.json", "1234", "C1", ["b.jpg", "a.jpg", "c.jpg"]),
+    ], {}, report)
+    assert _colors(catalogue) == {("1234", "C1"): ["b.jpg", "a.jpg", "c.jpg"]}
+    assert report.duplicates == 2
+    assert report.conflicts == []
+
+
+def test_image_moved_to_another_colour_keeps_the_newest_source():
+    report = MergeReport()
+    catalogue = merge([
+        _group("antigo.json", "1234", "C1", ["a.jpg", "b.jpg"]),
+        _group("novo.json", "1234", "C2", ["c.jpg", "b.jpg"]),
+    ], {}, report)
+    assert _colors(catalogue) == {("1234", "C1"): ["a.jpg"], ("1234", "C2"): ["c.jpg", "b.jpg"]}
+    assert report.conflicts == ["b.jpg: 1234/C1 -> 1234/C2 (novo.json)"]
+
+
+def test_colour_left_without_images_is_removed():
+    report = MergeReport()
+    catalogue = merge([
+        _group("antigo.json", "1234", "C1", ["a.jpg"]),
+        _group("novo.json", "5678", "C1", ["a.jpg"]),
+    ], {}, report)
+    assert _colors(catalogue) == {("5678", "C1"): ["a.jpg"]}
+    assert report.conflicts[-1] == "1234/C1: sem imagens depois da deduplicação (removida)"
+
+
+def test_size_conflicts_are_reported_and_newest_sizes_kept():
+    report = MergeReport()
+    catalogue = merge([
+        _group("antigo.json", "1234", "C1", ["a.jpg"]),
+        _group("novo.json", "1234", "C2", ["b.jpg"], sizes=("55", "18", "145")),
+        _group("sem_tamanhos.json", "1234", "C3", ["c.jpg"], sizes=(None, None, None)),
+    ], {}, report)
+    assert (catalogue[0]["size1"], catalogue[0]["size2"], catalogue[0]["size3"]) == ("55", "18", "145")
+    assert report.conflicts == ["1234: tamanhos 54/18/145 -> 55/18/145 (novo.json)"]
+
+
+def test_same_content_under_another_name_is_one_image(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"oculos")
+    (tmp_path / "a_copia.jpg").write_bytes(b"oculos")
+    report = MergeReport()
+    catalogue = merge([
+        _group("antigo.json", "1234", "C1", ["a.jpg"]),
+        _group("novo.json", "1234", "C1", ["a_copia.jpg"]),
+    ], {"a.jpg": tmp_path / "a.jpg", "a_copia.jpg": tmp_path / "a_copia.jpg"}, report)
+    assert _colors(catalogue) == {("1234", "C1"): ["a.jpg"]}
+    assert report.duplicates == 1
+    assert report.hashed == 2
+
+
+def test_same_name_with_other_content_keeps_the_newest(tmp_path):
+    (tmp_path / "old").mkdir()
+    (tmp_path / "new").mkdir()
+    (tmp_path / "old" / "a.jpg").write_bytes(b"antiga")
+    (tmp_path / "new" / "a.jpg").write_bytes(b"nova")
+    report = MergeReport()
+    catalogue = merge([
+        _group("antigo.json", "1234", "C1", ["a.jpg"], paths={"a.jpg": tmp_path / "old" / "a.jpg"}),
+        _group("novo.json", "5678", "C2", ["a.jpg"], paths={"a.jpg": tmp_path / "new" / "a.jpg"}),
+    ], {}, report)
+    assert _colors(catalogue) == {("5678", "C2"): ["a.jpg"]}
+    assert report.conflicts[0] == "a.jpg: o mesmo nome com outro conteúdo; fica o de novo.json"
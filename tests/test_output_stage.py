@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import processar_oculos2 as pipeline
+from output_stage import OutputStage
+from response_cache import file_hash
+
+
+@pytest.fixture
+def stage(tmp_path):
+    output = OutputStage(tmp_path / "saida", mode="copy", workers=4)
+    yield output
+    output.close()
+
+
+def _image(folder, name, content: bytes):
+    folder.mkdir(exist_ok=True)
+    path = folder / name
+    path.write_bytes(content)
+    return path
+
+
+def test_indices_are_unique_per_reference_and_colour(tmp_path, stage):
+    sources = [_image(tmp_path / "in", f"RUS_{i}.JPG", f"imagem {i}".encode()) for i in range(12)]
+    futures = stage.submit(sources[:6], "1234", "C1") + stage.submit(sources[6:], "1234", "C2")
+    placed = sorted(future.result().name for future in futures)
+    assert placed == sorted([f"1234_C1_{i}.jpg" for i in range(6)] + [f"1234_C2_{i}.jpg" for i in range(6)])
+
+
+def test_existing_files_are_not_overwritten(tmp_path):
+    target = tmp_path / "saida" / "1234"
+    target.mkdir(parents=True)
+    (target / "1234_C1_0.jpg").write_bytes(b"antiga")
+    (target / "1234_C1_3.jpg").write_bytes(b"outra antiga")
+    stage = OutputStage(tmp_path / "saida", mode="copy")
+    try:
+        placed = stage.place(_image(tmp_path / "in", "a.jpg", b"nova"), "1234", "C1")
+    finally:
+        stage.close()
+    assert placed.name == "1234_C1_4.jpg"
+    assert (target / "1234_C1_0.jpg").read_bytes() == b"antiga"
+
+
+def test_same_image_is_placed_once(tmp_path, stage):
+    source = _image(tmp_path / "in", "a.jpg", b"conteudo")
+    first = stage.place(source, "1234", "C1", file_hash(source))
+    assert stage.place(source, "1234", "C1", file_hash(source)) == first
+    assert stage.place(source, "1234", "C1") == first  # Sem hash: comparação byte a byte
+    assert len(list(first.parent.iterdir())) == 1
+
+
+def test_same_size_and_mtime_with_other_content_is_placed(tmp_path, stage):
+    first = _image(tmp_path / "in", "a.jpg", b"AAAA")
+    second = _image(tmp_path / "in", "b.jpg", b"BBBB")
+    os.utime(second, ns=(first.stat().st_atime_ns, first.stat().st_mtime_ns))
+    placed = stage.place(first, "1234", "C1", file_hash(first))
+    other = stage.place(second, "1234", "C1", file_hash(second))
+    assert other != placed
+    assert other.read_bytes() == b"BBBB"
+
+
+def test_images_are_placed_only_after_the_batch_is_saved(tmp_path, monkeypatch):
+    submitted = []
+
+    class Stage:
+        def submit(self, *args):
+            submitted.append(args)
+
+    monkeypatch.setattr(pipeline, "output_stage", Stage())
+    monkeypatch.setattr(pipeline, "save_data", lambda *args: False)
+    monkeypatch.setattr(pipeline, "LOG_FILE", tmp_path / "processing_events.jsonl")
+    monkeypatch.setattr(pipeline, "STATE_DB", tmp_path / "processing_state.sqlite")
+    monkeypatch.setattr(pipeline, "event_log", None)
+    monkeypatch.setattr(pipeline, "fingerprints", None)
+
+    class Failures:
+        def __init__(self):
+            self.recorded = []
+
+        def record(self, names, reason, error="", retry_at=None):
+            self.recorded.append((names, reason))
+
+    paths = [tmp_path / "a.jpg", tmp_path / "b.jpg"]
+    result = {"key_image_name": "a.jpg", "data": {"reference": "1234", "color": "C1"},
+              "matched_filenames": ["a.jpg", "b.jpg"], "model": "mock"}
+    failures = Failures()
+    pipeline.handle_batch_result(paths, paths, result, None, None, None, set(), failures)
+    if pipeline.event_log is not None:
+        pipeline.event_log.close()
+    assert submitted == []
+    assert failures.recorded == [(["a.jpg", "b.jpg"], pipeline.SAVE_ERROR)]
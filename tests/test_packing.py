@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import processar_oculos2 as pipeline
+from backends import MockBackend
+from dispatcher import RateLimiter
+from preprocess import PreparedImage
+
+MODEL = pipeline.MODEL_CASCADE[0]
+
+
+class PickyBackend(MockBackend):
+    """Estraga as respostas agrupadas com mais de `max_batches` lotes e o lote com `bad_name`."""
+
+    def __init__(self, max_batches: int = 99, bad_name: str | None = None):
+        super().__init__()
+        self.max_batches = max_batches
+        self.bad_name = bad_name
+        self.sizes = []  # Lotes por pedido, pela ordem
+
+    def generate(self, payload, schema=None):
+        batches = sum(1 for part in payload[1:] if isinstance(part, str) and part.startswith("LOTE "))
+        self.sizes.append(batches or 1)
+        if batches > self.max_batches:
+            self.stats.record_call(payload)
+            return "Desculpe, não consegui."
+        text = super().generate(payload, schema)
+        if batches and self.bad_name:
+            answer = json.loads(text)
+            for entry in answer["batches"]:
+                if self.bad_name in (entry.get("matched_filenames") or []):
+                    entry["key_image_name"] = "outro_lote.jpg"
+            text = json.dumps(answer)
+        return text
+
+
+@pytest.fixture
+def install(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "LOG_FILE", tmp_path / "processing_events.jsonl")
+    monkeypatch.setattr(pipeline, "STATE_DB", tmp_path / "processing_state.sqlite")
+    monkeypatch.setattr(pipeline, "event_log", None)
+    monkeypatch.setattr(pipeline, "budget", None)
+    monkeypatch.setattr(pipeline, "response_cache", None)
+    monkeypatch.setattr(pipeline, "rate_limiters", {MODEL: RateLimiter(MODEL, 10 ** 9, 10 ** 12)})
+
+    def install(backend):
+        monkeypatch.setattr(pipeline, "backends", {MODEL: backend})
+        return backend
+
+    yield install
+    if pipeline.event_log is not None:
+        pipeline.event_log.close()
+
+
+def _requests(count):
+    requests = []
+    for i in range(count):
+        names = [f"p{i}_a.jpg", f"p{i}_b.jpg"]
+        prepared = [PreparedImage(name, name.encode() * 64, "image/jpeg", (8, 8), content_hash=name) for name in names]
+        requests.append((prepared, True))
+    return requests
+
+
+def _keys(results):
+    return [result and result["key_image_name"] for result in results]
+
+
+def test_good_pack_is_one_request(install):
+    backend = install(PickyBackend())
+    results = pipeline.call_model_packed(MODEL, _requests(4))
+    assert backend.sizes == [4]
+    assert _keys(results) == [f"p{i}_a.jpg" for i in range(4)]
+
+
+def test_unreadable_pack_is_split_in_half_until_it_fits(install):
+    backend = install(PickyBackend(max_batches=2))
+    results = pipeline.call_model_packed(MODEL, _requests(8))
+    assert backend.sizes == [8, 4, 2, 2, 4, 2, 2]
+    assert _keys(results) == [f"p{i}_a.jpg" for i in range(8)]
+
+
+def test_bad_batch_in_a_good_pack_is_resent_alone(install):
+    backend = install(PickyBackend(bad_name="p2_b.jpg"))
+    results = pipeline.call_model_packed(MODEL, _requests(4))
+    assert backend.sizes == [4, 1]  # Sozinho, o lote vai sem a linha LOTE e não é estragado
+    assert _keys(results) == [f"p{i}_a.jpg" for i in range(4)]
@@ -0,0 +1,74 @@
+import hashlib
+import time
+
+import pytest
+
+from response_cache import ResponseCache, file_hash, make_key, prompt_fingerprint
+
+
+@pytest.fixture
+def cache(tmp_path):
+    responses = ResponseCache(tmp_path / "cache.sqlite", max_entries=10, max_bytes=10_000)
+    yield responses
+    responses.close()
+
+
+def test_put_and_get_round_trip(cache):
+    cache.put("k", {"data": {"reference": "1234"}, "matched_indices": [0, 2]})
+    assert cache.get("k") == {"data": {"reference": "1234"}, "matched_indices": [0, 2]}
+    assert cache.get("outra") is None
+
+
+def test_key_depends_on_images_order_prompt_and_model():
+    fingerprint = prompt_fingerprint("gemini-2.5-flash", "prompt")
+    key = make_key(["a", "b"], fingerprint)
+    assert make_key(["a", "b"], fingerprint) == key
+    assert make_key(["b", "a"], fingerprint) != key
+    assert make_key(["a", "b"], prompt_fingerprint("gemini-2.5-flash", "prompt novo")) != key
+    assert make_key(["a", "b"], prompt_fingerprint("gemini-2.5-pro", "prompt")) != key
+
+
+def test_file_hash_is_the_content_sha256(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"oculos")
+    (tmp_path / "copia.jpg").write_bytes(b"oculos")
+    assert file_hash(tmp_path / "a.jpg") == file_hash(tmp_path / "copia.jpg")
+    assert file_hash(tmp_path / "a.jpg") == hashlib.sha256(b"oculos").hexdigest()
+
+
+def test_entries_older_than_max_age_expire(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_age_days=1)
+    try:
+        cache.put("k", 1)
+        cache._conn.execute("UPDATE responses SET created_at = ?", (time.time() - 2 * 86400,))
+        cache._conn.commit()
+        assert cache.get("k") is None
+    finally:
+        cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_first(cache):
+    for i in range(11):
+        cache.put(f"k{i}", i)
+        time.sleep(0.001)
+    cache.get("k0")  # Usada agora: passa a ser a mais recente
+    cache.evict()
+    remaining = {f"k{i}" for i in range(11) if cache.get(f"k{i}") is not None}
+    assert len(remaining) == 9
+    assert "k0" in remaining
+    assert not {"k1", "k2"} & remaining
+
+
+def test_size_limit_evicts_until_below_the_budget(cache):
+    # 5 x 2902 bytes > 10 000: ficam as mais recentes que cabem em 90% (9 000)
+    for i in range(5):
+        cache.put(f"k{i}", "x" * 2900)
+        time.sleep(0.001)
+    cache.evict()
+    remaining = [f"k{i}" for i in range(5) if cache.get(f"k{i}") is not None]
+    assert remaining == ["k2", "k3", "k4"]
+
+
+def test_discard_removes_an_entry(cache):
+    cache.put("k", 1)
+    cache.discard("k")
+    assert cache.get("k") is None
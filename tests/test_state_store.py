@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from state_store import StateStore, merge_files
+
+DATA = {"reference": "1234", "size1": "54", "size2": "18", "size3": "145", "color": "C1"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    state = StateStore(tmp_path / "state.sqlite")
+    yield state
+    state.close()
+
+
+def test_merge_files_keeps_the_key_and_appends_new_files_once():
+    assert merge_files("a.jpg", ["b.jpg"], "c.jpg", ["b.jpg", "d.jpg", "a.jpg"]) == ("a.jpg", ["b.jpg", "c.jpg", "d.jpg"])
+    assert merge_files("a.jpg", ["b.jpg"], "a.jpg", ["b.jpg"]) == ("a.jpg", ["b.jpg"])
+
+
+def test_record_batch_merges_a_second_batch_of_the_same_colour(store):
+    store.record_batch(DATA, "a.jpg", ["b.jpg"])
+    store.record_batch(DATA, "c.jpg", ["b.jpg", "d.jpg"])
+    store.record_batch(DATA, "c.jpg", ["b.jpg", "d.jpg"])  # Repetido: nada muda
+    assert list(store.iter_catalogue()) == [{
+        **{k: DATA[k] for k in ("reference", "size1", "size2", "size3")},
+        "image_files": [{"color": "C1", "key_file": "a.jpg", "additional_files": ["b.jpg", "c.jpg", "d.jpg"]}],
+    }]
+    assert store.processed_filenames() == {"a.jpg", "b.jpg", "c.jpg", "d.jpg"}
+    assert store.lookup_file("d.jpg")[:2] == ("1234", "C1")
+
+
+def test_catalogue_keeps_insertion_order(store):
+    store.record_batch({**DATA, "reference": "9999"}, "x.jpg", [])
+    store.record_batch(DATA, "a.jpg", [])
+    store.record_batch({**DATA, "color": "C2"}, "b.jpg", [])
+    store.record_batch({**DATA, "reference": "9999", "color": "C0"}, "y.jpg", [])
+    assert [(entry["reference"], [group["color"] for group in entry["image_files"]])
+            for entry in store.iter_catalogue()] == [("9999", ["C1", "C0"]), ("1234", ["C1", "C2"])]
+
+
+def test_export_matches_json_dump_and_imports_back(tmp_path, store):
+    store.record_batch(DATA, "a.jpg", ["b.jpg"])
+    store.record_batch({**DATA, "reference": "Ç-1"}, "c.jpg", [])
+    exported = tmp_path / "extracted_data.json"
+    store.export_json(exported)
+    entries = list(store.iter_catalogue())
+    assert exported.read_text(encoding="utf-8") == json.dumps(entries, indent=2, ensure_ascii=False)
+
+    other = StateStore(tmp_path / "other.sqlite")
+    try:
+        assert other.import_json(exported) == 2
+        assert list(other.iter_catalogue()) == entries
+    finally:
+        other.close()
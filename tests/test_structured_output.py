@@ -0,0 +1,47 @@
+import pytest
+
+from structured_output import BATCH_SCHEMA, EXTRACT_SCHEMA, PARTIAL_KEY, conform, packed_schema, parse_response
+
+ANSWER = '{"key_image_name": "a.jpg", "data": null, "matched_filenames": ["a.jpg", "b.jpg"]}'
+EXPECTED = {"key_image_name": "a.jpg", "data": None, "matched_filenames": ["a.jpg", "b.jpg"]}
+
+
+@pytest.mark.parametrize("text", [
+    ANSWER,
+    f"```json\n{ANSWER}\n```",
+    f"Aqui está a resposta pedida:\n```json\n{ANSWER}\n```\nEspero ter ajudado.",
+    f"A resposta é {ANSWER} como pedido.",
+    ANSWER.replace('"b.jpg"]', '"b.jpg",]'),
+])
+def test_parse_response_reads_json_around_noise(text):
+    assert parse_response(text) == EXPECTED
+
+
+def test_parse_response_rejects_text_without_json():
+    with pytest.raises(ValueError):
+        parse_response("Não encontrei nenhum texto na haste.")
+
+
+def test_list_cut_mid_way_is_repaired_but_rejected_by_conform():
+    response = parse_response('{"key_image_name": "a.jpg", "data": null, "matched_filenames": ["a.jpg", "b.jp')
+    assert response["matched_filenames"] == ["a.jpg"]
+    assert response[PARTIAL_KEY] is True
+    assert conform(response, BATCH_SCHEMA)[1] == ["$: resposta cortada"]
+
+
+def test_packed_response_keeps_batches_completed_before_the_cut():
+    text = ('{"batches": [{"batch": 1, "key_image_name": null, "data": null, "matched_filenames": []}, '
+            '{"batch": 2, "key_image_name": "c.jpg", "data": null, "matched_filenames": ["c.jpg", "d')
+    entries = parse_response(text)["batches"]
+    item_schema = packed_schema(BATCH_SCHEMA)["properties"]["batches"]["items"]
+    assert conform(entries[0], item_schema)[1] == []
+    assert conform(entries[1], item_schema)[1] == ["$: resposta cortada"]
+
+
+def test_conform_coerces_harmless_types_and_reports_problems():
+    fixed, problems = conform({"referencia": 1234, "cor": None}, EXTRACT_SCHEMA)
+    assert (fixed, problems) == ({"referencia": "1234", "cor": None}, [])
+    _, problems = conform({"key_image_name": "a.jpg", "data": None}, BATCH_SCHEMA)
+    assert problems == ["$.matched_filenames: em falta"]
+    fixed, problems = conform({"batch": "2"}, {"type": "OBJECT", "properties": {"batch": {"type": "INTEGER"}}})
+    assert (fixed, problems) == ({"batch": 2}, [])
@@ -0,0 +1,66 @@
+"""
+Deteção local da presença de texto na haste, antes de chamar a API.
+
+Heurística clássica sobre a imagem reduzida, em tons de cinzento: o texto
+impresso na haste ("0037 54[]18-145 C4") aparece como uma faixa horizontal
+com muitos traços verticais curtos, ou seja, muitas transições de gradiente
+horizontal numa zona pequena, com densidade de arestas intermédia. Cada
+imagem recebe uma pontuação; só as melhores candidatas vão para a API.
+
+Corre em NumPy puro sobre ~512 px: centenas de imagens por segundo num CPU.
+"""
+import numpy as np
+from PIL import Image
+
+SCORE_LONG_EDGE = 512
+_TILE = 16
+_EDGE_THRESHOLD = 24
+_RUN_TILES = 6
+
+
+def text_score(img: Image.Image) -> float:
+    """Pontuação (0 a ~1) da probabilidade de a imagem conter texto impresso."""
+    gray = img.convert("L")
+    gray.thumbnail((SCORE_LONG_EDGE, SCORE_LONG_EDGE))
+    a = np.asarray(gray, dtype=np.int16)
+    if a.shape[0] < 2 * _TILE or a.shape[1] < 2 * _TILE:
+        return 0.0
+
+    gx = np.abs(np.diff(a, axis=1))[:-1, :]
+    gy = np.abs(np.diff(a, axis=0))[:, :-1]
+    vertical = gx > _EDGE_THRESHOLD      # arestas de traços verticais
+    horizontal = gy > _EDGE_THRESHOLD
+
+    # Mudanças de sinal ao longo da linha: cada carácter dá várias.
+    sign = np.sign(np.diff(a, axis=1))[:-1, :]
+    crossings = (sign[:, 1:] * sign[:, :-1] < 0) & vertical[:, 1:]
+
+    h = (crossings.shape[0] // _TILE) * _TILE
+    w = (crossings.shape[1] // _TILE) * _TILE
+
+    def tiles(mask):
+        return mask[:h, :w].reshape(h // _TILE, _TILE, w // _TILE, _TILE).mean(axis=(1, 3))
+
+    crossing_density = tiles(crossings)
+    vertical_density = tiles(vertical[:, 1:])
+    horizontal_density = tiles(horizontal[:, 1:])
+
+    # Texto: muitos traços verticais, mais verticais do que horizontais,
+    # e densidade total nem vazia (fundo) nem saturada (textura/reflexo).
+    total = vertical_density + horizontal_density
+    balance = np.clip(vertical_density / (total + 1e-6), 0.0, 1.0)
+    plausible = (total > 0.05) & (total < 0.8)
+    tile_score = crossing_density * balance * plausible
+
+    # O texto ocupa uma faixa contínua: média da melhor sequência de células
+    # consecutivas em cada linha. Arestas isoladas (contorno da armação) diluem-se.
+    k = min(_RUN_TILES, tile_score.shape[1])
+    cumulative = np.concatenate([np.zeros((tile_score.shape[0], 1)), np.cumsum(tile_score, axis=1)], axis=1)
+    run_means = (cumulative[:, k:] - cumulative[:, :-k]) / k
+    return float(run_means.max())
+
+
+def rank_candidates(scores: dict, top: int) -> list:
+    """Nomes das `top` imagens com maior pontuação (empates pela ordem original)."""
+    ordered = sorted(scores, key=lambda name: -scores[name])
+    return ordered[:top]
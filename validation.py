@@ -0,0 +1,65 @@
+"""
+Validação das respostas do modelo, para a cascata de modelos.
+
+O texto da haste segue o formato "Referência Tamanho[]Tamanho2-Tamanho3 Cor"
+(ex: "0037 54[]18-145 C4"). Uma resposta só é aceite se a imagem chave
+pertencer ao lote, se cada campo tiver o formato esperado e se o texto lido
+(`raw_text`) voltar a dar os mesmos campos: é o sinal de auto-consistência
+pedido ao modelo, junto com a confiança que ele próprio indica.
+"""
+import re
+
+FIELD_PATTERNS = {
+    "reference": re.compile(r"^[A-Za-z0-9][A-Za-z0-9 ./-]*$"),
+    "size1": re.compile(r"^\d{2}$"),
+    "size2": re.compile(r"^\d{2}$"),
+    "size3": re.compile(r"^\d{3}$"),
+    "color": re.compile(r"^[A-Za-z0-9][A-Za-z0-9 ./-]{0,15}$"),
+}
+TEMPLE_TEXT_RE = re.compile(
+    r"^\s*(?P<reference>.+?)\s+(?P<size1>\d{2})\s*[\[\]□◻|]*\s*(?P<size2>\d{2})\s*-\s*(?P<size3>\d{3})"
+    r"\s+(?P<color>\S+)\s*$"
+)
+
+
+def _normalize(value) -> str:
+    return re.sub(r"\s+", "", str(value)).upper()
+
+
+def validate_result(result: dict | None, file_names: list[str], min_confidence: float = 0.0) -> list[str]:
+    """
+    Problemas encontrados na resposta (lista vazia = válida). Uma resposta
+    sem imagem chave também é devolvida como problema, para poder subir de modelo.
+    """
+    if not result or not result.get("data"):
+        return ["nenhuma imagem chave"]
+    problems = []
+    if result.get("key_image_name") not in file_names:
+        problems.append(f"imagem chave desconhecida: {result.get('key_image_name')!r}")
+
+    data = result["data"]
+    for name, pattern in FIELD_PATTERNS.items():
+        value = data.get(name)
+        if value is None or not pattern.match(str(value).strip()):
+            problems.append(f"{name} inválido: {value!r}")
+
+    raw_text = result.get("raw_text")
+    if raw_text:
+        match = TEMPLE_TEXT_RE.match(str(raw_text))
+        if not match:
+            problems.append(f"texto lido fora do formato: {raw_text!r}")
+        else:
+            for name in FIELD_PATTERNS:
+                if _normalize(match.group(name)) != _normalize(data.get(name, "")):
+                    problems.append(f"{name} não coincide com o texto lido")
+    elif min_confidence > 0:
+        problems.append("sem texto lido")
+
+    confidence = result.get("confidence")
+    if min_confidence > 0:
+        try:
+            if float(confidence) < min_confidence:
+                problems.append(f"confiança baixa ({float(confidence):.2f})")
+        except (TypeError, ValueError):
+            problems.append("sem confiança")
+    return problems
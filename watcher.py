@@ -0,0 +1,127 @@
+"""
+Vigilância contínua da pasta de entrada (modo contínuo do processar_oculos2).
+
+Durante uma sessão o estúdio vai largando fotografias na pasta. Os eventos
+do sistema de ficheiros (inotify no Linux, ReadDirectoryChangesW no Windows,
+através do pacote opcional `watchdog`) indicam que ficheiros mudaram; sem
+`watchdog`, a pasta é listada a cada `poll_interval`. Em ambos os casos um
+ficheiro só é aceite quando está completo: tamanho e data de modificação
+iguais durante `settle_seconds` (a cópia ou a gravação da câmara terminou).
+"""
+import fnmatch
+import os
+import threading
+import time
+from pathlib import Path
+
+IMAGE_PATTERNS = ('*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff')
+FULL_RESCAN_SECONDS = 60 # Com eventos, relista a pasta de vez em quando (eventos perdidos)
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+
+def matches(name: str, patterns=IMAGE_PATTERNS) -> bool:
+    name = name.lower()
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+class FolderWatcher:
+    """Entrega os ficheiros novos de uma pasta assim que estiverem completos."""
+
+    def __init__(self, folder: Path, patterns=IMAGE_PATTERNS, settle_seconds: float = 2.0,
+                 poll_interval: float = 1.0, known: set | None = None, use_events: bool = True):
+        self.folder = Path(folder)
+        self.patterns = patterns
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self._known = set(known or ())  # nomes já entregues (ou já existentes no arranque)
+        self._candidates = {}           # nome -> (tamanho, mtime_ns, estável desde)
+        self._touched = set()           # nomes indicados pelos eventos, por verificar
+        self._lock = threading.Lock()
+        self._last_scan = 0.0
+        self._observer = None
+        if use_events and Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_Handler(self), str(self.folder), recursive=False)
+            self._observer.start()
+
+    @property
+    def uses_events(self) -> bool:
+        return self._observer is not None
+
+    def _touch(self, path: str):
+        name = os.path.basename(path)
+        if matches(name, self.patterns):
+            with self._lock:
+                self._touched.add(name)
+
+    def _scan(self):
+        with os.scandir(self.folder) as entries:
+            names = {e.name for e in entries if e.is_file() and matches(e.name, self.patterns)}
+        with self._lock:
+            self._touched.update(names - self._known)
+        self._last_scan = time.monotonic()
+
+    def poll(self) -> list[Path]:
+        """Verifica os candidatos e devolve os que ficaram completos desde a última chamada."""
+        interval = FULL_RESCAN_SECONDS if self.uses_events else self.poll_interval
+        if time.monotonic() - self._last_scan >= interval:
+            self._scan()
+        with self._lock:
+            touched, self._touched = self._touched, set()
+        now = time.monotonic()
+        for name in touched - self._known:
+            self._candidates.setdefault(name, None)
+
+        completed = []
+        for name, previous in list(self._candidates.items()):
+            try:
+                st = os.stat(self.folder / name)
+            except FileNotFoundError:
+                del self._candidates[name]
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if previous is None or previous[:2] != signature:
+                self._candidates[name] = (*signature, now)
+            elif st.st_size > 0 and now - previous[2] >= self.settle_seconds:
+                del self._candidates[name]
+                self._known.add(name)
+                completed.append(self.folder / name)
+        return sorted(completed)
+
+    def wait(self, timeout: float) -> list[Path]:
+        """Como `poll`, mas espera até `timeout` segundos por pelo menos um ficheiro completo."""
+        deadline = time.monotonic() + timeout
+        while True:
+            completed = self.poll()
+            remaining = deadline - time.monotonic()
+            if completed or remaining <= 0:
+                return completed
+            time.sleep(min(remaining, 0.5, self.poll_interval))
+
+    def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+
+if Observer is not None:
+    class _Handler(FileSystemEventHandler):
+        def __init__(self, watcher: FolderWatcher):
+            self.watcher = watcher
+
+        def on_created(self, event):
+            if not event.is_directory:
+                self.watcher._touch(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                self.watcher._touch(event.src_path)
+
+        def on_moved(self, event):
+            if not event.is_directory:
+                self.watcher._touch(event.dest_path)